@@ -1,10 +1,19 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import calplot
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Date, select, func
 from datetime import date, datetime, timedelta
-import io
+from coffee_tracker import db
+from coffee_tracker.db import consumption, varieties, refresh_rollup
+from coffee_tracker.editing import diff_entries, apply_changes
+from coffee_tracker.importer import import_varieties, import_consumption
+from coffee_tracker import changelog, decay, precompute, profiling, retention, snapshot, sync, trends, writebehind
+from coffee_tracker.export import FORMATS as EXPORT_FORMATS, available_formats, export_consumption, export_varieties
+from coffee_tracker.stats import (
+    TIMEFRAMES, HIGH_CAFFEINE_MG, RESOLUTIONS, MAX_BARS, compute_stats, in_timeframe, auto_resolution
+)
 
 # Seiten-Konfiguration - MUST BE FIRST
 st.set_page_config(
@@ -13,10 +22,18 @@ st.set_page_config(
     page_icon="☕"
 )
 
+# Laufzeitmessung pro Abschnitt (Sidebar "Wartung" oder COFFEE_PROFILE=1)
+profiling.start(profiling.enabled_by_env() or st.session_state.get('show_diagnostics', False))
+profiling.mark("Sidebar")
+
 # Initialize session state for quick buttons
 if 'quick_buttons' not in st.session_state:
     st.session_state.quick_buttons = []
 
+# Kennung dieser Session für ihre noch nicht gespeicherten Quick Entries
+if 'session_token' not in st.session_state:
+    st.session_state.session_token = uuid.uuid4().hex
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -95,40 +112,203 @@ show_heatmap = st.sidebar.checkbox("🗓️ Kalender-Heatmap anzeigen", value=Tr
 show_caffeine = st.sidebar.checkbox("⚡ Koffein-Tracking anzeigen", value=True)
 show_import = st.sidebar.checkbox("📁 Import/Export anzeigen", value=True)
 
-# Datenbank-Setup
-engine = create_engine('sqlite:///coffee.db', echo=False)
-metadata = MetaData()
+# Datenbank-Setup (Schema, Migrationen und Rollup-Befüllung einmal pro Prozess).
+# WAL-Modus: geschrieben wird über eine Verbindung (engine), gelesen über einen eigenen Pool.
+@st.cache_resource
+def get_engine():
+    engine = db.create_db_engine('sqlite:///coffee.db')
+    profiling.instrument(db.reader(engine))
+    return profiling.instrument(engine)
 
-consumption = Table(
-    'consumption', metadata,
-    Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('date', Date, nullable=False),
-    Column('cups', Integer, nullable=False),
-    Column('variety_id', Integer, nullable=False),
-)
-varieties = Table(
-    'varieties', metadata,
-    Column('id', Integer, primary_key=True, autoincrement=True),
-    Column('name', String, unique=True, nullable=False),
-    Column('caffeine_mg', Integer, default=0),
-)
-metadata.create_all(engine)
+engine = get_engine()
+read_engine = db.reader(engine)
 
-# Check if caffeine_mg column exists, if not add it
-try:
-    with engine.begin() as conn:
-        result = conn.execute("PRAGMA table_info(varieties)")
-        columns = [row[1] for row in result]
-        if 'caffeine_mg' not in columns:
-            conn.execute("ALTER TABLE varieties ADD COLUMN caffeine_mg INTEGER DEFAULT 0")
-            st.info("🔄 Datenbank wurde um Koffein-Tracking erweitert!")
-except:
-    pass
+# Gecachte Datenzugriffe - Schreibpfade leeren nur die betroffenen Caches
+@st.cache_data(show_spinner=False)
+def load_varieties():
+    frame = db.read_varieties(read_engine)
+    profiling.fetched(len(frame))
+    return frame
+
+@st.cache_data(show_spinner=False)
+def load_entries_page(limit, after, date_from, date_to, variety):
+    page, has_next = db.read_entries_page(read_engine, limit, after, date_from, date_to, variety)
+    profiling.fetched(len(page) + has_next)
+    return page, has_next
+
+@st.cache_data(show_spinner=False)
+def load_header_metrics(today):
+    profiling.fetched(1)
+    return db.read_header_metrics(read_engine, today)
+
+@st.cache_data(show_spinner=False)
+def load_has_entries():
+    return db.has_entries(read_engine)
+
+@st.cache_data(show_spinner=False)
+def load_rollup():
+    frame = db.read_rollup(read_engine)
+    profiling.fetched(len(frame))
+    return frame
+
+@st.cache_data(show_spinner=False)
+def load_doses():
+    doses = decay.read_doses(read_engine)
+    profiling.fetched(len(doses))
+    return doses
+
+# Datenversion: wird bei jedem Schreibzugriff auf Einträge erhöht. Erhöht wird aus dem
+# Skript, aus writebehind (on_commit) und aus dem Sync-Thread, daher unter einer Sperre.
+@st.cache_resource
+def get_data_version():
+    return {'value': 0, 'lock': threading.Lock()}
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def load_stats(timeframe, today, data_version, use_snapshot=False):
+    frame = snapshot.load(read_engine, load_varieties()) if use_snapshot else None
+    if frame is None:
+        frame = load_rollup()
+    return compute_stats(frame, timeframe, today)
+
+def invalidate_consumption(rows_changed=False):
+    # rows_changed: bestehende Einträge wurden geändert oder gelöscht, nicht nur neue angelegt
+    load_entries_page.clear()
+    load_header_metrics.clear()
+    load_has_entries.clear()
+    load_rollup.clear()
+    load_doses.clear()
+    if rows_changed:
+        # Neue Einträge rechnet trends.summary() selbst ein, Änderungen brauchen einen Neuaufbau
+        trends.reset(read_engine)
+    if snapshot.available() and snapshot.exists(read_engine):
+        if rows_changed:
+            snapshot.rebuild(read_engine)
+        else:
+            snapshot.append(read_engine)
+    new_data_version()
+
+def new_data_version():
+    version = get_data_version()
+    with version['lock']:
+        version['value'] += 1
+        value = version['value']
+    warm_stats(value)
+
+# Statistiken und Diagramme werden im Hintergrund berechnet (precompute), sobald sich die Daten
+# ändern. Schlüssel ist die Ansicht: (Zeitraum, Tag, Datenversion, Snapshot).
+FIGURES = {
+    'pie': 'pie',
+    'cups': 'cups_series',
+    'caffeine': 'caffeine_series',
+}
+RECENT_VIEWS = 2
+
+@st.cache_resource
+def get_recent_views():
+    # Zuletzt angezeigte (Zeitraum, Snapshot)-Kombinationen aller Sessions -> Diagramme der
+    # dabei eingeschalteten Abschnitte
+    return OrderedDict()
+
+def render_figure(kind, timeframe, today, data_version, use_snapshot):
+    from coffee_tracker.figures import pie_image, heatmap_image
+    series = load_stats(timeframe, today, data_version, use_snapshot)[FIGURES[kind]]
+    if series.empty or series.sum() == 0:
+        return None
+    if kind == 'pie':
+        return pie_image(series)
+    if kind == 'cups':
+        return heatmap_image(series, "☕ Kaffeekonsum-Heatmap", cmap='YlOrBr')
+    return heatmap_image(series, "⚡ Koffeinkonsum-Heatmap (mg)", cmap='Reds')
+
+def stats_job(view, kinds, speculative=False):
+    if not speculative:
+        views = get_recent_views()
+        views[(view[0], view[3])] = kinds
+        views.move_to_end((view[0], view[3]))
+        while len(views) > RECENT_VIEWS:
+            views.popitem(last=False)
+    return precompute.submit(('stats',) + view, load_stats, *view, queue='stats', speculative=speculative)
+
+def figure_job(kind, view, speculative=False):
+    return precompute.submit(
+        (kind,) + view, render_figure, kind, *view, queue='figures', speculative=speculative
+    )
+
+def warm_stats(data_version):
+    # Nach einem Schreibzugriff die zuletzt angezeigten Ansichten schon vorab berechnen, nur mit
+    # den Diagrammen, die dort zu sehen waren. Noch wartende Vorberechnungen älterer
+    # Datenversionen sind überholt und werden verworfen.
+    precompute.discard(lambda key: key[3] < data_version)
+    today = date.today()
+    for (timeframe, use_snapshot), kinds in list(get_recent_views().items()):
+        view = (timeframe, today, data_version, use_snapshot)
+        stats_job(view, kinds, speculative=True)
+        for kind in kinds:
+            figure_job(kind, view, speculative=True)
+
+def trend_chart(trend, metric, label, color):
+    # Balken je Tag, darüber rollierendes Mittel und Schwelle; auffällige Tage in Rot
+    st.vega_lite_chart(trend, {
+        'encoding': {'x': {'field': 'date', 'type': 'temporal', 'title': 'Datum'}},
+        'layer': [
+            {
+                'mark': 'bar',
+                'encoding': {
+                    'y': {'field': metric, 'type': 'quantitative', 'title': label},
+                    'color': {'condition': {'test': f"datum.{metric}_anomaly", 'value': '#d32f2f'}, 'value': color},
+                    'tooltip': [
+                        {'field': 'date', 'type': 'temporal', 'title': 'Datum'},
+                        {'field': metric, 'type': 'quantitative', 'title': label},
+                        {'field': f'{metric}_mean', 'type': 'quantitative', 'title': 'Ø', 'format': '.1f'},
+                    ],
+                },
+            },
+            {
+                'mark': {'type': 'line', 'color': '#333333'},
+                'encoding': {'y': {'field': f'{metric}_mean', 'type': 'quantitative'}},
+            },
+            {
+                'mark': {'type': 'line', 'color': '#999999', 'strokeDash': [4, 4]},
+                'encoding': {'y': {'field': f'{metric}_upper', 'type': 'quantitative'}},
+            },
+        ],
+    })
+
+def show_figure(kind, view, pending):
+    # Fertige Bilder sofort zeigen, sonst einen Platzhalter, der am Ende des Fragments gefüllt wird
+    future = figure_job(kind, view)
+    slot = st.empty()
+    if future.done():
+        slot.image(future.result(), use_container_width=True)
+    else:
+        slot.info("⏳ Diagramm wird berechnet...")
+        pending.append((future, lambda image: slot.image(image, use_container_width=True)))
+
+# Quick Entries werden im Hintergrund gesammelt und gebündelt in einer Transaktion gespeichert
+@st.cache_resource
+def get_writer():
+    return writebehind.start(engine, on_commit=lambda dates: invalidate_consumption())
+
+get_writer()
+
+# Delta-Sync mit einem Server, nur wenn COFFEE_SYNC_URL gesetzt ist (siehe coffee_tracker/sync.py)
+def on_sync_pull():
+    load_varieties.clear()
+    invalidate_consumption(rows_changed=True)
+
+@st.cache_resource
+def get_sync():
+    url = os.environ.get(sync.ENV_URL)
+    if not url:
+        return None
+    return sync.start(engine, url, os.environ.get(sync.ENV_TOKEN), on_pull=on_sync_pull)
+
+get_sync()
 
 # Sortenverwaltung (optional)
 if show_varieties:
     with st.sidebar.expander("🌱 Sorten verwalten", expanded=False):
-        df_var = pd.read_sql(select(varieties), engine)
+        df_var = load_varieties()
         
         st.markdown("**🆕 Neue Sorte hinzufügen:**")
         col1, col2 = st.columns(2)
@@ -139,7 +319,9 @@ if show_varieties:
         
         if st.button("➕ Hinzufügen", key='add_var') and new_var:
             with engine.begin() as conn:
-                conn.execute(varieties.insert().values(name=new_var, caffeine_mg=new_caffeine))
+                result = conn.execute(varieties.insert().values(name=new_var, caffeine_mg=new_caffeine))
+                changelog.record(conn, 'varieties', result.inserted_primary_key)
+            load_varieties.clear()
             st.success(f"✅ Sorte '{new_var}' mit {new_caffeine}mg Koffein hinzugefügt")
             st.rerun()
         
@@ -159,6 +341,11 @@ if show_varieties:
                                 .where(varieties.c.id == row['id'])
                                 .values(caffeine_mg=new_caff)
                             )
+                            changelog.record(conn, 'varieties', [row['id']])
+                            refresh_rollup(conn, variety_ids=[row['id']])
+                        load_varieties.clear()
+                        trends.reset(read_engine)
+                        invalidate_consumption()
                         st.success("✅ Aktualisiert!")
                         st.rerun()
         
@@ -166,15 +353,21 @@ if show_varieties:
             to_delete = st.multiselect("🗑️ Sorten löschen", df_var['name'])
             if st.button("❌ Löschen", key='del_var') and to_delete:
                 with engine.begin() as conn:
+                    deleted_ids = df_var[df_var['name'].isin(to_delete)]['id']
+                    changelog.record(conn, 'varieties', deleted_ids, op='delete')
                     for name in to_delete:
                         conn.execute(varieties.delete().where(varieties.c.name == name))
+                    refresh_rollup(conn, variety_ids=deleted_ids)
+                load_varieties.clear()
+                trends.reset(read_engine)
+                invalidate_consumption()
                 st.success(f"🗑️ Gelöscht: {', '.join(to_delete)}")
                 st.rerun()
 
 # Quick Entry Settings (optional)
 if show_quick_settings:
     with st.sidebar.expander("⚡ Quick-Entry Buttons konfigurieren", expanded=False):
-        df_var = pd.read_sql(select(varieties), engine)
+        df_var = load_varieties()
         
         if not df_var.empty:
             st.markdown("**⚡ Wähle Sorten für Quick-Entry Buttons:**")
@@ -206,58 +399,204 @@ if show_quick_settings:
         else:
             st.warning("⚠️ Bitte erst Sorten hinzufügen, um Quick Buttons zu konfigurieren!")
 
+# Wartung
+with st.sidebar.expander("🛠️ Wartung", expanded=False):
+    if st.button("🔄 Tages-Rollup neu aufbauen", key='rebuild_rollup', help="Berechnet die Tages-Aggregate aus allen Einträgen neu"):
+        with engine.begin() as conn:
+            refresh_rollup(conn)
+        trends.reset(read_engine)
+        invalidate_consumption()
+        st.success("✅ Tages-Rollup neu aufgebaut!")
+    
+    keep_days = st.number_input(
+        "🗜️ Einzeleinträge behalten (Tage)", min_value=retention.MIN_RETENTION_DAYS,
+        value=retention.RETENTION_DAYS, step=30, key='retention_days',
+        help="Ältere Einträge werden zu Tagessummen je Sorte zusammengefasst; Statistiken, Heatmaps und Export bleiben vollständig"
+    )
+    if st.button("🗜️ Archivieren & komprimieren", key='apply_retention'):
+        with st.spinner("🗜️ Archiviere und komprimiere..."):
+            result = retention.apply_retention(engine, keep_days)
+        invalidate_consumption(rows_changed=True)
+        st.success(
+            f"✅ {result['archived']} Einträge vor dem {result['cutoff']:%d.%m.%Y} archiviert "
+            f"(im Editor nicht mehr einzeln bearbeitbar). "
+            f"Datenbank: {result['bytes_before'] / 1e6:.1f} MB → {result['bytes_after'] / 1e6:.1f} MB"
+        )
+    
+    if get_sync() is not None:
+        with read_engine.connect() as conn:
+            pending_changes = changelog.pending(conn)
+        sync_status = sync.status(engine) or {}
+        if sync_status.get('last_error'):
+            st.caption(f"🔁 Sync fehlgeschlagen: {sync_status['last_error']} ({pending_changes} Änderungen ausstehend)")
+        elif sync_status.get('last_sync'):
+            st.caption(f"🔁 Letzter Sync {sync_status['last_sync']:%H:%M:%S}, {pending_changes} Änderungen ausstehend")
+        else:
+            st.caption(f"🔁 Sync läuft, {pending_changes} Änderungen ausstehend")
+        if st.button("🔁 Jetzt synchronisieren", key='sync_now'):
+            sync.trigger(engine)
+            st.success("✅ Sync angestoßen - Änderungen anderer Geräte erscheinen beim nächsten Laden")
+    
+    if snapshot.available():
+        use_snapshot = st.checkbox(
+            "🧊 Arrow-Snapshot für Analysen", value=False, key="use_snapshot",
+            help="Statistiken aus einer spaltenorientierten Kopie der Einträge laden (SQLite bleibt die Datenquelle)"
+        )
+        if use_snapshot and not snapshot.exists(read_engine):
+            with st.spinner("🧊 Erstelle Snapshot..."):
+                snapshot.rebuild(read_engine)
+        if st.button("🧊 Snapshot neu aufbauen", key='rebuild_snapshot'):
+            snapshot.rebuild(read_engine)
+            new_data_version()
+            st.success("✅ Snapshot neu aufgebaut!")
+    else:
+        use_snapshot = False
+    
+    # Wird am Ende des Skripts mit dem Speicherbedarf dieser Session gefüllt
+    memory_slot = st.empty()
+    
+    st.checkbox(
+        "🩺 Diagnose anzeigen", value=False, key="show_diagnostics",
+        help="Misst Laufzeit, SQL-Abfragen und gelesene Zeilen pro Abschnitt (ab dem nächsten Lauf)"
+    )
+    diagnostics_slot = st.empty()
+
+# Speicherbedarf der in diesem Lauf geladenen Frames
+session_memory = {}
+
 # App-Header
 st.markdown('<h1 class="main-header">☕ Kaffeekonsum-Tracker</h1>', unsafe_allow_html=True)
 
-# Daten laden
-df = pd.read_sql(
-    """
-    SELECT c.id, c.date, c.cups, v.name AS variety, v.caffeine_mg,
-           (c.cups * v.caffeine_mg) AS total_caffeine
-      FROM consumption c
-      JOIN varieties v ON c.variety_id = v.id
-    """,
-    engine, parse_dates=['date']
-)
+# Die Abschnitte sind Fragmente: Interaktionen darin und Schreibzugriffe laufen nur
+# die betroffenen Abschnitte neu statt der ganzen Seite (Keys für st.rerun)
+def has_entries():
+    return load_has_entries()
+
+def log_entry(day, cups, variety_id, message, consumed_at=None):
+    # Callback des Formulars
+    with engine.begin() as conn:
+        result = conn.execute(
+            consumption.insert().values(
+                date=day,
+                cups=cups,
+                variety_id=variety_id,
+                consumed_at=consumed_at
+            )
+        )
+        changelog.record(conn, 'consumption', result.inserted_primary_key)
+        refresh_rollup(conn, dates=[day])
+    invalidate_consumption()
+    st.session_state.entry_message = message
+    rerun_after_entry(day)
+
+def log_quick_cup(variety_id, variety_name, caffeine):
+    # Write-behind: kehrt sofort zurück, der Worker speichert gebündelt im Hintergrund
+    today = date.today()
+    writebehind.submit(
+        engine, st.session_state.session_token, today, 1, variety_id, caffeine,
+        consumed_at=datetime.now().replace(microsecond=0)
+    )
+    st.session_state.entry_message = f"✅ 1 Tasse {variety_name} für heute hinzugefügt! (+{caffeine}mg Koffein)"
+    rerun_after_entry(today)
+
+def rerun_after_entry(day):
+    # Statistiken nur neu zeichnen, wenn der Tag im gewählten Zeitraum liegt
+    targets = ["header", "entry", "editor"]
+    if in_timeframe(day, st.session_state.get('timeframe', TIMEFRAMES[0]), date.today()):
+        targets.append("stats")
+    st.rerun(targets)
+
+def save_entry():
+    df_var = load_varieties()
+    selected = df_var[df_var['name'] == st.session_state.entry_variety].iloc[0]
+    cups = st.session_state.entry_cups
+    day = st.session_state.entry_date
+    clock = st.session_state.get('entry_time')
+    log_entry(
+        day, cups, int(selected['id']),
+        f"✅ Eintrag erfolgreich gespeichert! (+{cups * int(selected['caffeine_mg'])}mg Koffein)",
+        consumed_at=datetime.combine(day, clock) if clock is not None else None
+    )
+
+# Deltas der Kennzahlen gegenüber den letzten Wochen (coffee_tracker.trends)
+def baseline_delta(trend, metric, value, fmt):
+    if trend is None or trend[metric]['days'] < trends.MIN_BASELINE_DAYS:
+        return None
+    return f"{value - trend[metric]['mean']:{fmt}} ggü. Ø {trends.WINDOW_DAYS} Tage"
+
+def week_delta(header, metric):
+    # Gleiche Grenzen wie die Wochenkachel: acht Tage gegenüber den acht Tagen davor
+    change = trends.week_change(header[f'week_{metric}'], header[f'prev_week_{metric}'])
+    return f"{change:+.0f}% ggü. Vorwoche" if change is not None else None
+
+def unusual_today(trend, today_cups, today_caffeine):
+    # Gesamt und je Sorte: heute weit über dem Mittel der letzten Wochen
+    notes = []
+    total = trend.get(trends.TOTAL)
+    if total is not None:
+        # Mit den angezeigten Werten, die noch nicht gespeicherte Quick Entries enthalten
+        caffeine, cups = total['caffeine'], total['cups']
+        if trends.is_anomaly('caffeine', today_caffeine, caffeine['mean'], caffeine['std'], caffeine['days']):
+            notes.append(f"insgesamt {today_caffeine}mg Koffein (sonst Ø {caffeine['mean']:.0f}mg)")
+        elif trends.is_anomaly('cups', today_cups, cups['mean'], cups['std'], cups['days']):
+            notes.append(f"insgesamt {today_cups} Tassen (sonst Ø {cups['mean']:.1f})")
+    names = load_varieties().set_index('id')['name']
+    for key, series in trend.items():
+        if key != trends.TOTAL and key in names.index and series['cups']['anomaly']:
+            notes.append(f"{names[key]} {series['cups']['today']} Tassen (sonst Ø {series['cups']['mean']:.1f})")
+    return notes
 
 # Quick Stats Header mit Koffein
-if not df.empty:
+@st.fragment(key="header")
+def header_section():
+    # Kennzahlen laden - der Editor lädt nur noch die sichtbare Seite
+    profiling.mark("Daten laden")
+    # Noch nicht gespeicherte Quick Entries dieser Session sofort mitzählen
     today = date.today()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    total_cups = df['cups'].sum()
-    total_caffeine = df['total_caffeine'].sum()
-    
-    today_data = df[df['date'] == pd.to_datetime(today)]
-    today_cups = today_data['cups'].sum()
-    today_caffeine = today_data['total_caffeine'].sum()
-    
-    week_data = df[df['date'] >= pd.to_datetime(week_ago)]
-    week_cups = week_data['cups'].sum()
-    week_caffeine = week_data['total_caffeine'].sum()
-    
-    month_data = df[df['date'] >= pd.to_datetime(month_ago)]
-    month_cups = month_data['cups'].sum()
-    month_caffeine = month_data['total_caffeine'].sum()
-    
+    header, pending = writebehind.read_with_pending(
+        engine, st.session_state.session_token, lambda: load_header_metrics(today)
+    )
+    header = writebehind.with_pending(header, pending, today)
+
+    profiling.mark("Quick Stats")
+    if header['total_cups'] == 0:
+        return
+
+    today_cups = header['today_cups']
+    today_caffeine = header['today_caffeine']
+    week_cups = header['week_cups']
+    week_caffeine = header['week_caffeine']
+    month_cups = header['month_cups']
+    total_caffeine = header['total_caffeine']
+
+    # Rollierende Vergleichswerte; neue Einträge kommen seit dem letzten Aufruf in O(1) hinzu
+    trend = trends.summary(read_engine, today)
+    unusual = unusual_today(trend, today_cups, today_caffeine)
+    total_trend = trend.get(trends.TOTAL)
+
     col1, col2, col3, col4, col5, col6 = st.columns(6)
     with col1:
-        st.metric("☕ Heute", f"{today_cups} Tassen", delta=None)
+        st.metric(
+            "☕ Heute", f"{today_cups} Tassen", delta=baseline_delta(total_trend, 'cups', today_cups, '+.1f'),
+            delta_color="inverse" if unusual else "off"
+        )
     with col2:
-        caffeine_color = "normal"
-        if today_caffeine > 400:
+        caffeine_color = "off"
+        if today_caffeine > 400 or unusual:
             caffeine_color = "inverse"
-        st.metric("⚡ Koffein heute", f"{today_caffeine}mg", delta=None, delta_color=caffeine_color)
+        st.metric(
+            "⚡ Koffein heute", f"{today_caffeine}mg",
+            delta=baseline_delta(total_trend, 'caffeine', today_caffeine, '+.0f'), delta_color=caffeine_color
+        )
     with col3:
-        st.metric("📅 Diese Woche", f"{week_cups} Tassen", delta=None)
+        st.metric("📅 Diese Woche", f"{week_cups} Tassen", delta=week_delta(header, 'cups'), delta_color="off")
     with col4:
-        st.metric("⚡ Woche Koffein", f"{week_caffeine}mg", delta=None)
+        st.metric("⚡ Woche Koffein", f"{week_caffeine}mg", delta=week_delta(header, 'caffeine'), delta_color="off")
     with col5:
         st.metric("📊 Monat Tassen", f"{month_cups}", delta=None)
     with col6:
         st.metric("🎯 Gesamt Koffein", f"{total_caffeine/1000:.1f}g", delta=None)
-    
+
     # Koffein-Warnung
     if today_caffeine > 400:
         st.markdown(
@@ -273,362 +612,535 @@ if not df.empty:
             'Näherst dich der empfohlenen Tageshöchstmenge von 400mg.</div>',
             unsafe_allow_html=True
         )
-    
+    if unusual:
+        st.markdown(
+            '<div class="caffeine-warning">📈 <strong>Ungewöhnlich viel heute:</strong> '
+            f'{", ".join(unusual)}.</div>',
+            unsafe_allow_html=True
+        )
+
     st.markdown("---")
 
 # Neuer Eintrag in schönerer Box
-st.markdown('<div class="section-header">➕ Neuen Eintrag hinzufügen</div>', unsafe_allow_html=True)
+@st.fragment(key="entry")
+def entry_section():
+    profiling.mark("Quick Buttons")
+    st.markdown('<div class="section-header">➕ Neuen Eintrag hinzufügen</div>', unsafe_allow_html=True)
 
-# Quick Entry Buttons (always visible if configured)
-if 'quick_buttons' in st.session_state and st.session_state.quick_buttons:
-    df_var = pd.read_sql(select(varieties), engine)
-    if not df_var.empty:
-        st.markdown("**⚡ Quick Entry Buttons:**")
-        
-        # Create columns for quick buttons (max 4 per row)
-        quick_varieties = st.session_state.quick_buttons
-        num_buttons = len(quick_varieties)
-        
-        if num_buttons > 0:
-            # Calculate number of rows needed (max 4 buttons per row)
-            buttons_per_row = min(4, num_buttons)
-            rows = (num_buttons + buttons_per_row - 1) // buttons_per_row
-            
-            button_index = 0
-            for row in range(rows):
-                # Create columns for this row
-                remaining_buttons = min(buttons_per_row, num_buttons - button_index)
-                cols = st.columns(remaining_buttons)
-                
-                for col_idx in range(remaining_buttons):
-                    if button_index < num_buttons:
-                        variety_name = quick_varieties[button_index]
-                        variety_info = df_var[df_var['name'] == variety_name]
-                        
-                        if not variety_info.empty:
-                            variety_data = variety_info.iloc[0]
-                            caffeine = int(variety_data.get('caffeine_mg', 0))
-                            variety_id = int(variety_data['id'])
-                            
-                            with cols[col_idx]:
-                                button_key = f"quick_{variety_name}_{button_index}"
-                                if st.button(
-                                    f"☕ {variety_name}\n({caffeine}mg)", 
-                                    key=button_key,
-                                    help=f"1 Tasse {variety_name} für heute hinzufügen",
-                                    use_container_width=True
-                                ):
-                                    # Add entry for today with 1 cup of this variety
-                                    today = date.today()
-                                    with engine.begin() as conn:
-                                        conn.execute(
-                                            consumption.insert().values(
-                                                date=today,
-                                                cups=1,
-                                                variety_id=variety_id
-                                            )
-                                        )
-                                    st.success(f"✅ 1 Tasse {variety_name} für heute hinzugefügt! (+{caffeine}mg Koffein)")
-                                    st.rerun()
-                        
-                        button_index += 1
-            
-            st.markdown("---")  # Separator between quick buttons and manual entry
+    if 'entry_message' in st.session_state:
+        st.success(st.session_state.pop('entry_message'))
+    for entry in writebehind.pop_failed(engine, st.session_state.session_token):
+        st.error(f"❌ {entry['cups']} Tasse(n) vom {entry['date']:%d.%m.%Y} konnten nicht gespeichert werden.")
 
-with st.container():
-    col1, col2, col3, col4 = st.columns([2, 1, 2, 1])
-    
-    with col1:
-        entry_date = st.date_input("📅 Datum", max_value=date.today(), key="entry_date")
-    with col2:
-        entry_cups = st.number_input("☕ Anzahl Tassen", min_value=1, value=1, key="entry_cups")
-    with col3:
-        df_var = pd.read_sql(select(varieties), engine)
+    # Quick Entry Buttons (always visible if configured)
+    if 'quick_buttons' in st.session_state and st.session_state.quick_buttons:
+        df_var = load_varieties()
         if not df_var.empty:
-            choice = st.selectbox("🌱 Sorte wählen", df_var['name'], key="entry_variety")
-        else:
-            st.warning("⚠️ Bitte erst eine Sorte in der Sidebar hinzufügen!")
-            choice = None
-            
-    with col4:
-        st.write("")  # Spacer for alignment
-        submit_button = st.button("💾 Speichern", type="primary", use_container_width=True)
-    
-    # Show caffeine info when variety is selected - this updates in real-time
-    if choice and not df_var.empty:
-        selected_variety = df_var[df_var['name'] == choice].iloc[0]
-        caffeine_per_cup = int(selected_variety.get('caffeine_mg', 0))
-        total_caffeine_entry = entry_cups * caffeine_per_cup
-        
-        st.info(f"⚡ **{caffeine_per_cup}mg/Tasse** → Gesamt: **{total_caffeine_entry}mg** Koffein")
-    
-    # Handle form submission
-    if submit_button and choice:
-        vid = int(df_var[df_var['name'] == choice]['id'].iloc[0])
-        caffeine_per_cup = int(df_var[df_var['name'] == choice]['caffeine_mg'].iloc[0])
-        total_caffeine_entry = entry_cups * caffeine_per_cup
-        
-        with engine.begin() as conn:
-            conn.execute(
-                consumption.insert().values(
-                    date=entry_date,
-                    cups=entry_cups,
-                    variety_id=vid
-                )
+            st.markdown("**⚡ Quick Entry Buttons:**")
+
+            # Create columns for quick buttons (max 4 per row)
+            quick_varieties = st.session_state.quick_buttons
+            num_buttons = len(quick_varieties)
+
+            if num_buttons > 0:
+                # Calculate number of rows needed (max 4 buttons per row)
+                buttons_per_row = min(4, num_buttons)
+                rows = (num_buttons + buttons_per_row - 1) // buttons_per_row
+
+                button_index = 0
+                for row in range(rows):
+                    # Create columns for this row
+                    remaining_buttons = min(buttons_per_row, num_buttons - button_index)
+                    cols = st.columns(remaining_buttons)
+
+                    for col_idx in range(remaining_buttons):
+                        if button_index < num_buttons:
+                            variety_name = quick_varieties[button_index]
+                            variety_info = df_var[df_var['name'] == variety_name]
+
+                            if not variety_info.empty:
+                                variety_data = variety_info.iloc[0]
+                                caffeine = int(variety_data.get('caffeine_mg', 0))
+                                variety_id = int(variety_data['id'])
+
+                                with cols[col_idx]:
+                                    button_key = f"quick_{variety_name}_{button_index}"
+                                    # Add entry for today with 1 cup of this variety
+                                    st.button(
+                                        f"☕ {variety_name}\n({caffeine}mg)",
+                                        key=button_key,
+                                        help=f"1 Tasse {variety_name} für heute hinzufügen",
+                                        use_container_width=True,
+                                        on_click=log_quick_cup,
+                                        args=(variety_id, variety_name, caffeine)
+                                    )
+
+                            button_index += 1
+
+                st.markdown("---")  # Separator between quick buttons and manual entry
+
+    profiling.mark("Eintragsformular")
+    with st.container():
+        col1, col_time, col2, col3, col4 = st.columns([2, 1, 1, 2, 1])
+
+        with col1:
+            st.date_input("📅 Datum", max_value=date.today(), key="entry_date")
+        with col_time:
+            st.time_input(
+                "🕐 Uhrzeit", value=None, step=timedelta(minutes=15), key="entry_time",
+                help="Optional - für den geschätzten Koffeinspiegel"
+            )
+        with col2:
+            entry_cups = st.number_input("☕ Anzahl Tassen", min_value=1, value=1, key="entry_cups")
+        with col3:
+            df_var = load_varieties()
+            if not df_var.empty:
+                choice = st.selectbox("🌱 Sorte wählen", df_var['name'], key="entry_variety")
+            else:
+                st.warning("⚠️ Bitte erst eine Sorte in der Sidebar hinzufügen!")
+                choice = None
+
+        with col4:
+            st.write("")  # Spacer for alignment
+            st.button(
+                "💾 Speichern", type="primary", use_container_width=True,
+                on_click=save_entry if choice else None
             )
-        st.success(f"✅ Eintrag erfolgreich gespeichert! (+{total_caffeine_entry}mg Koffein)")
-        st.rerun()
+
+        # Show caffeine info when variety is selected - this updates in real-time
+        if choice and not df_var.empty:
+            selected_variety = df_var[df_var['name'] == choice].iloc[0]
+            caffeine_per_cup = int(selected_variety.get('caffeine_mg', 0))
+            total_caffeine_entry = entry_cups * caffeine_per_cup
+
+            st.info(f"⚡ **{caffeine_per_cup}mg/Tasse** → Gesamt: **{total_caffeine_entry}mg** Koffein")
 
 # Einträge bearbeiten & löschen (optional)
-if show_editor and not df.empty:
+@st.fragment(key="editor")
+def editor_section(show_editor):
+    profiling.mark("Editor")
+    # Eigene Quick Entries sind meist nach wenigen Millisekunden gespeichert
+    writebehind.wait(engine, st.session_state.session_token)
+    if not (show_editor and has_entries()):
+        return
+
     st.markdown('<div class="section-header">✏️ Einträge bearbeiten & löschen</div>', unsafe_allow_html=True)
-    
+
+    if 'editor_message' in st.session_state:
+        st.success(st.session_state.pop('editor_message'))
+
+    # Filter und Seitengröße - geladen, verglichen und gespeichert wird nur die sichtbare Seite
+    variety_names = load_varieties()['name'].tolist()
+    col_f1, col_f2, col_f3 = st.columns([2, 2, 1])
+    with col_f1:
+        date_range = st.date_input("📅 Zeitraum filtern", value=(), max_value=date.today(), key="editor_range")
+    with col_f2:
+        variety_filter = st.selectbox("🌱 Sorte filtern", ["Alle"] + variety_names, key="editor_variety")
+    with col_f3:
+        page_size = st.selectbox("📄 Zeilen pro Seite", [50, 100, 250, 500], key="editor_page_size")
+
+    date_from = date_range[0] if len(date_range) > 0 else None
+    date_to = date_range[1] if len(date_range) > 1 else None
+    variety = None if variety_filter == "Alle" else variety_filter
+
+    # Seitenanfänge als (date, id); bei geänderten Filtern zurück auf Seite 1
+    filters = (date_from, date_to, variety, page_size)
+    if st.session_state.get('editor_filters') != filters:
+        st.session_state.editor_filters = filters
+        st.session_state.editor_cursors = [None]
+    cursors = st.session_state.editor_cursors
+    page, has_next = load_entries_page(page_size, cursors[-1], date_from, date_to, variety)
+    session_memory['Editor-Seite'] = db.memory_bytes(page)
+
     # Display with caffeine info
-    display_df = df[['id', 'date', 'cups', 'variety', 'caffeine_mg', 'total_caffeine']].copy()
+    display_df = page[['id', 'date', 'cups', 'variety', 'caffeine_mg', 'total_caffeine']].copy()
     display_df = display_df.rename(columns={
         'caffeine_mg': 'Koffein/Tasse (mg)',
         'total_caffeine': 'Gesamt Koffein (mg)'
     })
-    
+
     edited = st.data_editor(
-        display_df, 
-        num_rows="dynamic", 
+        display_df,
+        num_rows="dynamic",
         use_container_width=True,
         column_config={
             "date": st.column_config.DateColumn("📅 Datum"),
             "cups": st.column_config.NumberColumn("☕ Tassen", min_value=1),
-            "variety": st.column_config.SelectboxColumn("🌱 Sorte"),
+            "variety": st.column_config.SelectboxColumn("🌱 Sorte", options=variety_names),
             "Koffein/Tasse (mg)": st.column_config.NumberColumn("⚡ Koffein/Tasse"),
             "Gesamt Koffein (mg)": st.column_config.NumberColumn("⚡ Gesamt Koffein")
         },
         disabled=["Koffein/Tasse (mg)", "Gesamt Koffein (mg)"]  # These are calculated fields
     )
-    
-    if st.button("💾 Änderungen übernehmen", type="primary"):
-        # Convert back to original format for database operations
-        edited_for_db = edited[['id', 'date', 'cups', 'variety']].copy()
-        orig_ids = set(df['id'])
-        new_ids = set(edited_for_db['id'])
-        removed = orig_ids - new_ids
-        with engine.begin() as conn:
-            for rid in removed:
-                conn.execute(consumption.delete().where(consumption.c.id == int(rid)))
-        merged = edited_for_db.set_index('id').combine_first(df[['id', 'date', 'cups', 'variety']].set_index('id'))
-        df_var = pd.read_sql(select(varieties), engine)
-        with engine.begin() as conn:
-            for idx, row in merged.iterrows():
-                orig = df[['id', 'date', 'cups', 'variety']].set_index('id').loc[idx]
-                if not orig.equals(row):
-                    vid = int(df_var[df_var['name'] == row['variety']]['id'].iloc[0])
-                    conn.execute(
-                        consumption.update()
-                                   .where(consumption.c.id == int(idx))
-                                   .values(
-                                       date=row['date'],
-                                       cups=int(row['cups']),
-                                       variety_id=vid
-                                   )
-                    )
-        st.success("✅ Datenbank erfolgreich aktualisiert!")
-        st.rerun()
 
-# Zeitraum & Statistik-Basis
-if show_stats and not df.empty:
-    st.markdown('<div class="section-header">📊 Statistiken & Auswertungen</div>', unsafe_allow_html=True)
-    
-    col1, col2 = st.columns([1, 3])
-    with col1:
-        timeframe = st.selectbox(
-            "🗓️ Zeitraum auswählen",
-            ["Letzte 7 Tage", "Letzte 30 Tage", "Letzte 90 Tage", "Alles"]
+    # Blättern ändert nur den Cursor-Stapel; danach läuft nur dieses Fragment neu
+    next_cursor = None
+    if has_next:
+        last = page.iloc[-1]
+        next_cursor = (last['date'].date().isoformat(), int(last['id']))
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button(
+            "◀ Zurück", key="editor_prev", disabled=len(cursors) == 1, use_container_width=True,
+            on_click=cursors.pop
         )
-    
-    today = pd.to_datetime(date.today())
-    tmp = df.copy()
-    if timeframe != "Alles":
-        days = int(timeframe.split()[1])
-        cutoff = today - pd.Timedelta(days=days-1)
-        tmp = tmp[tmp['date'] >= cutoff]
-
-    # Verbesserter Daily Chart mit Koffein
-    if not tmp.empty:
-        daily = tmp.groupby('date', as_index=False).agg({
-            'cups': 'sum',
-            'total_caffeine': 'sum'
-        }).sort_values('date')
-        
-        col_chart1, col_chart2 = st.columns(2)
-        
-        with col_chart1:
-            st.markdown("### 📈 Täglicher Kaffeekonsum")
-            st.bar_chart(
-                data=daily.rename(columns={'date':'Datum','cups':'Tassen'}), 
-                x='Datum', 
-                y='Tassen',
-                color="#8B4513"
+    with col_page:
+        st.markdown(f"<div style='text-align: center;'>Seite {len(cursors)}</div>", unsafe_allow_html=True)
+    with col_next:
+        st.button(
+            "Weiter ▶", key="editor_next", disabled=not has_next, use_container_width=True,
+            on_click=cursors.append, args=(next_cursor,)
+        )
+
+    if st.button("💾 Änderungen übernehmen", type="primary"):
+        df_var = load_varieties()
+        changes = diff_entries(page, edited, dict(zip(df_var['name'], df_var['id'])))
+        if changes['unknown_varieties']:
+            st.error(f"❌ Unbekannte Sorten: {', '.join(changes['unknown_varieties'])}")
+        if changes['incomplete']:
+            st.error(
+                "❌ Datum, Tassen und Sorte dürfen nicht leer sein (IDs: "
+                f"{', '.join(str(rid) for rid in changes['incomplete'])})"
             )
-        
-        with col_chart2:
-            st.markdown("### ⚡ Täglicher Koffeinkonsum")
-            st.bar_chart(
-                data=daily.rename(columns={'date':'Datum','total_caffeine':'Koffein (mg)'}), 
-                x='Datum', 
-                y='Koffein (mg)',
-                color="#FF6B35"
+        if not changes['unknown_varieties'] and not changes['incomplete']:
+            with engine.begin() as conn:
+                summary = apply_changes(conn, changes)
+            invalidate_consumption(rows_changed=True)
+            st.session_state.editor_message = (
+                f"✅ Datenbank erfolgreich aktualisiert! "
+                f"{summary['inserted']} neu, {summary['updated']} geändert, {summary['deleted']} gelöscht"
             )
-    else:
-        st.info("📊 Keine Daten für den ausgewählten Zeitraum vorhanden.")
+            # Änderungen können beliebige Tage betreffen - ganze Seite neu laden
+            st.rerun()
 
-    # Layout für Pie Chart und Heatmap
-    chart_col1, chart_col2 = st.columns(2)
-    
-    # Sorten-Verteilung (optional)
-    if show_pie:
-        with chart_col1:
-            st.markdown("### 🥧 Sorten-Verteilung")
-            pie = tmp.groupby('variety')['cups'].sum()
-            if not pie.empty:
-                fig1, ax1 = plt.subplots(figsize=(8, 6))
-                fig1.patch.set_facecolor('#f0f0f0')
-                
-                colors = plt.cm.Set3(range(len(pie)))
-                wedges, texts, autotexts = ax1.pie(
-                    pie, 
-                    labels=pie.index, 
-                    autopct='%1.1f%%', 
-                    startangle=90,
-                    colors=colors,
-                    shadow=True,
-                    explode=[0.05] * len(pie)
-                )
-                
-                # Styling für bessere Lesbarkeit
-                for autotext in autotexts:
-                    autotext.set_color('white')
-                    autotext.set_fontweight('bold')
-                
-                ax1.axis('equal')
-                plt.title('Verteilung nach Kaffeesorten', fontsize=14, fontweight='bold', pad=20)
-                st.pyplot(fig1, use_container_width=True)
-            else:
-                st.info("🥧 Keine Sortendaten verfügbar.")
+# Überschriften der Balkendiagramme je Auflösung
+RESOLUTION_LABELS = {
+    "Tag": "Täglicher",
+    "Woche": "Wöchentlicher",
+    "Monat": "Monatlicher",
+    "Jahr": "Jährlicher",
+}
+# Punkte der Koffeinspiegel-Kurve im Diagramm (das Modell rechnet im 15-Minuten-Raster)
+LEVEL_CHART_POINTS = 2000
 
-    # Kalender-Heatmap (optional)
-    if show_heatmap:
-        with chart_col2:
-            st.markdown("### 🗓️ Kalender-Heatmap")
-            tmp_series = tmp.groupby('date')['cups'].sum()
+# Zeitraum & Statistik-Basis, Diagramme und Koffein-Analyse (hängen alle am Zeitraum)
+@st.fragment(key="stats")
+def stats_section(show_stats, show_pie, show_heatmap, show_caffeine, use_snapshot):
+    profiling.mark("Statistiken")
+    writebehind.wait(engine, st.session_state.session_token)
+    if not has_entries():
+        return
+    # Platzhalter für Diagramme, die noch im Hintergrund gerendert werden
+    pending_figures = []
+    # Diagramme der eingeschalteten Abschnitte, nur diese berechnet warm_stats vorab
+    kinds = {
+        kind for kind, shown in (
+            ('pie', show_stats and show_pie), ('cups', show_stats and show_heatmap), ('caffeine', show_caffeine)
+        ) if shown
+    }
 
-            if tmp_series.sum() == 0:
-                st.info("🗓️ Keine Konsumdaten für die Heatmap vorhanden.")
-            else:
-                fig3, axes3 = calplot.calplot(
-                    tmp_series,
-                    how='sum',
-                    fillcolor='lightgrey',
-                    linewidth=0.5,
-                    figsize=(10, 4),
-                    cmap='YlOrBr'
-                )
-                fig3.suptitle("☕ Kaffeekonsum-Heatmap", fontsize=14, fontweight='bold')
-                st.pyplot(fig3, use_container_width=True)
+    if show_stats:
+        st.markdown('<div class="section-header">📊 Statistiken & Auswertungen</div>', unsafe_allow_html=True)
 
-# Koffein-spezifische Statistiken (optional)
-if show_caffeine and not df.empty:
-    st.markdown('<div class="section-header">⚡ Koffein-Analyse</div>', unsafe_allow_html=True)
-    
-    today = pd.to_datetime(date.today())
-    tmp = df.copy()
-    if timeframe != "Alles":
-        days = int(timeframe.split()[1])
-        cutoff = today - pd.Timedelta(days=days-1)
-        tmp = tmp[tmp['date'] >= cutoff]
-    
-    if not tmp.empty:
-        col1, col2, col3 = st.columns(3)
-        
-        avg_daily_caffeine = tmp.groupby('date')['total_caffeine'].sum().mean()
-        max_daily_caffeine = tmp.groupby('date')['total_caffeine'].sum().max()
-        high_caffeine_days = len(tmp.groupby('date')['total_caffeine'].sum()[lambda x: x > 400])
-        
+        col1, col2, col3 = st.columns([1, 1, 2])
         with col1:
-            st.metric("📊 Ø Koffein/Tag", f"{avg_daily_caffeine:.0f}mg")
+            timeframe = st.selectbox(
+                "🗓️ Zeitraum auswählen",
+                TIMEFRAMES,
+                key="timeframe"
+            )
         with col2:
-            st.metric("📈 Max Koffein/Tag", f"{max_daily_caffeine:.0f}mg")
-        with col3:
-            st.metric("⚠️ Tage >400mg", f"{high_caffeine_days}")
-        
-        # Koffein nach Sorten
-        st.markdown("### ⚡ Koffein nach Sorten")
-        caffeine_by_variety = tmp.groupby('variety').agg({
-            'total_caffeine': 'sum',
-            'cups': 'sum',
-            'caffeine_mg': 'first'
-        }).sort_values('total_caffeine', ascending=False)
-        
-        caffeine_by_variety['avg_per_cup'] = caffeine_by_variety['caffeine_mg']
-        caffeine_by_variety = caffeine_by_variety.rename(columns={
-            'total_caffeine': 'Gesamt Koffein (mg)',
-            'cups': 'Anzahl Tassen',
-            'avg_per_cup': 'Koffein/Tasse (mg)'
-        })
-        
-        st.dataframe(caffeine_by_variety, use_container_width=True)
-        
-        # Koffein-Heatmap
-        st.markdown("### 🗓️ Koffein-Heatmap")
-        caffeine_series = tmp.groupby('date')['total_caffeine'].sum()
-        
-        if caffeine_series.sum() > 0:
-            fig4, axes4 = calplot.calplot(
-                caffeine_series,
-                how='sum',
-                fillcolor='lightgrey',
-                linewidth=0.5,
-                figsize=(10, 4),
-                cmap='Reds'
+            resolution_choice = st.selectbox(
+                "📏 Auflösung",
+                ["Automatisch"] + list(RESOLUTIONS),
+                key="chart_resolution",
+                help="Automatisch: so fein, wie es eine Diagrammspalte (ca. 600px) zulässt"
             )
-            fig4.suptitle("⚡ Koffeinkonsum-Heatmap (mg)", fontsize=14, fontweight='bold')
-            st.pyplot(fig4, use_container_width=True)
+
+        view = (timeframe, date.today(), get_data_version()['value'], use_snapshot)
+        stats = stats_job(view, kinds).result()
+        session_memory['Statistiken'] = db.memory_bytes(stats)
+
+        # Verbesserter Daily Chart mit Koffein - vorberechnete Reihe je Auflösung,
+        # höchstens MAX_BARS Balken unabhängig von der Länge der Historie
+        if not stats['empty']:
+            if resolution_choice == "Automatisch":
+                resolution = auto_resolution(stats['span_days'])
+            else:
+                resolution = resolution_choice
+            daily = stats['series'][resolution]
+            if len(daily) > MAX_BARS:
+                daily = daily.iloc[-MAX_BARS:]
+                st.caption(f"📏 Nur die letzten {MAX_BARS} Balken - für den ganzen Zeitraum eine gröbere Auflösung wählen.")
+            per = RESOLUTION_LABELS[resolution]
+
+            # Tagesdiagramme mit rollierendem Mittel und markierten auffälligen Tagen
+            trend = stats['trend']
+            if resolution == "Tag" and not trend.empty:
+                trend = trend[trend['date'] >= daily['date'].iloc[0]]
+
+            col_chart1, col_chart2 = st.columns(2)
+
+            with col_chart1:
+                st.markdown(f"### 📈 {per} Kaffeekonsum")
+                if resolution == "Tag" and not trend.empty:
+                    trend_chart(trend, 'cups', 'Tassen', "#8B4513")
+                else:
+                    st.bar_chart(
+                        data=daily.rename(columns={'date':'Datum','cups':'Tassen'}),
+                        x='Datum',
+                        y='Tassen',
+                        color="#8B4513"
+                    )
+
+            with col_chart2:
+                st.markdown(f"### ⚡ {per} Koffeinkonsum")
+                if resolution == "Tag" and not trend.empty:
+                    trend_chart(trend, 'caffeine', 'Koffein (mg)', "#FF6B35")
+                else:
+                    st.bar_chart(
+                        data=daily.rename(columns={'date':'Datum','total_caffeine':'Koffein (mg)'}),
+                        x='Datum',
+                        y='Koffein (mg)',
+                        color="#FF6B35"
+                    )
+            if resolution == "Tag" and not trend.empty:
+                st.caption(
+                    f"Linie: Ø der {trends.WINDOW_DAYS} Tage davor, gestrichelt: Schwelle für "
+                    f"ungewöhnlich hohe Tage (rot, Ø + {trends.ANOMALY_Z:g} Standardabweichungen)"
+                )
+        else:
+            st.info("📊 Keine Daten für den ausgewählten Zeitraum vorhanden.")
+
+        # Layout für Pie Chart und Heatmap
+        chart_col1, chart_col2 = st.columns(2)
+
+        # Sorten-Verteilung (optional)
+        if show_pie:
+            profiling.mark("Pie")
+            with chart_col1:
+                st.markdown("### 🥧 Sorten-Verteilung")
+                pie = stats['pie']
+                if not pie.empty:
+                    show_figure('pie', view, pending_figures)
+                else:
+                    st.info("🥧 Keine Sortendaten verfügbar.")
+
+        # Kalender-Heatmap (optional)
+        if show_heatmap:
+            profiling.mark("Heatmap")
+            with chart_col2:
+                st.markdown("### 🗓️ Kalender-Heatmap")
+                tmp_series = stats['cups_series']
+
+                if tmp_series.sum() == 0:
+                    st.info("🗓️ Keine Konsumdaten für die Heatmap vorhanden.")
+                else:
+                    show_figure('cups', view, pending_figures)
+
+    # Koffein-spezifische Statistiken (optional)
+    profiling.mark("Koffein-Analyse")
+    if show_caffeine:
+        st.markdown('<div class="section-header">⚡ Koffein-Analyse</div>', unsafe_allow_html=True)
+
+        # Gleiche Kennzahlen wie im Statistik-Abschnitt, ohne erneutes Filtern und Gruppieren
+        timeframe = st.session_state.get('timeframe', TIMEFRAMES[0])
+        view = (timeframe, date.today(), get_data_version()['value'], use_snapshot)
+        stats = stats_job(view, kinds).result()
+        session_memory['Statistiken'] = db.memory_bytes(stats)
+
+        if not stats['empty']:
+            col1, col2, col3 = st.columns(3)
+
+            avg_daily_caffeine = stats['avg_daily_caffeine']
+            max_daily_caffeine = stats['max_daily_caffeine']
+            high_caffeine_days = stats['high_caffeine_days']
+
+            with col1:
+                st.metric("📊 Ø Koffein/Tag", f"{avg_daily_caffeine:.0f}mg")
+            with col2:
+                st.metric("📈 Max Koffein/Tag", f"{max_daily_caffeine:.0f}mg")
+            with col3:
+                st.metric(f"⚠️ Tage >{HIGH_CAFFEINE_MG}mg", f"{high_caffeine_days}")
+
+            # Koffein nach Sorten
+            st.markdown("### ⚡ Koffein nach Sorten")
+            caffeine_by_variety = stats['by_variety'].assign(avg_per_cup=stats['by_variety']['caffeine_mg'])
+            caffeine_by_variety = caffeine_by_variety.rename(columns={
+                'total_caffeine': 'Gesamt Koffein (mg)',
+                'cups': 'Anzahl Tassen',
+                'avg_per_cup': 'Koffein/Tasse (mg)'
+            })
+
+            st.dataframe(caffeine_by_variety, use_container_width=True)
+
+            # Koffein-Heatmap
+            st.markdown("### 🗓️ Koffein-Heatmap")
+            caffeine_series = stats['caffeine_series']
+
+            if caffeine_series.sum() > 0:
+                show_figure('caffeine', view, pending_figures)
+
+            # Geschätzter Koffeinspiegel aus allen Dosen mit Halbwertszeit-Modell
+            st.markdown("### 🩸 Geschätzter Koffeinspiegel")
+            doses = load_doses()
+            col_half_life, col_threshold = st.columns(2)
+            with col_half_life:
+                half_life = st.number_input(
+                    "⏳ Halbwertszeit (Stunden)", min_value=1.0, max_value=12.0,
+                    value=decay.HALF_LIFE_HOURS, step=0.5, key="half_life",
+                    help="Individuell verschieden, bei Erwachsenen meist 3-7 Stunden"
+                )
+            with col_threshold:
+                threshold = st.number_input(
+                    "🌙 Schwelle (mg)", min_value=5, max_value=400,
+                    value=decay.THRESHOLD_MG, step=5, key="level_threshold"
+                )
+
+            now = datetime.now()
+            level = decay.level_at(doses, now, half_life)
+            hours = decay.hours_below(level, threshold, half_life)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("🩸 Jetzt im Körper", f"{level:.0f}mg")
+            with col2:
+                if hours == 0:
+                    st.metric(f"🌙 Unter {threshold}mg", "bereits")
+                else:
+                    below_at = now + timedelta(hours=hours)
+                    st.metric(f"🌙 Unter {threshold}mg", f"{below_at:%H:%M}", delta=f"in {hours:.1f}h", delta_color="off")
+
+            first_day = stats['series']["Tag"]['date'].iloc[0]
+            level_curve = decay.curve(doses, first_day, now, half_life)
+            st.line_chart(
+                decay.peaks(level_curve, LEVEL_CHART_POINTS).rename('Koffein (mg)'),
+                color="#FF6B35"
+            )
+            if len(level_curve) > LEVEL_CHART_POINTS:
+                st.caption("📏 Spitzenwert je Intervall - für Details einen kürzeren Zeitraum wählen.")
+
+    # Statistiken und Tabellen stehen schon; Diagramme erscheinen, sobald sie fertig sind
+    profiling.mark("Diagramme (Hintergrund)")
+    precompute.wait_all(pending_figures)
 
 # Import / Export CSV (optional)
-if show_import:
+@st.fragment(key="transfer")
+def transfer_section():
+    profiling.mark("Import/Export")
     st.markdown('<div class="section-header">📁 Import & Export</div>', unsafe_allow_html=True)
     col_imp, col_exp = st.columns(2)
-    
+
     with col_imp:
         st.markdown("#### 📥 Import")
+        # Meldungen des letzten Imports (nach dem Neuladen der Seite)
+        for kind, message in st.session_state.pop('import_messages', []):
+            getattr(st, kind)(message)
+
+        # Bereits verarbeitete Uploads dieser Session nicht bei jedem Rerun erneut prüfen
+        if 'imported_files' not in st.session_state:
+            st.session_state.imported_files = set()
+
         up1 = st.file_uploader("🌱 Varieties CSV importieren", type=['csv'])
-        if up1:
-            dfv = pd.read_csv(up1)
-            with engine.begin() as conn:
-                conn.execute(varieties.insert(), dfv.to_dict(orient='records'))
-            st.success("✅ Sorten erfolgreich importiert!")
-            
+        if up1 and up1.file_id not in st.session_state.imported_files:
+            # Auch fehlerhafte Dateien als verarbeitet merken, sonst scheitert jeder Rerun erneut
+            st.session_state.imported_files.add(up1.file_id)
+            try:
+                result = import_varieties(engine, up1, up1.name)
+            except ValueError as exc:
+                st.error(f"❌ {exc}")
+            else:
+                if result['skipped']:
+                    st.info("ℹ️ Diese Datei wurde bereits importiert.")
+                else:
+                    load_varieties.clear()
+                    # Geänderte Koffeinwerte: die Trendsummen enthalten noch die alten mg
+                    trends.reset(read_engine)
+                    invalidate_consumption()
+                    st.session_state.import_messages = [('success', f"✅ {result['rows']} Sorten erfolgreich importiert!")]
+                    # Sorten und Koffeinwerte betreffen alle Abschnitte
+                    st.rerun()
+
         up2 = st.file_uploader("☕ Consumption CSV importieren", type=['csv'])
-        if up2:
-            dfc = pd.read_csv(up2, parse_dates=['date'])
-            df_var = pd.read_sql(select(varieties), engine)
-            dfc = dfc.merge(df_var, how='left', left_on='variety', right_on='name')
-            to_ins = dfc[['date','cups','id']].rename(columns={'id':'variety_id'}).to_dict(orient='records')
-            with engine.begin() as conn:
-                conn.execute(consumption.insert(), to_ins)
-            st.success("✅ Einträge erfolgreich importiert!")
-            
+        if up2 and up2.file_id not in st.session_state.imported_files:
+            st.session_state.imported_files.add(up2.file_id)
+            bar = st.progress(0.0, text="📥 Importiere Einträge...")
+            try:
+                result = import_consumption(
+                    engine, up2, up2.name,
+                    progress=lambda fraction, rows: bar.progress(fraction, text=f"📥 {rows} Einträge importiert...")
+                )
+            except ValueError as exc:
+                # Die Transaktion wurde zurückgerollt, es ist nichts gespeichert
+                bar.empty()
+                st.error(f"❌ {exc}")
+            else:
+                bar.empty()
+                if result['skipped']:
+                    st.info("ℹ️ Diese Datei wurde bereits importiert.")
+                else:
+                    if result['new_varieties']:
+                        load_varieties.clear()
+                    invalidate_consumption()
+                    messages = [('success', f"✅ {result['rows']} Einträge erfolgreich importiert!")]
+                    if result['new_varieties']:
+                        messages.append(('info', f"🌱 {result['new_varieties']} neue Sorten angelegt (0mg Koffein) - bitte in der Sortenverwaltung ergänzen."))
+                    if result['invalid']:
+                        messages.append(('warning', f"⚠️ {result['invalid']} unvollständige Zeilen übersprungen."))
+                    st.session_state.import_messages = messages
+                    st.rerun()
+
     with col_exp:
         st.markdown("#### 📤 Export")
-        all_var = pd.read_sql(select(varieties), engine)
-        buf1 = io.StringIO()
-        all_var.to_csv(buf1, index=False)
-        st.download_button("🌱 Varieties exportieren", buf1.getvalue(), "varieties.csv", "text/csv")
-        
-        all_cons = pd.read_sql(
-            "SELECT c.*, v.name AS variety FROM consumption c JOIN varieties v ON c.variety_id=v.id",
-            engine, parse_dates=['date']
+        # Exporte werden erst beim Klick erzeugt und blockweise aus der Datenbank geschrieben
+        st.download_button(
+            "🌱 Varieties exportieren", lambda: export_varieties(read_engine), "varieties.csv", "text/csv",
+            on_click="ignore"
         )
-        buf2 = io.StringIO()
-        all_cons.to_csv(buf2, index=False)
-        st.download_button("☕ Consumption exportieren", buf2.getvalue(), "consumption.csv", "text/csv")
+
+        export_format = st.selectbox("📄 Format", available_formats(), key="export_format")
+        export_range = st.date_input("📅 Zeitraum (optional)", value=(), max_value=date.today(), key="export_range")
+        export_from = export_range[0] if len(export_range) > 0 else None
+        export_to = export_range[1] if len(export_range) > 1 else None
+        mime, extension = EXPORT_FORMATS[export_format]
+        st.download_button(
+            "☕ Consumption exportieren",
+            lambda: export_consumption(read_engine, export_format, export_from, export_to),
+            f"consumption{extension}", mime,
+            on_click="ignore"
+        )
+
+# Fragmente immer aufrufen, damit sie für gezielte Reruns registriert sind
+header_section()
+entry_section()
+editor_section(show_editor)
+stats_section(show_stats, show_pie, show_heatmap, show_caffeine, use_snapshot)
+if show_import:
+    transfer_section()
+
+report = profiling.finish()
+if report is not None and st.session_state.get('show_diagnostics'):
+    with diagnostics_slot.container():
+        st.caption(
+            f"⏱️ {report['seconds'] * 1000:.0f} ms · {report['queries']} SQL-Abfragen · {report['rows']} Zeilen"
+        )
+        st.dataframe(
+            [
+                {
+                    'Abschnitt': s['section'],
+                    'ms': round(s['seconds'] * 1000, 1),
+                    'SQL ms': round(s['sql_s'] * 1000, 1),
+                    'Abfragen': s['queries'],
+                    'Zeilen': s['rows'],
+                }
+                for s in report['sections']
+            ],
+            hide_index=True, use_container_width=True
+        )
+
+memory_slot.caption(
+    f"🧠 Speicher dieser Session: {sum(session_memory.values()) / 1024:.0f} KB"
+    + "".join(f"\n- {name}: {size / 1024:.0f} KB" for name, size in session_memory.items())
+)
 
 # Footer
 st.markdown("---")
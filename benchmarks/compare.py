@@ -0,0 +1,39 @@
+import argparse
+import json
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Zwei Benchmark-Ergebnisse vergleichen")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative Verschlechterung, ab der eine Stufe markiert wird")
+    args = parser.parse_args(argv)
+
+    base, cand = load(args.baseline), load(args.candidate)
+    if base['params'] != cand['params']:
+        print(f"Achtung: unterschiedliche Parameter {base['params']} / {cand['params']}")
+
+    names = [name for name in cand['stages'] if name in base['stages']]
+    width = max((len(name) for name in names), default=0)
+    print(f"{'':<{width}}  {base['commit'] or '-':>10}  {cand['commit'] or '-':>10}")
+    regressions = 0
+    for name in names:
+        before = base['stages'][name]['median_s']
+        after = cand['stages'][name]['median_s']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  <-- langsamer'
+            regressions += 1
+        print(f"{name:<{width}}  {before * 1000:8.1f}ms  {after * 1000:8.1f}ms  {change:+7.1%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
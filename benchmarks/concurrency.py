@@ -0,0 +1,145 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_database  # noqa: E402
+from coffee_tracker import db  # noqa: E402
+from coffee_tracker.db import consumption, refresh_rollup  # noqa: E402
+
+
+def reader_loop(engine, stop, counts):
+    # Wie eine Session beim Laden der Statistiken: ganze Historie plus Kopfzahlen
+    while not stop.is_set():
+        try:
+            db.read_rollup(engine)
+            db.read_header_metrics(engine, date.today())
+            counts['reads'] += 1
+        except OperationalError:
+            counts['errors'] += 1
+
+
+def writer_loop(engine, stop, counts):
+    today = date.today()
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                conn.execute(consumption.insert().values(date=today, cups=1, variety_id=1))
+                refresh_rollup(conn, dates=[today])
+            counts['writes'] += 1
+        except OperationalError:
+            counts['errors'] += 1
+
+
+def open_engines(mode, path):
+    # Liefert (Schreib-Engine, Lese-Engine)
+    if mode == 'Standard':
+        engine = create_engine(f'sqlite:///{path}')
+        return engine, engine
+    engine = db.create_db_engine(f'sqlite:///{path}')
+    return engine, db.reader(engine)
+
+
+def close_engines(mode, engines):
+    if mode == 'Standard':
+        engines[0].dispose()
+    else:
+        db.dispose_engine(engines[0])
+
+
+def run_threads(mode, path, readers, writers, seconds):
+    # Wie Streamlit: alle Sessions als Threads eines Prozesses mit gemeinsamen Engines
+    writer, reader = engines = open_engines(mode, path)
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    threads = [threading.Thread(target=reader_loop, args=(reader, stop, counts)) for _ in range(readers)]
+    threads += [threading.Thread(target=writer_loop, args=(writer, stop, counts)) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    close_engines(mode, engines)
+    return counts
+
+
+def _process(kind, mode, path, stop, totals, lock):
+    engines = open_engines(mode, path)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    if kind == 'reader':
+        reader_loop(engines[1], stop, counts)
+    else:
+        writer_loop(engines[0], stop, counts)
+    close_engines(mode, engines)
+    with lock:
+        for key, value in counts.items():
+            totals[key] += value
+
+
+def run_processes(mode, path, readers, writers, seconds):
+    # Mehrere Server-Prozesse auf derselben Datei, ohne gemeinsamen GIL
+    manager = multiprocessing.Manager()
+    totals = manager.dict({'reads': 0, 'writes': 0, 'errors': 0})
+    lock = manager.Lock()
+    stop = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=_process, args=(kind, mode, path, stop, totals, lock))
+        for kind in ['reader'] * readers + ['writer'] * writers
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(seconds)
+    stop.set()
+    for process in processes:
+        process.join()
+    counts = dict(totals)
+    manager.shutdown()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gleichzeitige Leser und Schreiber: Standard vs. WAL-Setup")
+    parser.add_argument('--readers', type=int, default=6)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--years', type=float, default=5)
+    parser.add_argument('--processes', action='store_true', help="Leser und Schreiber als eigene Prozesse")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='coffee-concurrency-')
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        engine, rows = generate_database(path, args.years, 3.0, 8, 42)
+        db.dispose_engine(engine)
+        print(f"{rows} Einträge, {args.readers} Leser, {args.writers} Schreiber, {args.seconds:.0f}s")
+
+        # Vorher: Rollback-Journal und eine gemeinsame Engine mit Standard-Pool
+        legacy = os.path.join(workdir, 'legacy.db')
+        shutil.copy(path, legacy)
+        with sqlite3.connect(legacy) as conn:
+            conn.execute("PRAGMA journal_mode=DELETE")
+
+        run = run_processes if args.processes else run_threads
+        for mode, target in (('Standard', legacy), ('WAL', path)):
+            counts = run(mode, target, args.readers, args.writers, args.seconds)
+            print(f"{mode:<9} {counts['reads'] / args.seconds:8.1f} Lesevorgänge/s  "
+                  f"{counts['writes'] / args.seconds:8.1f} Schreibvorgänge/s  {counts['errors']} Fehler")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coffee_tracker import db  # noqa: E402
+
+VARIETY_NAMES = [
+    'Espresso', 'Americano', 'Latte', 'Cappuccino', 'Flat White', 'Mocha',
+    'Macchiato', 'Drip Coffee', 'Cold Brew', 'Cortado', 'Lungo', 'Ristretto',
+]
+
+
+def synthetic_entries(years=3, entries_per_day=3.0, varieties=8, seed=42, end=None):
+    # Poisson-verteilte Einträge pro Tag, Sorten nach Zipf-Gewichten (wenige Lieblingssorten),
+    # am Wochenende etwas weniger Kaffee
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or pd.Timestamp.today()).normalize()
+    days = pd.date_range(end=end, periods=int(years * 365), freq='D')
+    weekend = days.dayofweek >= 5
+    counts = rng.poisson(np.where(weekend, entries_per_day * 0.7, entries_per_day))
+
+    weights = 1 / np.arange(1, varieties + 1)
+    weights /= weights.sum()
+    n = int(counts.sum())
+    entries = pd.DataFrame({
+        'date': np.repeat(days.values, counts),
+        'cups': rng.choice([1, 1, 1, 2, 2, 3], size=n),
+        'variety_id': rng.choice(np.arange(1, varieties + 1), size=n, p=weights),
+    })
+    # Uhrzeit zwischen 6 und 22 Uhr, wie von den Quick Buttons erfasst
+    entries['consumed_at'] = entries['date'] + pd.to_timedelta(rng.integers(6 * 60, 22 * 60, size=n), unit='min')
+    return entries
+
+
+def synthetic_varieties(varieties=8, seed=42):
+    rng = np.random.default_rng(seed)
+    names = [
+        VARIETY_NAMES[i] if i < len(VARIETY_NAMES) else f"Sorte {i + 1}"
+        for i in range(varieties)
+    ]
+    return pd.DataFrame({
+        'id': np.arange(1, varieties + 1),
+        'name': names,
+        'caffeine_mg': rng.integers(60, 160, size=varieties),
+    })
+
+
+def generate_database(path, years=3, entries_per_day=3.0, varieties=8, seed=42):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = db.create_db_engine(f'sqlite:///{path}')
+    dfv = synthetic_varieties(varieties, seed)
+    entries = synthetic_entries(years, entries_per_day, varieties, seed)
+    with engine.begin() as conn:
+        conn.execute(db.varieties.insert(), dfv.to_dict(orient='records'))
+        conn.exec_driver_sql(
+            "INSERT INTO consumption (date, cups, variety_id, consumed_at) VALUES (?, ?, ?, ?)",
+            list(zip(
+                entries['date'].dt.strftime('%Y-%m-%d').tolist(),
+                entries['cups'].tolist(),
+                entries['variety_id'].tolist(),
+                entries['consumed_at'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist(),
+            ))
+        )
+        db.refresh_rollup(conn)
+    return engine, len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetische Kaffee-Datenbank erzeugen")
+    parser.add_argument('path')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--per-day', type=float, default=3.0, help="Einträge pro Tag (Mittelwert)")
+    parser.add_argument('--varieties', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    _, rows = generate_database(args.path, args.years, args.per_day, args.varieties, args.seed)
+    print(f"{args.path}: {rows} Einträge")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_database  # noqa: E402
+from coffee_tracker import db, writebehind  # noqa: E402
+from coffee_tracker.db import consumption, refresh_rollup  # noqa: E402
+
+
+def synchronous(engine, session, entries):
+    # Bisheriger Weg: eine Transaktion pro Klick
+    today = date.today()
+    for i in range(entries):
+        with engine.begin() as conn:
+            conn.execute(consumption.insert().values(date=today, cups=1, variety_id=i % 4 + 1))
+            refresh_rollup(conn, dates=[today])
+
+
+def write_behind(engine, session, entries):
+    today = date.today()
+    for i in range(entries):
+        writebehind.submit(engine, session, today, 1, i % 4 + 1)
+
+
+def run(engine, sessions, entries, insert):
+    threads = [
+        threading.Thread(target=insert, args=(engine, f"session-{n}", entries))
+        for n in range(sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if insert is write_behind:
+        writebehind.flush(engine)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quick Entries: synchron vs. Write-behind")
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--entries', type=int, default=200, help="Einträge pro Session")
+    parser.add_argument('--years', type=float, default=3)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='coffee-quick-')
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        generate_database(path, args.years, 3.0, 8, 42)
+        total = args.sessions * args.entries
+        for name, insert in (('synchron', synchronous), ('write-behind', write_behind)):
+            engine = db.create_db_engine(f'sqlite:///{path}')
+            if insert is write_behind:
+                writebehind.start(engine)
+            seconds = run(engine, args.sessions, args.entries, insert)
+            writebehind.stop(engine)
+            db.dispose_engine(engine)
+            print(f"{name:<13} {total} Einträge in {seconds:6.2f}s  ({total / seconds:8.0f}/s)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
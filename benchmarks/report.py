@@ -0,0 +1,48 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_database  # noqa: E402
+from coffee_tracker import db, report  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-Report: Durchsatz nach Anzahl der Prozesse")
+    parser.add_argument('--databases', type=int, default=16)
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=None, help="Standard: 1, 2, 4, ... bis CPU-Kerne")
+    args = parser.parse_args(argv)
+
+    cores = os.cpu_count() or 1
+    workers = args.workers or sorted({1, *[2 ** i for i in range(1, cores.bit_length()) if 2 ** i <= cores], cores})
+    workdir = tempfile.mkdtemp(prefix='coffee-report-')
+    try:
+        directory = os.path.join(workdir, 'teams')
+        os.makedirs(directory)
+        for n in range(args.databases):
+            engine, _ = generate_database(os.path.join(directory, f"team-{n:03d}.db"), args.years, 3.0, 8, n)
+            db.dispose_engine(engine)
+        print(f"{args.databases} Datenbanken à {args.years:g} Jahre, {cores} CPU-Kerne")
+
+        for count in workers:
+            out = os.path.join(workdir, f"out-{count}")
+            start = time.perf_counter()
+            report.build_report(directory, out, workers=count)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            result = report.build_report(directory, out, workers=count)
+            warm = time.perf_counter() - start
+            print(f"{count:3d} Prozesse  {cold:7.2f}s ({args.databases / cold:6.1f} DB/s)  "
+                  f"aus dem Cache {warm:6.2f}s ({result['cached']} Treffer)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
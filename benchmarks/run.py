@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generate import generate_database  # noqa: E402
+from coffee_tracker import db, decay, export, figures, trends  # noqa: E402
+from coffee_tracker.editing import diff_entries  # noqa: E402
+from coffee_tracker.importer import import_consumption  # noqa: E402
+from coffee_tracker.stats import TIMEFRAMES, compute_stats  # noqa: E402
+
+
+def timed(fn, repeat):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'runs': runs}, result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_core(path, repeat, workdir):
+    stages = {}
+    url = f'sqlite:///{path}'
+
+    def initial_load():
+        # Wie ein frischer Prozess: Migrationsprüfung plus Laden von Rollup und Sorten
+        engine = db.create_db_engine(url)
+        return engine, db.read_rollup(db.reader(engine)), db.read_varieties(db.reader(engine))
+
+    stages['initial_load'], (engine, rollup, dfv) = timed(initial_load, repeat)
+    # Wie in der App: Schreiben über die Engine, Lesen über ihren Lese-Pool
+    writer, engine = engine, db.reader(engine)
+    stages['header_metrics'], _ = timed(lambda: db.read_header_metrics(engine, date.today()), repeat)
+
+    stages['editor_first_page'], (page, _) = timed(lambda: db.read_entries_page(engine, 100), repeat)
+    last = page.iloc[-1]
+    deep = (pd.Timestamp(last['date']) - pd.Timedelta(days=365), int(last['id']))
+    stages['editor_deep_page'], _ = timed(lambda: db.read_entries_page(engine, 100, deep), repeat)
+    edited = page.assign(cups=page['cups'] + 1).iloc[1:]
+    variety_ids = dict(zip(dfv['name'], dfv['id']))
+    stages['editor_diff'], _ = timed(lambda: diff_entries(page, edited, variety_ids), repeat)
+
+    for timeframe in TIMEFRAMES:
+        key = 'stats_' + timeframe.lower().replace(' ', '_')
+        stages[key], _ = timed(lambda: compute_stats(rollup, timeframe, date.today()), repeat)
+    stats = compute_stats(rollup, 'Alles', date.today())
+
+    # Koffeinspiegel: Dosen laden, aktueller Wert, Kurve über die ganze Historie im 15-Minuten-Raster
+    stages['decay_doses'], doses = timed(lambda: decay.read_doses(engine), repeat)
+    stages['decay_level_now'], _ = timed(lambda: decay.level_at(doses, datetime.now()), repeat)
+    stages['decay_curve_all'], _ = timed(
+        lambda: decay.curve(doses, doses['at'].iloc[0].normalize(), datetime.now()), repeat
+    )
+
+    # Trends: Neuaufbau aus den Einträgen des Fensters, danach je Aufruf nur neue Einträge
+    def trends_build():
+        trends.reset(engine)
+        return trends.summary(engine)
+
+    stages['trends_build'], _ = timed(trends_build, repeat)
+    stages['trends_summary'], _ = timed(lambda: trends.summary(engine), repeat)
+
+    def uncached(render):
+        def run():
+            figures.clear_cache()
+            return render()
+        return run
+
+    stages['pie'], _ = timed(uncached(lambda: figures.pie_image(stats['pie'])), repeat)
+    stages['heatmap_cups'], _ = timed(uncached(
+        lambda: figures.heatmap_image(stats['cups_series'], "☕ Kaffeekonsum-Heatmap", cmap='YlOrBr')
+    ), repeat)
+    stages['heatmap_caffeine'], _ = timed(uncached(
+        lambda: figures.heatmap_image(stats['caffeine_series'], "⚡ Koffeinkonsum-Heatmap (mg)", cmap='Reds')
+    ), repeat)
+    stages['heatmap_cached'], _ = timed(
+        lambda: figures.heatmap_image(stats['caffeine_series'], "⚡ Koffeinkonsum-Heatmap (mg)", cmap='Reds'), repeat
+    )
+
+    for fmt in export.available_formats():
+        key = 'export_' + fmt.lower().replace(' ', '_').replace('(', '').replace(')', '')
+        stages[key], _ = timed(lambda: export.export_consumption(engine, fmt).close(), repeat)
+
+    # Import: Export der Datenbank in eine leere Datenbank einlesen
+    csv_path = os.path.join(workdir, 'import.csv')
+    with open(csv_path, 'wb') as f:
+        export.write_consumption(engine, f, 'CSV')
+
+    def import_into_fresh():
+        target = os.path.join(workdir, 'import.db')
+        if os.path.exists(target):
+            os.remove(target)
+        target_engine = db.create_db_engine(f'sqlite:///{target}')
+        with open(csv_path, 'rb') as f:
+            result = import_consumption(target_engine, f, 'import.csv')
+        db.dispose_engine(target_engine)
+        return result
+
+    stages['import_csv'], _ = timed(import_into_fresh, repeat)
+    db.dispose_engine(writer)
+    return stages
+
+
+def bench_apptest(path, repeat, workdir):
+    # Komplette Reruns von app.py ohne Browser über Streamlits AppTest
+    from streamlit.testing.v1 import AppTest
+
+    appdir = os.path.join(workdir, 'app')
+    os.makedirs(appdir)
+    shutil.copy(os.path.join(ROOT, 'app.py'), appdir)
+    shutil.copytree(os.path.join(ROOT, 'coffee_tracker'), os.path.join(appdir, 'coffee_tracker'))
+    shutil.copy(path, os.path.join(appdir, 'coffee.db'))
+
+    cwd = os.getcwd()
+    os.chdir(appdir)
+    try:
+        at = AppTest.from_file(os.path.join(appdir, 'app.py'), default_timeout=600)
+        start = time.perf_counter()
+        at.run()
+        cold = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        stages = {'apptest_cold': {'median_s': cold, 'min_s': cold, 'runs': [cold]}}
+        stages['apptest_rerun'], _ = timed(at.run, repeat)
+        return stages
+    finally:
+        os.chdir(cwd)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks für den Kaffeekonsum-Tracker")
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--per-day', type=float, default=3.0, help="Einträge pro Tag (Mittelwert)")
+    parser.add_argument('--varieties', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--apptest', action='store_true', help="zusätzlich komplette App-Reruns messen")
+    parser.add_argument('--output', help="JSON-Datei (Standard: benchmarks/results/<zeit>-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='coffee-bench-')
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        start = time.perf_counter()
+        _, rows = generate_database(path, args.years, args.per_day, args.varieties, args.seed)
+        generate_s = time.perf_counter() - start
+
+        stages = bench_core(path, args.repeat, workdir)
+        if args.apptest:
+            stages.update(bench_apptest(path, args.repeat, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    result = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {
+            'years': args.years, 'per_day': args.per_day, 'varieties': args.varieties,
+            'seed': args.seed, 'repeat': args.repeat, 'rows': rows,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'generate_s': generate_s,
+        'stages': stages,
+    }
+
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    width = max(len(name) for name in stages)
+    print(f"{rows} Einträge, {args.years} Jahre, {args.varieties} Sorten")
+    for name, stage in stages.items():
+        print(f"{name:<{width}}  {stage['median_s'] * 1000:10.1f} ms")
+    print(f"-> {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import sync_server  # noqa: E402
+from benchmarks.generate import generate_database  # noqa: E402
+from coffee_tracker import changelog, db, sync  # noqa: E402
+from coffee_tracker.db import consumption, refresh_rollup  # noqa: E402
+
+
+def totals(engine):
+    with db.reader(engine).connect() as conn:
+        return tuple(conn.exec_driver_sql("SELECT COUNT(*), COALESCE(SUM(cups), 0) FROM consumption").one())
+
+
+def add_entries(engine, count):
+    # Wie das Formular: einzelne Einträge mit changelog
+    today = date.today()
+    for i in range(count):
+        with engine.begin() as conn:
+            result = conn.execute(consumption.insert().values(date=today, cups=1, variety_id=i % 4 + 1))
+            changelog.record(conn, 'consumption', result.inserted_primary_key)
+            refresh_rollup(conn, dates=[today])
+
+
+def timed_sync(engine, url):
+    start = time.perf_counter()
+    result = sync.sync_once(engine, url)
+    return time.perf_counter() - start, result
+
+
+def run(workdir, years, changes, fail_rate):
+    server = sync_server.serve(fail_rate=fail_rate, seed=1)
+    url = f"http://127.0.0.1:{server.server_port}"
+    store = server.store
+    try:
+        local, _ = generate_database(os.path.join(workdir, f"local-{years}.db"), years, 3.0, 8, 42)
+        # Zweites Gerät: leere Datenbank
+        remote = db.create_db_engine(f"sqlite:///{os.path.join(workdir, f'remote-{years}.db')}")
+
+        seconds, result = timed_sync(local, url)
+        timed_sync(remote, url)
+        print(f"{years:4g} Jahre  Erstabgleich: {result['pushed']} Änderungen in {seconds:6.2f}s")
+
+        add_entries(local, changes)
+        before = store['bytes_in'] + store['bytes_out']
+        push_seconds, result = timed_sync(local, url)
+        pull_seconds, pulled = timed_sync(remote, url)
+        transferred = store['bytes_in'] + store['bytes_out'] - before
+        print(f"{'':10} {changes} neue Einträge: Push {push_seconds * 1000:7.1f} ms, "
+              f"Pull {pull_seconds * 1000:7.1f} ms, {transferred / 1024:6.1f} KiB, "
+              f"{pulled['pulled']} übernommen")
+        print(f"{'':10} lokal {totals(local)}  zweites Gerät {totals(remote)}  "
+              f"{store['failures']} von {store['requests']} Anfragen mit 503 beantwortet")
+        db.dispose_engine(local)
+        db.dispose_engine(remote)
+    finally:
+        server.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delta-Sync: Kosten nach Historie und Änderungen")
+    parser.add_argument('--years', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--changes', type=int, default=20)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Anteil der Anfragen, die mit 503 scheitern")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='coffee-sync-')
+    try:
+        for years in args.years:
+            run(workdir, years, args.changes, args.fail_rate)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lokaler Ersatz für den Sync-Endpunkt (Protokoll siehe coffee_tracker/sync.py): hält alle
+# Änderungen im Speicher, Cursor ist die Position in dieser Liste. Mit fail_rate antwortet
+# ein Teil der Anfragen mit 503, um die Wiederholungen des Clients zu prüfen.
+
+
+def new_store():
+    return {
+        'changes': [],
+        'seen': set(),
+        'lock': threading.Lock(),
+        'requests': 0,
+        'failures': 0,
+        'bytes_in': 0,
+        'bytes_out': 0,
+    }
+
+
+def make_handler(store, fail_rate=0.0, token=None, seed=None):
+    rng = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            store['bytes_out'] += len(body)
+
+        def _check(self):
+            store['requests'] += 1
+            if token and self.headers.get('Authorization') != f"Bearer {token}":
+                self._reply(401, {'error': 'unauthorized'})
+                return False
+            if rng.random() < fail_rate:
+                store['failures'] += 1
+                self._reply(503, {'error': 'unavailable'})
+                return False
+            return True
+
+        def do_POST(self):
+            if urllib.parse.urlparse(self.path).path != '/changes':
+                return self._reply(404, {'error': 'not found'})
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            store['bytes_in'] += len(body)
+            if not self._check():
+                return
+            payload = json.loads(body)
+            device = payload['device']
+            accepted = 0
+            with store['lock']:
+                for change in payload['changes']:
+                    if (device, change['seq']) in store['seen']:
+                        continue
+                    store['seen'].add((device, change['seq']))
+                    store['changes'].append(dict(change, device=device))
+                    accepted += 1
+            self._reply(200, {'accepted': accepted})
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path != '/changes':
+                return self._reply(404, {'error': 'not found'})
+            if not self._check():
+                return
+            query = urllib.parse.parse_qs(url.query)
+            after = int(query.get('after', ['0'])[0] or 0)
+            limit = int(query.get('limit', ['500'])[0])
+            device = query.get('device', [None])[0]
+            result = []
+            position = after
+            with store['lock']:
+                while position < len(store['changes']) and len(result) < limit:
+                    change = store['changes'][position]
+                    position += 1
+                    if change['device'] != device:
+                        result.append({k: change[k] for k in ('table', 'key', 'op', 'data')})
+                more = position < len(store['changes'])
+            self._reply(200, {'changes': result, 'cursor': position, 'more': more})
+
+    return Handler
+
+
+def serve(port=0, fail_rate=0.0, token=None, seed=None):
+    # Startet den Server in einem Thread; URL: f"http://127.0.0.1:{server.server_port}"
+    store = new_store()
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(store, fail_rate, token, seed))
+    server.store = store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokaler Sync-Server zum Testen")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Anteil der Anfragen, die mit 503 antworten")
+    parser.add_argument('--token', default=None)
+    args = parser.parse_args(argv)
+    server = serve(args.port, args.fail_rate, args.token)
+    print(f"Sync-Server auf http://127.0.0.1:{server.server_port} (Strg+C beendet)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
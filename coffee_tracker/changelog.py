@@ -0,0 +1,105 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+# Jeder Schreibpfad trägt seine Änderungen in derselben Transaktion ins changelog ein
+# (wie refresh_rollup), aber erst, wenn der Sync einmal eingerichtet wurde (enable()).
+# coffee_tracker.sync überträgt sie in Reihenfolge von seq und löscht bestätigte Einträge.
+# Schlüssel über Geräte hinweg: Sorten über den Namen, Einträge über sync_key bzw.
+# "<Geräte-ID>:<id>" für lokal angelegte Einträge.
+
+TABLES = {'consumption', 'varieties'}
+OPS = {'upsert', 'delete'}
+
+_SOURCES = {
+    'consumption': """
+        SELECT 'consumption', COALESCE(c.sync_key, :device || ':' || c.id), :op,
+               CASE WHEN :op = 'upsert' THEN json_object(
+                   'date', c.date, 'cups', c.cups, 'variety', v.name, 'consumed_at', c.consumed_at
+               ) END,
+               :now
+          FROM consumption c
+          LEFT JOIN varieties v ON c.variety_id = v.id
+         WHERE {where}
+         ORDER BY c.id
+    """,
+    'varieties': """
+        SELECT 'varieties', v.name, :op,
+               CASE WHEN :op = 'upsert' THEN json_object('name', v.name, 'caffeine_mg', v.caffeine_mg) END,
+               :now
+          FROM varieties v
+         WHERE {where}
+         ORDER BY v.id
+    """,
+}
+
+
+def device_id(conn):
+    # ID dieser Datenbank, None solange der Sync nie eingerichtet wurde
+    return conn.execute(text("SELECT value FROM sync_state WHERE name = 'device'")).scalar()
+
+
+def enable(conn):
+    # Richtet den Sync beim ersten Push/Pull ein: Geräte-ID anlegen und den Bestand einmal
+    # vollständig eintragen. Ohne Sync bleibt das changelog so leer und wächst nicht.
+    device = device_id(conn)
+    if device is None:
+        device = uuid.uuid4().hex
+        conn.execute(text("INSERT INTO sync_state (name, value) VALUES ('device', :value)"), {'value': device})
+        record(conn, 'varieties', after_id=0)
+        record(conn, 'consumption', after_id=0)
+    return device
+
+
+def last_id(conn, table):
+    # Höchste id vor einem Masseneinfügen; danach record(..., after_id=...) für alle neuen Zeilen
+    if table not in TABLES:
+        raise ValueError(f"Unbekannte Tabelle: {table}")
+    return conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}")).scalar()
+
+
+def record(conn, table, ids=None, op='upsert', after_id=None):
+    # Trägt die Zeilen mit den gegebenen ids (oder alle mit id > after_id) ein.
+    # Löschungen vor dem DELETE eintragen, danach ist der Schlüssel nicht mehr lesbar.
+    if table not in TABLES:
+        raise ValueError(f"Unbekannte Tabelle: {table}")
+    if op not in OPS:
+        raise ValueError(f"Unbekannte Operation: {op}")
+    device = device_id(conn)
+    if device is None:
+        return
+    alias = 'c' if table == 'consumption' else 'v'
+    params = {'device': device, 'op': op, 'now': datetime.now().isoformat(sep=' ')}
+    insert = "INSERT INTO changelog (table_name, key, op, data, changed_at) " + _SOURCES[table]
+    oldest, newest = conn.execute(text("SELECT MIN(seq), MAX(seq) FROM changelog")).one()
+    first_seq = (newest or 0) + 1
+    if after_id is not None:
+        conn.execute(text(insert.format(where=f"{alias}.id > :after_id")), dict(params, after_id=int(after_id)))
+    else:
+        ids = sorted({int(i) for i in ids})
+        for i in range(0, len(ids), 500):
+            statement = text(insert.format(where=f"{alias}.id IN :ids")).bindparams(bindparam('ids', expanding=True))
+            conn.execute(statement, dict(params, ids=ids[i:i+500]))
+    if oldest is None:
+        return
+    # Noch nicht übertragene ältere Stände derselben Zeilen sind überholt - nur der neueste zählt.
+    # Ausgehend von den neuen Zeilen über ix_changelog_key, unabhängig von der Länge des Logs.
+    conn.execute(text("""
+        DELETE FROM changelog
+         WHERE seq IN (SELECT old.seq
+                         FROM changelog new
+                         JOIN changelog old
+                           ON old.table_name = new.table_name AND old.key = new.key AND old.seq < :first_seq
+                        WHERE new.seq >= :first_seq)
+    """), {'first_seq': first_seq})
+
+
+def prune(conn, seq):
+    # Vom Server bestätigte Änderungen bis einschließlich seq entfernen
+    conn.execute(text("DELETE FROM changelog WHERE seq <= :seq"), {'seq': seq})
+
+
+def pending(conn):
+    # Anzahl noch nicht übertragener Änderungen
+    return conn.execute(text("SELECT COUNT(*) FROM changelog")).scalar()
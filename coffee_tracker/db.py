@@ -0,0 +1,389 @@
+import argparse
+import logging
+import threading
+import weakref
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine, event, make_url, MetaData, Table, Column, Index, Integer, String, Date, DateTime, select, func, text, union_all
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = 'sqlite:///coffee.db'
+
+# Speicher-Setup für mehrere gleichzeitige Sessions (nur für SQLite-Dateien).
+# Einzelne Werte lassen sich über create_db_engine(url, **storage) überschreiben.
+STORAGE_DEFAULTS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout_ms': 5000,
+    # Verbindungen der Lese-Engine; geschrieben wird über genau eine Verbindung
+    'read_pool_size': 4,
+    # Abstand der WAL-Checkpoints im Hintergrund, None schaltet sie ab
+    'checkpoint_seconds': 60,
+}
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+CHECKPOINT_MODES = {'PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'}
+# Ist das WAL nach einem passiven Checkpoint noch so groß (Seiten), wird es zurückgesetzt
+WAL_TRUNCATE_PAGES = 10_000
+
+# Schreib-Engine -> {'reader': Lese-Engine, 'stop': Event des Checkpoint-Threads}
+_storage = weakref.WeakKeyDictionary()
+
+metadata = MetaData()
+
+consumption = Table(
+    'consumption', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('date', Date, nullable=False, index=True),
+    Column('cups', Integer, nullable=False),
+    Column('variety_id', Integer, nullable=False, index=True),
+    # Uhrzeit des Konsums, falls bekannt (Quick Buttons, Formular mit Uhrzeit)
+    Column('consumed_at', DateTime, nullable=True),
+    # Schlüssel von Einträgen, die per Sync von einem anderen Gerät kamen (siehe coffee_tracker.changelog)
+    Column('sync_key', String, nullable=True, index=True),
+)
+varieties = Table(
+    'varieties', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', String, unique=True, nullable=False),
+    Column('caffeine_mg', Integer, default=0),
+)
+# Archivierte Einträge (siehe coffee_tracker.retention): Tassen je Tag und Sorte,
+# ohne Einzeleinträge und Uhrzeiten. Zählt überall mit, wo die ganze Historie gebraucht wird.
+consumption_archive = Table(
+    'consumption_archive', metadata,
+    Column('date', Date, primary_key=True),
+    Column('variety_id', Integer, primary_key=True),
+    Column('cups', Integer, nullable=False),
+)
+# Tages-Aggregate je Sorte für Diagramme, Heatmaps und Koffein-Analyse
+daily_rollup = Table(
+    'daily_rollup', metadata,
+    Column('date', Date, primary_key=True),
+    Column('variety_id', Integer, primary_key=True),
+    Column('cups', Integer, nullable=False),
+    Column('caffeine', Integer, nullable=False),
+)
+
+# Noch nicht übertragene Änderungen für den Sync, seq steigt streng monoton
+changelog = Table(
+    'changelog', metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('table_name', String, nullable=False),
+    Column('key', String, nullable=False),
+    Column('op', String, nullable=False),
+    Column('data', String),
+    Column('changed_at', DateTime, nullable=False),
+    # Ältere, noch nicht übertragene Stände derselben Zeile finden (changelog.record)
+    Index('ix_changelog_key', 'table_name', 'key'),
+    sqlite_autoincrement=True,
+)
+# Geräte-ID und Cursor des Sync
+sync_state = Table(
+    'sync_state', metadata,
+    Column('name', String, primary_key=True),
+    Column('value', String, nullable=False),
+)
+# Schlüssel archivierter Einträge anderer Geräte: spätere Änderungen daran kämen sonst als
+# neue Einträge zurück und würden neben der Tagessumme im Archiv doppelt gezählt
+archived_sync_keys = Table(
+    'archived_sync_keys', metadata,
+    Column('sync_key', String, primary_key=True),
+)
+
+# Bereits importierte CSV-Dateien, über den Inhalts-Hash erkannt
+imports = Table(
+    'imports', metadata,
+    Column('sha256', String, primary_key=True),
+    Column('kind', String, primary_key=True),
+    Column('filename', String),
+    Column('rows', Integer, nullable=False),
+    Column('imported_at', DateTime, nullable=False),
+)
+
+
+def create_db_engine(url=DEFAULT_URL, **storage):
+    # Liefert die Schreib-Engine (eine Verbindung). Lesende Zugriffe gehen über reader(engine).
+    unknown = set(storage) - set(STORAGE_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unbekannte Speicher-Optionen: {', '.join(sorted(unknown))}")
+    options = dict(STORAGE_DEFAULTS, **storage)
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        engine = create_engine(url, echo=False)
+        init_schema(engine)
+        return engine
+
+    # Ein einziger Schreiber: Schreibzugriffe warten im Pool statt auf die SQLite-Sperre
+    engine = create_engine(url, echo=False, pool_size=1, max_overflow=0)
+    _configure(engine, options, readonly=False)
+    init_schema(engine)
+    reader = create_engine(
+        url, echo=False, pool_size=options['read_pool_size'], max_overflow=options['read_pool_size']
+    )
+    _configure(reader, options, readonly=True)
+
+    state = {'reader': reader, 'stop': threading.Event()}
+    if options['checkpoint_seconds'] and options['journal_mode'].upper() == 'WAL':
+        threading.Thread(
+            target=_checkpoint_loop,
+            args=(weakref.ref(engine), options['checkpoint_seconds'], state['stop']),
+            name=f"checkpoint-{url.database}", daemon=True,
+        ).start()
+    _storage[engine] = state
+    return engine
+
+
+def _configure(engine, options, readonly):
+    journal_mode = options['journal_mode'].upper()
+    synchronous = options['synchronous'].upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unbekannter journal_mode: {options['journal_mode']}")
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unbekannter synchronous-Modus: {options['synchronous']}")
+    busy_timeout = int(options['busy_timeout_ms'])
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not readonly:
+            # Der Journal-Modus gilt für die Datei; der Schreiber setzt ihn beim ersten Verbinden
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        if readonly:
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+
+
+def reader(engine):
+    # Lese-Engine zur Schreib-Engine; ohne getrennten Pool (z.B. In-Memory) die Engine selbst
+    state = _storage.get(engine)
+    return state['reader'] if state else engine
+
+
+def dispose_engine(engine):
+    state = _storage.pop(engine, None)
+    if state:
+        state['stop'].set()
+        state['reader'].dispose()
+    engine.dispose()
+
+
+def checkpoint(engine, mode='PASSIVE'):
+    # Überträgt das WAL in die Datenbankdatei. PASSIVE wartet weder auf Leser noch Schreiber.
+    mode = mode.upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Unbekannter Checkpoint-Modus: {mode}")
+    with engine.connect() as conn:
+        busy, wal_pages, checkpointed = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one()
+    return {'busy': bool(busy), 'wal_pages': wal_pages, 'checkpointed': checkpointed}
+
+
+def _checkpoint_loop(engine_ref, interval, stop):
+    # Hält nur eine schwache Referenz, damit der Thread mit der Engine endet
+    while not stop.wait(interval):
+        engine = engine_ref()
+        if engine is None:
+            return
+        try:
+            result = checkpoint(engine)
+            if result['wal_pages'] > WAL_TRUNCATE_PAGES:
+                result = checkpoint(engine, 'TRUNCATE')
+            logger.debug("WAL-Checkpoint: %s", result)
+        except Exception as exc:
+            logger.warning("WAL-Checkpoint fehlgeschlagen: %s", exc)
+        del engine
+
+
+def init_schema(engine):
+    # Migrationen liegen in coffee_tracker.migrations, das seinerseits die Tabellen von hier importiert
+    from coffee_tracker.migrations import migrate
+    return migrate(engine)
+
+
+def refresh_rollup(conn, dates=None, variety_ids=None):
+    # Berechnet die betroffenen Rollup-Zeilen innerhalb der laufenden Transaktion neu.
+    # Ohne Filter wird das komplette Rollup neu aufgebaut.
+    if dates is not None:
+        dates = sorted({pd.Timestamp(d).date() for d in dates})
+        for i in range(0, len(dates), 500):
+            _refresh_rollup(conn, 'date', dates[i:i+500])
+    elif variety_ids is not None:
+        variety_ids = sorted({int(v) for v in variety_ids})
+        _refresh_rollup(conn, 'variety_id', variety_ids)
+    else:
+        _refresh_rollup(conn, None, None)
+
+
+def _refresh_rollup(conn, column, values):
+    # Quelle sind die Einträge plus das Archiv; der Filter greift in beiden Teilen, damit die Indizes zählen
+    delete = daily_rollup.delete()
+    parts = []
+    for table in (consumption, consumption_archive):
+        part = select(table.c.date, table.c.variety_id, table.c.cups)
+        if column is not None:
+            part = part.where(table.c[column].in_(values))
+        parts.append(part)
+    entries = union_all(*parts).subquery()
+    source = (
+        select(
+            entries.c.date,
+            entries.c.variety_id,
+            func.sum(entries.c.cups),
+            func.sum(entries.c.cups * func.coalesce(varieties.c.caffeine_mg, 0)),
+        )
+        .select_from(entries.join(varieties, entries.c.variety_id == varieties.c.id))
+        .group_by(entries.c.date, entries.c.variety_id)
+    )
+    if column is not None:
+        delete = delete.where(daily_rollup.c[column].in_(values))
+    conn.execute(delete)
+    conn.execute(daily_rollup.insert().from_select(['date', 'variety_id', 'cups', 'caffeine'], source))
+
+
+def compact_frame(frame):
+    # Kompakte Darstellung für Analysen: Sorte als Kategorie, kleinste ausreichende
+    # Integer-Typen und Datum in Sekundenauflösung (Tageswerte, keine Nanosekunden)
+    frame = frame.assign(date=pd.to_datetime(frame['date']).dt.normalize().astype('datetime64[s]'))
+    if 'variety' in frame:
+        frame['variety'] = frame['variety'].astype('category')
+    for column in ('id', 'cups', 'caffeine_mg', 'total_caffeine'):
+        if column in frame:
+            frame[column] = pd.to_numeric(frame[column].fillna(0), downcast='integer')
+    return frame
+
+
+def memory_bytes(obj):
+    # Speicherbedarf von DataFrames/Series, auch verschachtelt in dicts und tuples
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(obj, pd.DataFrame) else int(usage)
+    if isinstance(obj, dict):
+        return sum(memory_bytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(memory_bytes(value) for value in obj)
+    return 0
+
+
+def read_varieties(engine):
+    return pd.read_sql(select(varieties), engine)
+
+
+def read_entries_page(engine, limit, after=None, date_from=None, date_to=None, variety=None):
+    # Keyset-Paginierung über (date, id), neueste Einträge zuerst.
+    # after ist (date, id) der letzten Zeile der vorherigen Seite.
+    where = []
+    params = {'limit': limit + 1}
+    if after is not None:
+        where.append("(c.date < :after_date OR (c.date = :after_date AND c.id < :after_id))")
+        params['after_date'] = pd.Timestamp(after[0]).date().isoformat()
+        params['after_id'] = int(after[1])
+    if date_from is not None:
+        where.append("c.date >= :date_from")
+        params['date_from'] = date_from.isoformat()
+    if date_to is not None:
+        where.append("c.date <= :date_to")
+        params['date_to'] = date_to.isoformat()
+    if variety is not None:
+        where.append("v.name = :variety")
+        params['variety'] = variety
+    page = pd.read_sql(
+        text(f"""
+        SELECT c.id, c.date, c.cups, v.name AS variety, v.caffeine_mg,
+               (c.cups * v.caffeine_mg) AS total_caffeine
+          FROM consumption c
+          JOIN varieties v ON c.variety_id = v.id
+         {'WHERE ' + ' AND '.join(where) if where else ''}
+         ORDER BY c.date DESC, c.id DESC
+         LIMIT :limit
+        """),
+        engine, params=params, parse_dates=['date']
+    )
+    # Eine Zeile mehr als nötig laden, um zu wissen, ob es eine weitere Seite gibt
+    return page.iloc[:limit], len(page) > limit
+
+
+def has_entries(engine):
+    with engine.connect() as conn:
+        return bool(conn.execute(text("SELECT EXISTS (SELECT 1 FROM daily_rollup)")).scalar())
+
+
+def read_header_metrics(engine, today):
+    # Aus den Tagessummen: Zeiträume als Bereich über den Primärschlüssel (date, variety_id),
+    # nur die Gesamtsumme liest alle Tagessummen. Die Vorwoche umfasst wie die Woche
+    # (date >= heute - 7) acht Tage, damit der Vergleich dieselben Grenzen hat.
+    week_ago = today - timedelta(days=7)
+    prev_week_ago = week_ago - timedelta(days=8)
+    month_ago = today - timedelta(days=30)
+    with engine.connect() as conn:
+        recent = conn.execute(
+            text("""
+            SELECT COALESCE(SUM(CASE WHEN date = :today THEN cups END), 0),
+                   COALESCE(SUM(CASE WHEN date = :today THEN caffeine END), 0),
+                   COALESCE(SUM(CASE WHEN date >= :week_ago THEN cups END), 0),
+                   COALESCE(SUM(CASE WHEN date >= :week_ago THEN caffeine END), 0),
+                   COALESCE(SUM(CASE WHEN date < :week_ago AND date >= :prev_week_ago THEN cups END), 0),
+                   COALESCE(SUM(CASE WHEN date < :week_ago AND date >= :prev_week_ago THEN caffeine END), 0),
+                   COALESCE(SUM(cups), 0),
+                   COALESCE(SUM(caffeine), 0)
+              FROM daily_rollup
+             WHERE date >= :month_ago
+            """),
+            {'today': today.isoformat(), 'week_ago': week_ago.isoformat(),
+             'prev_week_ago': prev_week_ago.isoformat(), 'month_ago': month_ago.isoformat()}
+        ).one()
+        total = conn.execute(text("SELECT COALESCE(SUM(cups), 0), COALESCE(SUM(caffeine), 0) FROM daily_rollup")).one()
+    keys = ['today_cups', 'today_caffeine', 'week_cups', 'week_caffeine', 'prev_week_cups', 'prev_week_caffeine',
+            'month_cups', 'month_caffeine', 'total_cups', 'total_caffeine']
+    return dict(zip(keys, (*recent, *total)))
+
+
+def read_rollup(engine):
+    return pd.read_sql(
+        """
+        SELECT r.date, v.name AS variety, v.caffeine_mg, r.cups,
+               r.caffeine AS total_caffeine
+          FROM daily_rollup r
+          JOIN varieties v ON r.variety_id = v.id
+         ORDER BY r.date
+        """,
+        engine
+    ).pipe(compact_frame)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wartung der Kaffeekonsum-Datenbank")
+    parser.add_argument('command', choices=['rebuild-rollup', 'rebuild-snapshot', 'checkpoint', 'compact'])
+    parser.add_argument('--db', default='coffee.db', help="Pfad zur SQLite-Datenbank")
+    parser.add_argument('--keep-days', type=int, default=None,
+                        help="compact: ältere Einträge zu Tagessummen archivieren (Standard: nur VACUUM/ANALYZE)")
+    args = parser.parse_args(argv)
+
+    engine = create_db_engine(f'sqlite:///{args.db}')
+    if args.command == 'rebuild-rollup':
+        with engine.begin() as conn:
+            refresh_rollup(conn)
+            rows = conn.execute(select(func.count()).select_from(daily_rollup)).scalar()
+        print(f"daily_rollup neu aufgebaut: {rows} Zeilen")
+    elif args.command == 'rebuild-snapshot':
+        from coffee_tracker import snapshot
+        manifest = snapshot.rebuild(engine)
+        print(f"Snapshot neu aufgebaut: {manifest['rows']} Zeilen in {snapshot.snapshot_dir(engine)}")
+    elif args.command == 'checkpoint':
+        result = checkpoint(engine, 'TRUNCATE')
+        print(f"WAL-Checkpoint: {result['checkpointed']} von {result['wal_pages']} Seiten übertragen")
+    elif args.command == 'compact':
+        from coffee_tracker import retention
+        if args.keep_days is not None:
+            result = retention.archive_entries(engine, args.keep_days)
+            print(f"{result['archived']} Einträge vor {result['cutoff']} archiviert")
+        result = retention.compact(engine)
+        print(f"Datenbank: {result['bytes_before'] / 1e6:.1f} MB -> {result['bytes_after'] / 1e6:.1f} MB")
+    dispose_engine(engine)
+
+
+if __name__ == '__main__':
+    main()
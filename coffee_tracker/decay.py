@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Eliminationshalbwertszeit von Koffein bei Erwachsenen, individuell etwa 3-7 Stunden
+HALF_LIFE_HOURS = 5.0
+# Unterhalb dieses Spiegels (mg im Körper) gilt Koffein als weitgehend abgebaut, z.B. zum Einschlafen
+THRESHOLD_MG = 50
+# Einträge ohne Uhrzeit (ältere Einträge, Nachträge) zählen zu dieser Stunde ihres Tages
+DEFAULT_HOUR = 9
+# Raster der Kurve
+STEP_MINUTES = 15
+# Anteile einer Dosis darunter werden abgeschnitten (nach rund 20 Halbwertszeiten)
+KERNEL_CUTOFF = 1e-6
+
+
+def read_doses(engine):
+    # Alle Einträge mit Koffein als (at, mg), nach Zeitpunkt sortiert; archivierte Tage ohne Uhrzeit
+    frame = pd.read_sql(
+        text("""
+        SELECT c.date, c.consumed_at, c.cups * v.caffeine_mg AS mg
+          FROM (SELECT date, cups, variety_id, consumed_at FROM consumption
+                UNION ALL
+                SELECT date, cups, variety_id, NULL FROM consumption_archive) c
+          JOIN varieties v ON c.variety_id = v.id
+         WHERE c.cups * v.caffeine_mg > 0
+        """),
+        engine
+    )
+    return doses_frame(frame['date'], frame['consumed_at'], frame['mg'])
+
+
+def doses_frame(dates, consumed_at, mg):
+    # Das Datum ist maßgeblich (der Editor ändert nur das Datum), consumed_at liefert die Uhrzeit
+    days = pd.to_datetime(pd.Series(dates)).dt.normalize()
+    clock = pd.to_datetime(pd.Series(consumed_at), errors='coerce', format='ISO8601')
+    offset = (clock - clock.dt.normalize()).fillna(pd.Timedelta(hours=DEFAULT_HOUR))
+    doses = pd.DataFrame({
+        'at': (days + offset.to_numpy()).to_numpy('datetime64[ns]'),
+        'mg': pd.Series(mg).to_numpy('float64'),
+    })
+    return doses.sort_values('at', ignore_index=True)
+
+
+def level_at(doses, at, half_life=HALF_LIFE_HOURS):
+    # Exakter Spiegel zu einem Zeitpunkt: Summe über alle früheren Dosen von mg * 0.5^(Δt / h)
+    hours = (pd.Timestamp(at).to_datetime64() - doses['at'].to_numpy()) / np.timedelta64(1, 'h')
+    past = hours >= 0
+    return float(np.sum(doses['mg'].to_numpy()[past] * np.exp2(-hours[past] / half_life)))
+
+
+def hours_below(level, threshold=THRESHOLD_MG, half_life=HALF_LIFE_HOURS):
+    # Stunden, bis der Spiegel ohne weitere Dosen unter threshold fällt
+    if threshold <= 0:
+        raise ValueError("Die Schwelle muss größer als 0 mg sein")
+    if level <= threshold:
+        return 0.0
+    return half_life * math.log2(level / threshold)
+
+
+def curve(doses, start, end, half_life=HALF_LIFE_HOURS, step_minutes=STEP_MINUTES):
+    # Geschätzter Spiegel im Raster von start bis end. Die Dosen werden je Rasterpunkt
+    # summiert und mit dem Abbau-Kern gefaltet (FFT) statt je Punkt über alle Dosen zu laufen.
+    # Jede Dosis zählt ab dem nächsten Rasterpunkt, um die Zeit bis dahin schon abgebaut -
+    # damit ist die Kurve auf dem Raster exakt (bis auf KERNEL_CUTOFF).
+    if half_life <= 0:
+        raise ValueError("Die Halbwertszeit muss größer als 0 Stunden sein")
+    start = pd.Timestamp(start)
+    step = pd.Timedelta(minutes=step_minutes)
+    index = pd.date_range(start, pd.Timestamp(end), freq=step, name='at')
+    if len(index) == 0:
+        return pd.Series(dtype='float64', index=index, name='mg')
+
+    times = doses['at'].to_numpy()
+    mg = doses['mg'].to_numpy()
+    inside = (times >= start.to_datetime64()) & (times <= index[-1].to_datetime64())
+    offset = (times[inside] - start.to_datetime64()) / step.to_timedelta64()
+    slots = np.ceil(offset).astype('int64')
+    weights = mg[inside] * np.exp2(-(slots - offset) * (step / pd.Timedelta(hours=1)) / half_life)
+    signal = np.bincount(slots, weights=weights, minlength=len(index)).astype('float64')
+    # Was von früheren Dosen noch übrig ist, geht exakt als Anfangswert ein
+    earlier = times < start.to_datetime64()
+    signal[0] += level_at(doses[earlier], start, half_life)
+
+    decay = 0.5 ** ((step / pd.Timedelta(hours=1)) / half_life)
+    length = min(len(index), math.ceil(math.log(KERNEL_CUTOFF) / math.log(decay)) + 1)
+    kernel = decay ** np.arange(length)
+    return pd.Series(_convolve(signal, kernel), index=index, name='mg')
+
+
+def _convolve(signal, kernel):
+    size = 1 << (len(signal) + len(kernel) - 2).bit_length()
+    out = np.fft.irfft(np.fft.rfft(signal, size) * np.fft.rfft(kernel, size), size)[:len(signal)]
+    # FFT-Rundungsfehler um 0 herum
+    return np.maximum(out, 0.0)
+
+
+def peaks(level, max_points):
+    # Für Diagramme: höchster Wert je Intervall, damit Spitzen beim Ausdünnen erhalten bleiben
+    if len(level) <= max_points:
+        return level
+    span = level.index[-1] - level.index[0]
+    return level.resample(span / max_points, origin='start').max()
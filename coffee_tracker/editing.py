@@ -0,0 +1,94 @@
+import pandas as pd
+from sqlalchemy import bindparam
+
+from coffee_tracker import changelog
+from coffee_tracker.db import consumption, refresh_rollup
+
+EDIT_COLUMNS = ['id', 'date', 'cups', 'variety']
+
+
+def _normalize(frame):
+    frame = frame[EDIT_COLUMNS].copy()
+    frame['date'] = pd.to_datetime(frame['date']).dt.normalize()
+    return frame
+
+
+def diff_entries(original, edited, variety_ids):
+    # Vergleicht Original und Editor-Stand spaltenweise statt Zeile für Zeile.
+    # variety_ids bildet Sortennamen auf ihre id ab (eine Abbildung für alle Zeilen).
+    orig = _normalize(original).set_index('id')
+    edit = _normalize(edited)
+
+    # Neue Zeilen aus dem Editor haben noch keine id; unvollständige werden ignoriert
+    inserted = edit[edit['id'].isna()].dropna(subset=['date', 'cups', 'variety'])
+    edit = edit.dropna(subset=['id'])
+    edit['id'] = edit['id'].astype('int64')
+    edit = edit.set_index('id')
+
+    deleted = orig.index.difference(edit.index)
+    common = edit.index.intersection(orig.index)
+    before = orig.loc[common]
+    after = edit.loc[common]
+    # Geleerte Zellen bestehender Zeilen werden gemeldet statt gespeichert
+    complete = after[['date', 'cups', 'variety']].notna().all(axis=1)
+    changed = complete & (
+        (before['date'] != after['date'])
+        | (before['cups'] != after['cups'])
+        | (before['variety'] != after['variety'])
+    )
+    updated = after[changed]
+
+    names = pd.concat([updated['variety'], inserted['variety']])
+    unknown = sorted(set(names.dropna()) - set(variety_ids))
+
+    return {
+        'inserted': inserted.drop(columns='id').assign(variety_id=inserted['variety'].map(variety_ids)),
+        'updated': updated.assign(variety_id=updated['variety'].map(variety_ids)),
+        'deleted': deleted,
+        'unknown_varieties': unknown,
+        'incomplete': [int(rid) for rid in after.index[~complete]],
+        # Alte und neue Datumswerte, damit das Rollup beider Tage stimmt
+        'touched_dates': pd.concat([
+            orig.loc[deleted, 'date'],
+            before.loc[changed, 'date'],
+            updated['date'],
+            inserted['date'],
+        ]).unique(),
+    }
+
+
+def apply_changes(conn, changes):
+    # Alle Änderungen als executemany innerhalb der Transaktion des Aufrufers
+    deleted = changes['deleted']
+    updated = changes['updated']
+    inserted = changes['inserted']
+
+    if len(deleted):
+        changelog.record(conn, 'consumption', deleted, op='delete')
+        conn.execute(
+            consumption.delete().where(consumption.c.id == bindparam('b_id')),
+            [{'b_id': int(rid)} for rid in deleted]
+        )
+    if not updated.empty:
+        conn.execute(
+            consumption.update()
+                       .where(consumption.c.id == bindparam('b_id'))
+                       .values(date=bindparam('b_date'), cups=bindparam('b_cups'), variety_id=bindparam('b_variety_id')),
+            [
+                {'b_id': int(rid), 'b_date': day.date(), 'b_cups': int(cups), 'b_variety_id': int(vid)}
+                for rid, day, cups, vid in zip(updated.index, updated['date'], updated['cups'], updated['variety_id'])
+            ]
+        )
+        changelog.record(conn, 'consumption', updated.index)
+    if not inserted.empty:
+        after = changelog.last_id(conn, 'consumption')
+        conn.execute(
+            consumption.insert(),
+            [
+                {'date': day.date(), 'cups': int(cups), 'variety_id': int(vid)}
+                for day, cups, vid in zip(inserted['date'], inserted['cups'], inserted['variety_id'])
+            ]
+        )
+        changelog.record(conn, 'consumption', after_id=after)
+    refresh_rollup(conn, dates=changes['touched_dates'])
+    return {'inserted': len(inserted), 'updated': len(updated), 'deleted': len(deleted)}
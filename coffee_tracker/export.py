@@ -0,0 +1,102 @@
+import gzip
+import importlib.util
+import io
+import tempfile
+
+import pandas as pd
+from sqlalchemy import text
+
+CHUNK_ROWS = 50_000
+
+# Format -> (MIME-Typ, Dateiendung)
+FORMATS = {
+    'CSV': ('text/csv', '.csv'),
+    'CSV (gzip)': ('application/gzip', '.csv.gz'),
+    'Parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+
+def available_formats():
+    # Parquet nur anbieten, wenn pyarrow installiert ist
+    return [fmt for fmt in FORMATS if fmt != 'Parquet' or importlib.util.find_spec('pyarrow')]
+
+
+def iter_consumption(engine, date_from=None, date_to=None, chunk_rows=CHUNK_ROWS):
+    # Liefert die Einträge blockweise aus der Datenbank, nie die ganze Historie auf einmal.
+    # Archivierte Tage erscheinen als eine Zeile je Sorte ohne id und Uhrzeit.
+    where = []
+    params = {}
+    if date_from is not None:
+        where.append("c.date >= :date_from")
+        params['date_from'] = date_from.isoformat()
+    if date_to is not None:
+        where.append("c.date <= :date_to")
+        params['date_to'] = date_to.isoformat()
+    query = text(f"""
+        SELECT c.id, c.date, c.cups, c.variety_id, v.name AS variety, c.consumed_at
+          FROM (SELECT id, date, cups, variety_id, consumed_at FROM consumption
+                UNION ALL
+                SELECT NULL, date, cups, variety_id, NULL FROM consumption_archive) c
+          JOIN varieties v ON c.variety_id = v.id
+         {'WHERE ' + ' AND '.join(where) if where else ''}
+         ORDER BY c.date, c.id
+    """)
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=chunk_rows):
+            # Je nach Anteil archivierter Zeilen wäre id sonst object, float64 oder int64
+            chunk['id'] = chunk['id'].astype('Int64')
+            yield chunk
+
+
+def _write_csv(chunks, binary):
+    out = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(out, index=False, header=header)
+        header = False
+    out.flush()
+    out.detach()
+
+
+def _write_parquet(chunks, binary):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('cups', pa.int64()),
+        ('variety_id', pa.int64()),
+        ('variety', pa.string()),
+        ('consumed_at', pa.timestamp('us')),
+    ])
+    with pq.ParquetWriter(binary, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            chunk['date'] = pd.to_datetime(chunk['date']).dt.date
+            chunk['consumed_at'] = pd.to_datetime(chunk['consumed_at'], format='ISO8601')
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_consumption(engine, binary, fmt='CSV', date_from=None, date_to=None):
+    chunks = iter_consumption(engine, date_from, date_to)
+    if fmt == 'CSV':
+        _write_csv(chunks, binary)
+    elif fmt == 'CSV (gzip)':
+        with gzip.GzipFile(fileobj=binary, mode='wb', compresslevel=6) as gz:
+            _write_csv(chunks, gz)
+    elif fmt == 'Parquet':
+        _write_parquet(chunks, binary)
+    else:
+        raise ValueError(f"Unbekanntes Exportformat: {fmt}")
+
+
+def export_consumption(engine, fmt='CSV', date_from=None, date_to=None):
+    # Schreibt in eine temporäre Datei statt in einen Puffer im Speicher
+    spool = tempfile.TemporaryFile()
+    write_consumption(engine, spool, fmt, date_from, date_to)
+    spool.seek(0)
+    return spool
+
+
+def export_varieties(engine):
+    return pd.read_sql(text("SELECT * FROM varieties ORDER BY id"), engine).to_csv(index=False)
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import calplot
+import pandas as pd
+
+MAX_ENTRIES = 32
+
+# Gerenderte Bilder (PNG/SVG-Bytes) nach Fingerprint, älteste werden zuerst verdrängt
+_cache = OrderedDict()
+# pyplot ist nicht thread-sicher, Streamlit-Sessions laufen aber in eigenen Threads
+_lock = threading.RLock()
+
+
+def fingerprint(series, **style):
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(series, index=True).values.tobytes())
+    digest.update(str(series.name).encode())
+    digest.update(repr(sorted(style.items())).encode())
+    return digest.hexdigest()
+
+
+def cached_image(key, render, fmt='png'):
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+        fig = render()
+        try:
+            buf = io.BytesIO()
+            fig.savefig(buf, format=fmt, bbox_inches='tight', dpi=200)
+        finally:
+            # Figuren explizit schließen, sonst wächst der Speicher im Server-Prozess
+            plt.close(fig)
+        _cache[key] = buf.getvalue()
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+        return _cache[key]
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def pie_image(pie, title='Verteilung nach Kaffeesorten', fmt='png'):
+    def render():
+        fig, ax = plt.subplots(figsize=(8, 6))
+        fig.patch.set_facecolor('#f0f0f0')
+
+        colors = plt.cm.Set3(range(len(pie)))
+        wedges, texts, autotexts = ax.pie(
+            pie,
+            labels=pie.index,
+            autopct='%1.1f%%',
+            startangle=90,
+            colors=colors,
+            shadow=True,
+            explode=[0.05] * len(pie)
+        )
+
+        # Styling für bessere Lesbarkeit
+        for autotext in autotexts:
+            autotext.set_color('white')
+            autotext.set_fontweight('bold')
+
+        ax.axis('equal')
+        ax.set_title(title, fontsize=14, fontweight='bold', pad=20)
+        return fig
+
+    key = fingerprint(pie, kind='pie', title=title, fmt=fmt)
+    return cached_image(key, render, fmt)
+
+
+def heatmap_image(series, title, cmap, fmt='png'):
+    def render():
+        fig, axes = calplot.calplot(
+            series,
+            how='sum',
+            fillcolor='lightgrey',
+            linewidth=0.5,
+            figsize=(10, 4),
+            cmap=cmap
+        )
+        fig.suptitle(title, fontsize=14, fontweight='bold')
+        return fig
+
+    key = fingerprint(series, kind='heatmap', title=title, cmap=cmap, fmt=fmt)
+    return cached_image(key, render, fmt)
@@ -0,0 +1,152 @@
+import hashlib
+import itertools
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from coffee_tracker import changelog
+from coffee_tracker.db import consumption, varieties, imports, refresh_rollup
+
+CHUNK_ROWS = 50_000
+CONSUMPTION_COLUMNS = ['date', 'cups', 'variety']
+# Optionale Spalten, z.B. aus dem eigenen Export
+OPTIONAL_COLUMNS = ['consumed_at']
+
+
+def file_digest(fileobj):
+    # Inhalts-Hash in Blöcken, danach zurück an den Anfang für das Einlesen
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(1 << 20), b''):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _file_size(fileobj):
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size or 1
+
+
+def _already_imported(conn, sha256, kind):
+    return conn.execute(
+        select(imports.c.sha256).where(imports.c.sha256 == sha256, imports.c.kind == kind)
+    ).first() is not None
+
+
+def _record_import(conn, sha256, kind, filename, rows):
+    conn.execute(imports.insert().values(
+        sha256=sha256, kind=kind, filename=filename, rows=rows, imported_at=datetime.now()
+    ))
+
+
+def _variety_ids(conn, names):
+    # Fehlende Sorten anlegen (ohne bestehende zu verändern) und ids nachschlagen.
+    # Alle genannten Sorten gehen ins changelog - import_varieties hat sie gerade aktualisiert.
+    names = sorted(names)
+    conn.execute(
+        sqlite_insert(varieties).on_conflict_do_nothing(index_elements=['name']),
+        [{'name': name, 'caffeine_mg': 0} for name in names]
+    )
+    mapping = {}
+    for i in range(0, len(names), 500):
+        rows = conn.execute(
+            select(varieties.c.name, varieties.c.id).where(varieties.c.name.in_(names[i:i+500]))
+        )
+        mapping.update(dict(rows.all()))
+    changelog.record(conn, 'varieties', mapping.values())
+    return mapping
+
+
+def import_varieties(engine, fileobj, filename=None):
+    sha256 = file_digest(fileobj)
+    with engine.begin() as conn:
+        if _already_imported(conn, sha256, 'varieties'):
+            return {'skipped': True, 'rows': 0}
+
+        dfv = pd.read_csv(fileobj)
+        if 'name' not in dfv.columns:
+            raise ValueError("Spalten fehlen in der CSV: name")
+        dfv = dfv.dropna(subset=['name'])
+        if 'caffeine_mg' not in dfv.columns:
+            dfv['caffeine_mg'] = 0
+        dfv = dfv.drop_duplicates('name', keep='last')
+        records = [
+            {'name': str(name), 'caffeine_mg': int(caffeine) if pd.notna(caffeine) else 0}
+            for name, caffeine in zip(dfv['name'], dfv['caffeine_mg'])
+        ]
+        if records:
+            stmt = sqlite_insert(varieties)
+            conn.execute(
+                stmt.on_conflict_do_update(index_elements=['name'], set_={'caffeine_mg': stmt.excluded.caffeine_mg}),
+                records
+            )
+            # Geänderte Koffeinwerte wirken auf die Tages-Aggregate der Sorten
+            ids = _variety_ids(conn, [r['name'] for r in records]).values()
+            refresh_rollup(conn, variety_ids=ids)
+        _record_import(conn, sha256, 'varieties', filename, len(records))
+    return {'skipped': False, 'rows': len(records)}
+
+
+def _timestamps(values):
+    # Uhrzeiten im Format von SQLAlchemys DateTime, None wenn leer oder ungültig
+    if values is None:
+        return itertools.repeat(None)
+    stamps = pd.to_datetime(values, errors='coerce', format='mixed')
+    return stamps.dt.strftime('%Y-%m-%d %H:%M:%S.%f').astype(object).where(stamps.notna(), None).tolist()
+
+
+def import_consumption(engine, fileobj, filename=None, chunk_rows=CHUNK_ROWS, progress=None):
+    # Liest die CSV in Blöcken, legt unbekannte Sorten an und schreibt alles in einer Transaktion.
+    sha256 = file_digest(fileobj)
+    size = _file_size(fileobj)
+    with engine.begin() as conn:
+        if _already_imported(conn, sha256, 'consumption'):
+            return {'skipped': True, 'rows': 0, 'invalid': 0, 'new_varieties': 0}
+
+        known = dict(conn.execute(select(varieties.c.name, varieties.c.id)).all())
+        after = changelog.last_id(conn, 'consumption')
+        new_varieties = 0
+        rows = 0
+        invalid = 0
+        dates = set()
+        columns = CONSUMPTION_COLUMNS + OPTIONAL_COLUMNS
+        for chunk in pd.read_csv(fileobj, chunksize=chunk_rows, usecols=lambda column: column in columns):
+            missing_columns = set(CONSUMPTION_COLUMNS) - set(chunk.columns)
+            if missing_columns:
+                raise ValueError(f"Spalten fehlen in der CSV: {', '.join(sorted(missing_columns))}")
+            chunk['date'] = pd.to_datetime(chunk['date'], errors='coerce')
+            chunk['cups'] = pd.to_numeric(chunk['cups'], errors='coerce')
+            valid = chunk.dropna(subset=['date', 'cups', 'variety'])
+            invalid += len(chunk) - len(valid)
+
+            missing = set(valid['variety'].astype(str)) - set(known)
+            if missing:
+                known.update(_variety_ids(conn, missing))
+                new_varieties += len(missing)
+
+            if not valid.empty:
+                # Direkt über den Treiber: vermeidet den Parameter-Overhead von SQLAlchemy pro Zeile
+                days = valid['date'].dt.strftime('%Y-%m-%d')
+                conn.exec_driver_sql(
+                    f"INSERT INTO {consumption.name} (date, cups, variety_id, consumed_at) VALUES (?, ?, ?, ?)",
+                    list(zip(
+                        days.tolist(),
+                        valid['cups'].astype('int64').tolist(),
+                        valid['variety'].astype(str).map(known).tolist(),
+                        _timestamps(valid.get('consumed_at'))
+                    ))
+                )
+                dates.update(days.unique())
+                rows += len(valid)
+            if progress is not None:
+                progress(min(fileobj.tell() / size, 1.0), rows)
+
+        changelog.record(conn, 'consumption', after_id=after)
+        refresh_rollup(conn, dates=dates)
+        _record_import(conn, sha256, 'consumption', filename, rows)
+    return {'skipped': False, 'rows': rows, 'invalid': invalid, 'new_varieties': new_varieties}
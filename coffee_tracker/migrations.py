@@ -0,0 +1,169 @@
+import logging
+import threading
+import weakref
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select, func, text
+
+logger = logging.getLogger(__name__)
+
+version_metadata = MetaData()
+schema_version = Table(
+    'schema_version', version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Bereits migrierte Engines - Reruns mit derselben Engine fragen den Katalog nicht erneut ab.
+# Nach Engine statt URL: eine neue Engine, z.B. auf eine neu angelegte Datei, prüft erneut.
+_migrated = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+def _create_base_tables(conn):
+    # Ursprüngliches Schema; alles Spätere ergänzen die folgenden Schritte. Feste Definitionen
+    # statt metadata.create_all, damit spätere Änderungen am Modell diesen Schritt nicht ändern.
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS consumption (
+            id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            cups INTEGER NOT NULL,
+            variety_id INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS varieties (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            caffeine_mg INTEGER,
+            PRIMARY KEY (id),
+            UNIQUE (name)
+        )
+    """))
+
+
+def _add_caffeine_mg(conn):
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(varieties)"))]
+    if 'caffeine_mg' not in columns:
+        conn.execute(text("ALTER TABLE varieties ADD COLUMN caffeine_mg INTEGER DEFAULT 0"))
+
+
+def _add_consumption_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_consumption_date ON consumption (date)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_consumption_variety_id ON consumption (variety_id)"))
+
+
+def _add_consumed_at(conn):
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(consumption)"))]
+    if 'consumed_at' not in columns:
+        conn.execute(text("ALTER TABLE consumption ADD COLUMN consumed_at DATETIME"))
+
+
+def _create_daily_rollup(conn):
+    # Feste Definitionen statt Modell und refresh_rollup: refresh_rollup liest inzwischen auch
+    # das Archiv, das erst Schritt 7 anlegt
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            date DATE NOT NULL,
+            variety_id INTEGER NOT NULL,
+            cups INTEGER NOT NULL,
+            caffeine INTEGER NOT NULL,
+            PRIMARY KEY (date, variety_id)
+        )
+    """))
+    if conn.execute(text("SELECT EXISTS (SELECT 1 FROM daily_rollup)")).scalar() == 0:
+        conn.execute(text("""
+            INSERT INTO daily_rollup (date, variety_id, cups, caffeine)
+            SELECT c.date, c.variety_id, SUM(c.cups), SUM(c.cups * COALESCE(v.caffeine_mg, 0))
+              FROM consumption c
+              JOIN varieties v ON c.variety_id = v.id
+             GROUP BY c.date, c.variety_id
+        """))
+
+
+def _create_imports(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS imports (
+            sha256 VARCHAR NOT NULL,
+            kind VARCHAR NOT NULL,
+            filename VARCHAR,
+            rows INTEGER NOT NULL,
+            imported_at DATETIME NOT NULL,
+            PRIMARY KEY (sha256, kind)
+        )
+    """))
+
+
+def _create_consumption_archive(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS consumption_archive (
+            date DATE NOT NULL,
+            variety_id INTEGER NOT NULL,
+            cups INTEGER NOT NULL,
+            PRIMARY KEY (date, variety_id)
+        )
+    """))
+
+
+def _create_changelog(conn):
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(consumption)"))]
+    if 'sync_key' not in columns:
+        conn.execute(text("ALTER TABLE consumption ADD COLUMN sync_key VARCHAR"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_consumption_sync_key ON consumption (sync_key)"))
+    # Feste Definitionen statt metadata.create_all, damit spätere Änderungen am Modell diesen Schritt nicht ändern.
+    # Der Bestand wird erst beim ersten Sync eingetragen (changelog.enable).
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name VARCHAR NOT NULL,
+            key VARCHAR NOT NULL,
+            op VARCHAR NOT NULL,
+            data VARCHAR,
+            changed_at DATETIME NOT NULL
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_changelog_key ON changelog (table_name, key)"))
+    conn.execute(text("CREATE TABLE IF NOT EXISTS sync_state (name VARCHAR PRIMARY KEY, value VARCHAR NOT NULL)"))
+    conn.execute(text("CREATE TABLE IF NOT EXISTS archived_sync_keys (sync_key VARCHAR PRIMARY KEY)"))
+
+
+# Geordnete Migrationsschritte, jeder Schritt läuft in einer eigenen Transaktion.
+# Neue Schritte nur hinten anhängen, Versionsnummern nie wiederverwenden.
+MIGRATIONS = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'varieties.caffeine_mg', _add_caffeine_mg),
+    (3, 'consumption indexes', _add_consumption_indexes),
+    (4, 'daily_rollup', _create_daily_rollup),
+    (5, 'imports', _create_imports),
+    (6, 'consumption.consumed_at', _add_consumed_at),
+    (7, 'consumption_archive', _create_consumption_archive),
+    (8, 'changelog', _create_changelog),
+]
+
+
+def current_version(conn):
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate(engine):
+    with _lock:
+        if engine in _migrated:
+            return []
+        version_metadata.create_all(engine)
+        with engine.connect() as conn:
+            version = current_version(conn)
+        applied = []
+        for step, name, apply in MIGRATIONS:
+            if step <= version:
+                continue
+            with engine.begin() as conn:
+                apply(conn)
+                conn.execute(schema_version.insert().values(
+                    version=step, name=name, applied_at=datetime.now()
+                ))
+            logger.info("Migration %s (%s) angewendet", step, name)
+            applied.append(name)
+        _migrated.add(engine)
+        return applied
@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Eigene Warteschlange je Art: Statistiken warten nicht hinter Heatmaps (pyplot ist
+# ohnehin gesperrt, mehr als ein Render-Worker bringt nichts)
+QUEUES = {'stats': 1, 'figures': 1}
+# Zuletzt verwendete Jobs; ältere Datenversionen fallen so nach und nach heraus
+MAX_JOBS = 64
+
+_executors = {}
+# Schlüssel (enthält die Datenversion) -> Future
+_jobs = OrderedDict()
+# Schlüssel vorab gestarteter Jobs, die noch niemand angefordert hat
+_speculative = set()
+_lock = threading.Lock()
+
+
+def _pool(queue):
+    executor = _executors.get(queue)
+    if executor is None:
+        executor = _executors[queue] = ThreadPoolExecutor(
+            max_workers=QUEUES[queue], thread_name_prefix=f'precompute-{queue}'
+        )
+    return executor
+
+
+def submit(key, fn, *args, queue='stats', speculative=False):
+    # Startet fn(*args) in der Warteschlange queue, außer für key läuft schon ein Job oder ist fertig.
+    # Fehlgeschlagene oder verworfene Jobs werden beim nächsten Aufruf neu gestartet.
+    # speculative: Vorberechnung ohne Anfrage, discard() darf sie verwerfen, solange sie wartet.
+    with _lock:
+        future = _jobs.get(key)
+        if future is None or future.cancelled() or (future.done() and future.exception() is not None):
+            future = _pool(queue).submit(_run, key, fn, args)
+            _jobs[key] = future
+            if speculative:
+                _speculative.add(key)
+            else:
+                _speculative.discard(key)
+        elif not speculative:
+            _speculative.discard(key)
+        _jobs.move_to_end(key)
+        for old in list(_jobs):
+            if len(_jobs) <= MAX_JOBS:
+                break
+            if _jobs[old].done():
+                del _jobs[old]
+                _speculative.discard(old)
+        return future
+
+
+def discard(stale):
+    # Verwirft noch nicht gestartete Vorberechnungen, deren Schlüssel stale(key) erfüllt,
+    # z.B. für eine überholte Datenversion. Angeforderte und laufende Jobs bleiben.
+    with _lock:
+        for key in [key for key in _speculative if stale(key)]:
+            if _jobs[key].cancel():
+                del _jobs[key]
+                _speculative.discard(key)
+
+
+def _run(key, fn, args):
+    try:
+        return fn(*args)
+    except Exception:
+        logger.exception("Vorberechnung %s fehlgeschlagen", key)
+        raise
+
+
+def wait_all(pending):
+    # pending: Liste von (Future, Callback); Callbacks in Fertigstellungsreihenfolge aufrufen
+    callbacks = {}
+    for future, callback in pending:
+        callbacks.setdefault(future, []).append(callback)
+    for future in as_completed(callbacks):
+        for callback in callbacks[future]:
+            callback(future.result())
+
+
+def clear():
+    with _lock:
+        _jobs.clear()
+        _speculative.clear()
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Per Umgebungsvariable für alle Sessions einschalten, z.B. COFFEE_PROFILE=1 streamlit run app.py
+ENV_VAR = 'COFFEE_PROFILE'
+
+# Streamlit führt jede Session in einem eigenen Thread aus - ein Lauf pro Thread
+_run = threading.local()
+_instrumented = set()
+
+
+def enabled_by_env():
+    return os.environ.get(ENV_VAR, '') not in ('', '0')
+
+
+def start(enabled):
+    # Beginnt einen neuen Lauf; ausgeschaltet bleibt nur ein Attribut-Zugriff pro Aufruf
+    _run.sections = [] if enabled else None
+    _run.current = None
+
+
+def active():
+    return getattr(_run, 'sections', None) is not None
+
+
+def mark(name):
+    # Beendet den laufenden Abschnitt und beginnt den nächsten. Abschnitte folgen
+    # im Skript aufeinander, daher reicht eine Markierung statt eines Blocks.
+    if not active():
+        return
+    now = time.perf_counter()
+    _close(now)
+    _run.current = {'section': name, 'start': now, 'queries': 0, 'sql_s': 0.0, 'rows': 0}
+
+
+def _close(now):
+    current = _run.current
+    if current is not None:
+        current['seconds'] = now - current.pop('start')
+        _run.sections.append(current)
+        _run.current = None
+
+
+def fetched(rows):
+    # Von den Ladefunktionen aufgerufen: gelesene Zeilen dem laufenden Abschnitt zuordnen
+    if active() and _run.current is not None:
+        _run.current['rows'] += int(rows)
+    return rows
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if active() and _run.current is not None:
+        conn.info['profile_start'] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('profile_start', None)
+    if start is not None and active() and _run.current is not None:
+        _run.current['queries'] += 1
+        _run.current['sql_s'] += time.perf_counter() - start
+
+
+def instrument(engine):
+    # Zählt SQL-Abfragen und ihre Dauer pro Abschnitt; einmal pro Engine
+    if id(engine) not in _instrumented:
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+        _instrumented.add(id(engine))
+    return engine
+
+
+def finish():
+    # Schließt den Lauf ab, schreibt eine strukturierte Logzeile und liefert den Bericht
+    if not active():
+        return None
+    _close(time.perf_counter())
+    sections = _run.sections
+    report = {
+        'seconds': sum(s['seconds'] for s in sections),
+        'queries': sum(s['queries'] for s in sections),
+        'rows': sum(s['rows'] for s in sections),
+        'sections': sections,
+    }
+    _run.sections = None
+    logger.info("profile %s", json.dumps({
+        'seconds': round(report['seconds'], 4),
+        'queries': report['queries'],
+        'rows': report['rows'],
+        'sections': [
+            {
+                'section': s['section'],
+                'ms': round(s['seconds'] * 1000, 2),
+                'sql_ms': round(s['sql_s'] * 1000, 2),
+                'queries': s['queries'],
+                'rows': s['rows'],
+            }
+            for s in sections
+        ],
+    }, ensure_ascii=False))
+    return report
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import importlib.util
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import pandas as pd
+
+from coffee_tracker import db
+from coffee_tracker.stats import compute_stats
+
+logger = logging.getLogger(__name__)
+
+PATTERNS = ('*.db', '*.sqlite', '*.sqlite3')
+FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+# Tabelle -> Auflösung aus stats.RESOLUTIONS
+SERIES = {'daily': "Tag", 'weekly': "Woche", 'monthly': "Monat"}
+TABLES = ['summary', *SERIES, 'varieties']
+CACHE_DIR = '.cache'
+# Erhöhen, wenn sich Inhalt oder Aufbau der Tabellen ändern - alte Cache-Einträge passen dann nicht mehr
+CACHE_VERSION = 2
+
+
+def find_databases(directory):
+    paths = set()
+    for pattern in PATTERNS:
+        paths.update(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def fingerprint(path):
+    # Änderungszeit und Größe der Datei samt WAL - im WAL-Modus landen neue Einträge
+    # bis zum nächsten Checkpoint nur im -wal, die Datenbankdatei bleibt unverändert
+    parts = [CACHE_VERSION]
+    for suffix in ('', '-wal'):
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        parts += [suffix, stat.st_mtime_ns, stat.st_size]
+    return tuple(parts)
+
+
+def _load_cached(cache_path, key):
+    try:
+        cached = pd.read_pickle(cache_path)
+    except (FileNotFoundError, EOFError):
+        return None
+    if cached['key'] != key or not all(os.path.exists(path) for path in cached['images']):
+        return None
+    return cached['tables']
+
+
+_ROLLUP = """
+    SELECT r.date, v.name AS variety, v.caffeine_mg, r.cups, r.caffeine AS total_caffeine
+      FROM daily_rollup r
+      JOIN varieties v ON r.variety_id = v.id
+     ORDER BY r.date
+"""
+# Ältere Datenbanken ohne Tagessummen (vor Migration 4), ggf. auch ohne caffeine_mg (vor Migration 2)
+_ENTRIES = """
+    SELECT c.date, v.name AS variety, {caffeine} AS caffeine_mg, SUM(c.cups) AS cups,
+           SUM(c.cups * {caffeine}) AS total_caffeine
+      FROM consumption c
+      JOIN varieties v ON c.variety_id = v.id
+     GROUP BY c.date, c.variety_id
+     ORDER BY c.date
+"""
+
+
+def _read_rollup(path):
+    # Nur lesend - weder Migrationen noch WAL-Umstellung, die Datei bleibt unverändert
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'consumption' not in tables:
+            raise ValueError(f"{path} ist keine Kaffee-Datenbank (Tabelle consumption fehlt)")
+        if 'daily_rollup' in tables:
+            query = _ROLLUP
+        else:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(varieties)")}
+            query = _ENTRIES.format(caffeine='COALESCE(v.caffeine_mg, 0)' if 'caffeine_mg' in columns else '0')
+        return pd.read_sql(query, conn).pipe(db.compact_frame)
+    finally:
+        conn.close()
+
+
+def report_database(path, out_dir):
+    # Läuft im Worker-Prozess: Kennzahlen und Heatmaps einer Datenbank, gecacht nach Änderungszeit
+    name = os.path.basename(path)
+    cache_path = os.path.join(out_dir, CACHE_DIR, f"{name}.pkl")
+    key = fingerprint(path)
+    tables = _load_cached(cache_path, key)
+    if tables is not None:
+        return name, tables, True
+
+    stats = compute_stats(_read_rollup(path), "Alles", date.today())
+    tables = _tables(name, stats)
+    images = _write_heatmaps(name, stats, out_dir)
+    pd.to_pickle({'key': key, 'tables': tables, 'images': images}, cache_path)
+    return name, tables, False
+
+
+def _tables(name, stats):
+    daily = stats['series']["Tag"]
+    summary = pd.DataFrame([{
+        'database': name,
+        'first_day': daily['date'].iloc[0] if not daily.empty else pd.NaT,
+        'last_day': daily['date'].iloc[-1] if not daily.empty else pd.NaT,
+        'active_days': len(daily),
+        'cups': int(daily['cups'].sum()),
+        'total_caffeine': int(daily['total_caffeine'].sum()),
+        'avg_daily_caffeine': float(stats['avg_daily_caffeine']),
+        'max_daily_caffeine': int(stats['max_daily_caffeine']),
+        'high_caffeine_days': stats['high_caffeine_days'],
+        # Tage weit über dem rollierenden Mittel der Wochen davor (coffee_tracker.trends)
+        'anomaly_days': int(stats['trend']['caffeine_anomaly'].sum()) if not stats['trend'].empty else 0,
+    }])
+    tables = {'summary': summary}
+    for table, resolution in SERIES.items():
+        series = stats['series'][resolution]
+        tables[table] = series.assign(database=name)[['database', 'date', 'cups', 'total_caffeine']]
+    by_variety = stats['by_variety'].reset_index()
+    tables['varieties'] = pd.DataFrame({
+        'database': name,
+        'variety': by_variety['variety'].astype(str),
+        'cups': by_variety['cups'].astype('int64'),
+        'total_caffeine': by_variety['total_caffeine'].astype('int64'),
+        'caffeine_mg': by_variety['caffeine_mg'].astype('int64'),
+    })
+    return tables
+
+
+def _write_heatmaps(name, stats, out_dir):
+    from coffee_tracker import figures
+
+    images = []
+    for kind, series, title, cmap in (
+        ('cups', stats['cups_series'], "☕ Kaffeekonsum-Heatmap", 'YlOrBr'),
+        ('caffeine', stats['caffeine_series'], "⚡ Koffeinkonsum-Heatmap (mg)", 'Reds'),
+    ):
+        path = os.path.join(out_dir, f"{name}-{kind}.png")
+        if series.sum() == 0:
+            # Ohne Einträge keine Heatmap, auch kein veraltetes Bild aus einem früheren Lauf
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        with open(path, 'wb') as f:
+            f.write(figures.heatmap_image(series.astype('int64'), f"{title} - {name}", cmap))
+        images.append(path)
+    return images
+
+
+def build_report(directory, out_dir, fmt='csv', workers=None):
+    # Verarbeitet alle Datenbanken im Verzeichnis parallel und schreibt je Tabelle eine Datei
+    if fmt not in FORMATS:
+        raise ValueError(f"Unbekanntes Format: {fmt}")
+    if fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise RuntimeError("Für Parquet muss pyarrow installiert sein")
+    paths = find_databases(directory)
+    if not paths:
+        raise ValueError(f"Keine Datenbanken in {directory} gefunden")
+    os.makedirs(os.path.join(out_dir, CACHE_DIR), exist_ok=True)
+
+    results = {}
+    cached = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(report_database, path, out_dir): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                name, tables, hit = future.result()
+            except Exception as exc:
+                # Eine defekte Datenbank soll den Report der anderen nicht verhindern
+                logger.error("%s: Report fehlgeschlagen: %s", futures[future], exc)
+                failed.append(futures[future])
+                continue
+            results[name] = tables
+            cached += hit
+
+    files = []
+    for table in TABLES:
+        frames = [results[name][table] for name in sorted(results)]
+        if not frames:
+            continue
+        combined = pd.concat(frames, ignore_index=True)
+        path = os.path.join(out_dir, table + FORMATS[fmt])
+        if fmt == 'csv':
+            combined.to_csv(path, index=False)
+        else:
+            combined.to_parquet(path, index=False)
+        files.append(path)
+    return {'databases': len(results), 'cached': cached, 'failed': sorted(failed), 'files': files}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report über alle Kaffee-Datenbanken eines Verzeichnisses")
+    parser.add_argument('directory', help="Verzeichnis mit .db/.sqlite-Dateien")
+    parser.add_argument('--out', default='reports', help="Ausgabeverzeichnis für Tabellen und Heatmaps")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--workers', type=int, default=None, help="Prozesse (Standard: Anzahl CPU-Kerne)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    start = time.perf_counter()
+    result = build_report(args.directory, args.out, args.format, args.workers)
+    print(
+        f"{result['databases']} Datenbanken ({result['cached']} aus dem Cache) "
+        f"in {time.perf_counter() - start:.1f}s -> {args.out}"
+    )
+    for path in result['failed']:
+        print(f"Fehlgeschlagen: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import logging
+import os
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from coffee_tracker.db import checkpoint
+
+logger = logging.getLogger(__name__)
+
+# Einträge, die älter sind, werden zu Tagessummen je Sorte zusammengefasst
+RETENTION_DAYS = 365
+# Der letzte Monat bleibt immer einzeln erhalten und im Editor bearbeitbar
+MIN_RETENTION_DAYS = 31
+# Seiten, die ein inkrementelles VACUUM pro Aufruf höchstens freigibt (None: alle)
+VACUUM_PAGES = None
+
+
+def archive_entries(engine, keep_days=RETENTION_DAYS, today=None):
+    # Verschiebt alle Einträge vor (heute - keep_days) ins Archiv. Die Tagessummen bleiben
+    # gleich, das Rollup muss deshalb nicht neu berechnet werden.
+    if keep_days < MIN_RETENTION_DAYS:
+        raise ValueError(f"Mindestens {MIN_RETENTION_DAYS} Tage müssen als Einzeleinträge erhalten bleiben")
+    cutoff = (today or date.today()) - timedelta(days=keep_days)
+    params = {'cutoff': cutoff.isoformat()}
+    with engine.begin() as conn:
+        # "WHERE" vor "ON CONFLICT" ist nötig, sonst liest SQLite die Klausel als Teil des SELECT
+        conn.execute(text("""
+            INSERT INTO consumption_archive (date, variety_id, cups)
+            SELECT date, variety_id, SUM(cups)
+              FROM consumption
+             WHERE date < :cutoff
+             GROUP BY date, variety_id
+            ON CONFLICT (date, variety_id) DO UPDATE SET cups = cups + excluded.cups
+        """), params)
+        # Einträge anderer Geräte bleiben über ihren Schlüssel erkennbar (sync._apply_entry)
+        conn.execute(text("""
+            INSERT OR IGNORE INTO archived_sync_keys (sync_key)
+            SELECT sync_key FROM consumption WHERE date < :cutoff AND sync_key IS NOT NULL
+        """), params)
+        archived = conn.execute(text("DELETE FROM consumption WHERE date < :cutoff"), params).rowcount
+    logger.info("%d Einträge vor %s archiviert", archived, cutoff)
+    return {'archived': archived, 'cutoff': cutoff}
+
+
+def compact(engine, pages=VACUUM_PAGES):
+    # Gibt freie Seiten an das Dateisystem zurück und aktualisiert die Statistiken des Planers.
+    # Beim ersten Mal wird auf auto_vacuum=INCREMENTAL umgestellt, das braucht ein volles VACUUM.
+    path = engine.url.database
+    before = _file_bytes(path)
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode != 2:
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+        else:
+            _incremental_vacuum(conn, pages)
+        conn.exec_driver_sql("ANALYZE")
+    # Das WAL enthält danach die kompletten neuen Seiten - zurück in die Datei und kürzen
+    checkpoint(engine, 'TRUNCATE')
+    after = _file_bytes(path)
+    return {'full_vacuum': mode != 2, 'bytes_before': before, 'bytes_after': after}
+
+
+def _incremental_vacuum(conn, pages):
+    # incremental_vacuum gibt pro Schritt eine Seite frei; sqlite3 führt nur executescript()
+    # bis zum Ende aus, execute() bliebe nach der ersten Seite stehen
+    conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages or 0)})")
+
+
+def release_pages(engine, pages=VACUUM_PAGES):
+    # Gibt freie Seiten zurück, falls die Datenbank schon auf auto_vacuum=INCREMENTAL steht
+    # (nach dem ersten compact()). Sonst bleiben sie für spätere Schreibzugriffe reserviert.
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return False
+        _incremental_vacuum(conn, pages)
+    return True
+
+
+def _file_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def apply_retention(engine, keep_days=RETENTION_DAYS, today=None):
+    result = archive_entries(engine, keep_days, today)
+    result.update(compact(engine))
+    return result
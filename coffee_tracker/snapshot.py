@@ -0,0 +1,197 @@
+import importlib.util
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+CHUNK_ROWS = 100_000
+# Ab so vielen Segmenten werden sie beim nächsten Anhängen zu einem zusammengefasst
+MAX_SEGMENTS = 16
+
+_lock = threading.Lock()
+
+
+def available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def snapshot_dir(engine):
+    # coffee.db -> coffee.snapshot/ neben der Datenbank
+    return os.path.splitext(os.path.abspath(engine.url.database))[0] + '.snapshot'
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.timestamp('s')),
+        ('cups', pa.int32()),
+        ('variety_id', pa.int32()),
+    ])
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(path, manifest):
+    tmp = os.path.join(path, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, 'manifest.json'))
+
+
+def exists(engine):
+    return _read_manifest(snapshot_dir(engine)) is not None
+
+
+def _write_segment(path, name, tables):
+    # Unkomprimiertes Arrow-IPC-Format, damit das Laden per Memory-Map ohne Kopie geht
+    import pyarrow as pa
+    rows = 0
+    with pa.ipc.new_file(os.path.join(path, name), _schema()) as writer:
+        for table in tables:
+            writer.write_table(table)
+            rows += table.num_rows
+    return rows
+
+
+def _query_tables(engine, after_id, until_id):
+    # Einträge mit after_id < id <= until_id, nach Datum sortiert. Beim Neuaufbau (after_id < 0)
+    # kommen die archivierten Tagessummen mit id 0 dazu.
+    import pyarrow as pa
+    query = text("""
+        SELECT id, date, cups, variety_id FROM consumption WHERE id > :after AND id <= :until
+        UNION ALL
+        SELECT 0, date, cups, variety_id FROM consumption_archive WHERE :after < 0
+        ORDER BY date, id
+    """)
+    with engine.connect() as conn:
+        params = {'after': after_id, 'until': until_id}
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=CHUNK_ROWS):
+            chunk['date'] = pd.to_datetime(chunk['date']).astype('datetime64[s]')
+            yield pa.Table.from_pandas(chunk, schema=_schema(), preserve_index=False)
+
+
+def _segment_tables(path, segments):
+    import pyarrow as pa
+    for name in segments:
+        # Die Tabelle verweist direkt auf die gemappten Seiten und hält die Map offen
+        source = pa.memory_map(os.path.join(path, name))
+        yield pa.ipc.open_file(source).read_all()
+
+
+def _sorted_by_date(table):
+    import pyarrow.compute as pc
+    dates = table['date']
+    if len(dates) < 2 or pc.all(pc.greater_equal(dates[1:], dates[:-1])).as_py():
+        return table
+    return table.take(pc.sort_indices(table, [('date', 'ascending'), ('id', 'ascending')]))
+
+
+def _replace_segments(path, manifest, tables):
+    # Neues Segment schreiben, dann Manifest umstellen, dann alte Segmente löschen
+    name = f"segment-{manifest['next']:06d}.arrow"
+    rows = _write_segment(path, name, tables)
+    old = manifest['segments']
+    manifest = dict(manifest, segments=[name], next=manifest['next'] + 1, rows=rows)
+    _write_manifest(path, manifest)
+    for segment in old:
+        os.remove(os.path.join(path, segment))
+    return manifest
+
+
+def rebuild(engine):
+    path = snapshot_dir(engine)
+    with _lock:
+        os.makedirs(path, exist_ok=True)
+        manifest = _read_manifest(path) or {'segments': [], 'next': 1}
+        with engine.connect() as conn:
+            watermark = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM consumption")).scalar()
+        # Nur bis zum Wasserstand lesen: später eingefügte Einträge holt das nächste append()
+        tables = _query_tables(engine, -1, watermark)
+        manifest = _replace_segments(path, dict(manifest, watermark=watermark), tables)
+    return manifest
+
+
+def append(engine):
+    # Hängt nur neue Einträge (id über dem Wasserstand) als weiteres Segment an.
+    # Geänderte oder gelöschte Einträge erfordern rebuild().
+    path = snapshot_dir(engine)
+    with _lock:
+        manifest = _read_manifest(path)
+        if manifest is None:
+            return None
+        with engine.connect() as conn:
+            watermark = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM consumption")).scalar()
+        tables = [t for t in _query_tables(engine, manifest['watermark'], watermark) if t.num_rows]
+        if tables:
+            name = f"segment-{manifest['next']:06d}.arrow"
+            rows = _write_segment(path, name, tables)
+            manifest = dict(
+                manifest,
+                segments=manifest['segments'] + [name],
+                next=manifest['next'] + 1,
+                rows=manifest['rows'] + rows,
+                watermark=watermark,
+            )
+            _write_manifest(path, manifest)
+        if len(manifest['segments']) > MAX_SEGMENTS:
+            # Zusammengefasst wieder ein nach Datum sortiertes Segment
+            import pyarrow as pa
+            table = _sorted_by_date(pa.concat_tables(_segment_tables(path, manifest['segments'])))
+            manifest = _replace_segments(path, manifest, [table])
+        return manifest
+
+
+def load(engine, varieties):
+    # Lädt alle Segmente per Memory-Map und ergänzt Sortenname und Koffein aus der
+    # (kleinen) Sortentabelle. Einträge ohne bekannte Sorte fallen wie beim JOIN weg.
+    import pyarrow as pa
+    path = snapshot_dir(engine)
+    for attempt in range(3):
+        manifest = _read_manifest(path)
+        if manifest is None:
+            return None
+        try:
+            tables = list(_segment_tables(path, manifest['segments']))
+            break
+        except FileNotFoundError:
+            # Segmente wurden gerade zusammengefasst - Manifest neu lesen
+            continue
+    else:
+        return None
+    table = pa.concat_tables(tables) if tables else _schema().empty_table()
+
+    # Sortennamen als Kategorie über Codes aus der Sortentabelle, ohne Zwischen-DataFrame
+    lookup = varieties.set_index('id')
+    codes = lookup.index.get_indexer(table['variety_id'].to_numpy())
+    known = codes >= 0
+    if not known.all():
+        table = table.filter(known)
+        codes = codes[known]
+    # Segmente sind nach Datum sortiert; nur wenn angehängte Segmente ältere Tage enthalten,
+    # neu ordnen, damit die Zeitraumfilter Slices statt Kopien verwenden können
+    table = _sorted_by_date(table.append_column('code', pa.array(codes)))
+    codes = table['code'].to_numpy()
+    names = lookup['name'].to_numpy()
+    used = np.bincount(codes, minlength=len(names)) > 0
+    categories = pd.Index(sorted(names[used]))
+    caffeine_mg = lookup['caffeine_mg'].fillna(0).to_numpy('int64')[codes]
+    cups = table['cups'].to_numpy()
+    # Datum ist bereits Tagesauflösung in Sekunden (wie db.compact_frame)
+    return pd.DataFrame({
+        'id': pd.to_numeric(table['id'].to_numpy(), downcast='integer'),
+        'date': table['date'].to_numpy(),
+        'cups': pd.to_numeric(cups, downcast='integer'),
+        'variety': pd.Categorical.from_codes(categories.get_indexer(names)[codes], categories=categories),
+        'caffeine_mg': pd.to_numeric(caffeine_mg, downcast='integer'),
+        'total_caffeine': pd.to_numeric(cups * caffeine_mg, downcast='integer'),
+    }, copy=False)
@@ -0,0 +1,105 @@
+import pandas as pd
+
+from coffee_tracker import trends
+
+TIMEFRAMES = ["Letzte 7 Tage", "Letzte 30 Tage", "Letzte 90 Tage", "Alles"]
+HIGH_CAFFEINE_MG = 400
+
+# Auflösungen der Balkendiagramme: Name -> pandas-Frequenz (Periodenbeginn als Datum)
+RESOLUTIONS = {
+    "Tag": 'D',
+    "Woche": 'W-MON',
+    "Monat": 'MS',
+    "Jahr": 'YS',
+}
+# Durchschnittliche Tage pro Periode, für die automatische Wahl
+_PERIOD_DAYS = {"Tag": 1, "Woche": 7, "Monat": 30.4, "Jahr": 365.25}
+# Feste Annahme für die Breite einer der beiden Diagrammspalten im breiten Layout (Fenster
+# um 1300px): Streamlit meldet die tatsächliche Breite nicht an den Server. In schmaleren
+# Fenstern werden die Balken etwas schmaler als MIN_BAR_PX, in breiteren bleibt Platz.
+# Wer die Breite kennt, übergibt sie an auto_resolution(width_px=...).
+CHART_WIDTH_PX = 600
+MIN_BAR_PX = 4
+MAX_BARS = CHART_WIDTH_PX // MIN_BAR_PX
+
+
+def filter_timeframe(frame, timeframe, today):
+    # "Letzte N Tage" schließt heute mit ein, "Alles" filtert nicht.
+    # Nach Datum sortierte Frames werden per Slice gefiltert (View statt Kopie).
+    if timeframe == "Alles":
+        return frame
+    days = int(timeframe.split()[1])
+    cutoff = pd.to_datetime(today) - pd.Timedelta(days=days-1)
+    if frame['date'].is_monotonic_increasing:
+        return frame.iloc[frame['date'].searchsorted(cutoff):]
+    return frame[frame['date'] >= cutoff]
+
+
+def in_timeframe(day, timeframe, today):
+    # Ob ein Eintrag an diesem Tag die Kennzahlen des Zeitraums verändert
+    if timeframe == "Alles":
+        return True
+    days = int(timeframe.split()[1])
+    return pd.Timestamp(day) >= pd.to_datetime(today) - pd.Timedelta(days=days-1)
+
+
+def downsample(daily, resolution):
+    # Summiert die Tageswerte je Woche/Monat/Jahr; Datum ist jeweils der Periodenbeginn
+    daily = daily.astype({'cups': 'int64', 'total_caffeine': 'int64'})
+    if resolution == "Tag" or daily.empty:
+        return daily.reset_index(drop=True)
+    rule = RESOLUTIONS[resolution]
+    return (
+        daily.resample(rule, on='date', label='left', closed='left')[['cups', 'total_caffeine']]
+             .sum()
+             .reset_index()
+    )
+
+
+def auto_resolution(span_days, width_px=CHART_WIDTH_PX):
+    # Feinste Auflösung, bei der alle Balken mindestens MIN_BAR_PX breit bleiben
+    max_bars = max(width_px // MIN_BAR_PX, 1)
+    for resolution, days in _PERIOD_DAYS.items():
+        if span_days / days <= max_bars:
+            return resolution
+    return "Jahr"
+
+
+def compute_stats(frame, timeframe, today, threshold=HIGH_CAFFEINE_MG):
+    # Alle Kennzahlen der Statistik- und Koffein-Abschnitte aus einem Durchlauf:
+    # eine Gruppierung nach Datum, eine nach Sorte.
+    tmp = filter_timeframe(frame, timeframe, today)
+
+    daily = tmp.groupby('date', as_index=False).agg({
+        'cups': 'sum',
+        'total_caffeine': 'sum'
+    }).sort_values('date')
+    daily_caffeine = daily['total_caffeine']
+
+    by_variety = tmp.groupby('variety', observed=True).agg({
+        'total_caffeine': 'sum',
+        'cups': 'sum',
+        'caffeine_mg': 'first'
+    })
+
+    if timeframe == "Alles":
+        span_days = (daily['date'].iloc[-1] - daily['date'].iloc[0]).days + 1 if not daily.empty else 0
+    else:
+        span_days = int(timeframe.split()[1])
+
+    return {
+        'empty': tmp.empty,
+        'daily': daily,
+        # Vorberechnete Reihen für die Balkendiagramme je Auflösung
+        'series': {resolution: downsample(daily, resolution) for resolution in RESOLUTIONS},
+        # Rollierendes Mittel und auffällige Tage für das Tagesdiagramm (liest nur die Tage davor mit)
+        'trend': trends.baseline(frame, daily['date'].iloc[0]) if not daily.empty else pd.DataFrame(columns=['date']),
+        'span_days': span_days,
+        'by_variety': by_variety.sort_values('total_caffeine', ascending=False),
+        'pie': by_variety['cups'],
+        'cups_series': daily.set_index('date')['cups'],
+        'caffeine_series': daily.set_index('date')['total_caffeine'],
+        'avg_daily_caffeine': daily_caffeine.mean() if not daily.empty else 0,
+        'max_daily_caffeine': daily_caffeine.max() if not daily.empty else 0,
+        'high_caffeine_days': int((daily_caffeine > threshold).sum()),
+    }
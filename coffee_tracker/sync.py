@@ -0,0 +1,280 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from coffee_tracker import changelog, retention
+from coffee_tracker.db import archived_sync_keys, consumption, varieties, refresh_rollup, reader
+
+logger = logging.getLogger(__name__)
+
+# Delta-Sync gegen einen HTTP-Endpunkt (z.B. eine Appwrite Function oder Next.js-Route vor Appwrite):
+#   POST {url}/changes  {"device": ..., "changes": [{seq, table, key, op, data, changed_at}, ...]}
+#        -> {"accepted": n}; der Server ignoriert (device, seq), die er schon kennt
+#   GET  {url}/changes?after=<cursor>&limit=<n>&device=<id>
+#        -> {"changes": [{table, key, op, data}, ...], "cursor": ..., "more": bool}
+#        ohne die eigenen Änderungen des Geräts
+ENV_URL = 'COFFEE_SYNC_URL'
+ENV_TOKEN = 'COFFEE_SYNC_TOKEN'
+BATCH_SIZE = 500
+RETRIES = 4
+# Wartezeit vor der ersten Wiederholung in Sekunden, danach jeweils doppelt so lang
+RETRY_DELAY = 0.2
+TIMEOUT = 10
+INTERVAL = 30
+
+# Ein Worker pro Datenbank (Schlüssel: URL der Datenbank)
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def _request(method, url, payload=None, token=None):
+    # JSON-Anfrage mit Wiederholung bei Netzwerkfehlern, 5xx, 408 und 429
+    headers = {'Accept': 'application/json'}
+    data = None
+    if payload is not None:
+        data = json.dumps(payload).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    error = None
+    for attempt in range(RETRIES):
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as exc:
+            if exc.code < 500 and exc.code not in (408, 429):
+                raise RuntimeError(f"Sync-Server lehnt {method} {url} ab: HTTP {exc.code}") from exc
+            error = exc
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as exc:
+            error = exc
+        logger.warning("%s %s fehlgeschlagen (Versuch %d): %s", method, url, attempt + 1, error)
+        time.sleep(RETRY_DELAY * 2 ** attempt)
+    raise RuntimeError(f"Sync-Server nicht erreichbar: {error}") from error
+
+
+def _get_state(conn, name, default=None):
+    value = conn.execute(text("SELECT value FROM sync_state WHERE name = :name"), {'name': name}).scalar()
+    return default if value is None else value
+
+
+def _set_state(conn, name, value):
+    conn.execute(
+        text("INSERT INTO sync_state (name, value) VALUES (:name, :value) "
+             "ON CONFLICT (name) DO UPDATE SET value = excluded.value"),
+        {'name': name, 'value': str(value)}
+    )
+
+
+def push(engine, url, token=None, batch_size=BATCH_SIZE):
+    # Überträgt das changelog in Blöcken; bestätigte Änderungen werden gelöscht.
+    # Beim ersten Aufruf trägt enable() den ganzen Bestand ein.
+    with engine.begin() as conn:
+        device = changelog.enable(conn)
+    pushed = 0
+    while True:
+        with reader(engine).connect() as conn:
+            rows = conn.execute(
+                text("SELECT seq, table_name, key, op, data, changed_at FROM changelog ORDER BY seq LIMIT :limit"),
+                {'limit': batch_size}
+            ).all()
+        if not rows:
+            if pushed:
+                # Der Platz der gelöschten Einträge (nach dem ersten Sync der ganze Bestand) wird frei
+                retention.release_pages(engine)
+            return pushed
+        _request('POST', f"{url}/changes", {
+            'device': device,
+            'changes': [
+                {
+                    'seq': seq, 'table': table, 'key': key, 'op': op,
+                    'data': json.loads(data) if data is not None else None,
+                    'changed_at': str(changed_at),
+                }
+                for seq, table, key, op, data, changed_at in rows
+            ],
+        }, token)
+        with engine.begin() as conn:
+            changelog.prune(conn, rows[-1][0])
+        pushed += len(rows)
+
+
+def pull(engine, url, token=None, batch_size=BATCH_SIZE):
+    # Holt Änderungen anderer Geräte ab dem gespeicherten Cursor und wendet sie an.
+    # Anwenden und Cursor stehen in derselben Transaktion - ein Abbruch wiederholt nur den Block.
+    with engine.begin() as conn:
+        device = changelog.enable(conn)
+    pulled = 0
+    while True:
+        with reader(engine).connect() as conn:
+            cursor = _get_state(conn, 'pull_cursor', '')
+        query = urllib.parse.urlencode({'after': cursor, 'limit': batch_size, 'device': device})
+        response = _request('GET', f"{url}/changes?{query}", token=token)
+        with engine.begin() as conn:
+            apply_changes(conn, response['changes'], device)
+            _set_state(conn, 'pull_cursor', response['cursor'])
+        pulled += len(response['changes'])
+        if not response.get('more') or not response['changes']:
+            return pulled
+
+
+def apply_changes(conn, changes, device):
+    # Wendet entfernte Änderungen an, ohne sie erneut ins changelog zu schreiben
+    dates = set()
+    variety_ids = set()
+    for change in changes:
+        if change['table'] == 'varieties':
+            _apply_variety(conn, change, variety_ids)
+        elif change['table'] == 'consumption':
+            _apply_entry(conn, change, device, dates)
+        else:
+            logger.warning("Unbekannte Tabelle im Sync ignoriert: %s", change['table'])
+    if variety_ids:
+        refresh_rollup(conn, variety_ids=variety_ids)
+    if dates:
+        refresh_rollup(conn, dates=dates)
+
+
+def _apply_variety(conn, change, variety_ids):
+    name = change['key']
+    if change['op'] == 'delete':
+        variety_id = conn.execute(select(varieties.c.id).where(varieties.c.name == name)).scalar()
+        if variety_id is not None:
+            conn.execute(varieties.delete().where(varieties.c.id == variety_id))
+            variety_ids.add(variety_id)
+        return
+    stmt = sqlite_insert(varieties).values(name=name, caffeine_mg=int(change['data'].get('caffeine_mg') or 0))
+    conn.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'caffeine_mg': stmt.excluded.caffeine_mg}))
+    variety_ids.add(conn.execute(select(varieties.c.id).where(varieties.c.name == name)).scalar())
+
+
+def _variety_id(conn, name):
+    # Unbekannte Sorten wie beim CSV-Import mit 0mg anlegen
+    conn.execute(sqlite_insert(varieties).values(name=name, caffeine_mg=0).on_conflict_do_nothing(index_elements=['name']))
+    return conn.execute(select(varieties.c.id).where(varieties.c.name == name)).scalar()
+
+
+def _local_entry(conn, key, device):
+    # (id, Datum) des lokalen Eintrags zum Schlüssel, None wenn es ihn nicht (mehr) gibt
+    prefix = f"{device}:"
+    if key.startswith(prefix):
+        where = consumption.c.id == int(key[len(prefix):])
+    else:
+        where = consumption.c.sync_key == key
+    return conn.execute(select(consumption.c.id, consumption.c.date).where(where)).first()
+
+
+def _apply_entry(conn, change, device, dates):
+    key = change['key']
+    local = _local_entry(conn, key, device)
+    if local is not None:
+        dates.add(local.date)
+    if change['op'] == 'delete':
+        if local is not None:
+            conn.execute(consumption.delete().where(consumption.c.id == local.id))
+        return
+    if local is None and key.startswith(f"{device}:"):
+        # Eigener Eintrag, der hier inzwischen gelöscht oder archiviert wurde
+        return
+    if local is None and conn.execute(
+        select(archived_sync_keys.c.sync_key).where(archived_sync_keys.c.sync_key == key)
+    ).first() is not None:
+        # Hier schon in der Tagessumme des Archivs enthalten - nicht als neuen Eintrag anlegen
+        logger.info("Änderung an archiviertem Eintrag %s ignoriert", key)
+        return
+
+    data = change['data']
+    if not data.get('variety'):
+        # Sorte wurde auf dem anderen Gerät gelöscht - wie beim JOIN ohne Sorte nicht übernehmen
+        logger.warning("Eintrag %s ohne Sorte ignoriert", key)
+        return
+    values = {
+        'date': date.fromisoformat(str(data['date'])[:10]),
+        'cups': int(data['cups']),
+        'variety_id': _variety_id(conn, data['variety']),
+        'consumed_at': datetime.fromisoformat(data['consumed_at']) if data.get('consumed_at') else None,
+    }
+    dates.add(values['date'])
+    if local is None:
+        conn.execute(consumption.insert().values(sync_key=key, **values))
+    else:
+        conn.execute(consumption.update().where(consumption.c.id == local.id).values(**values))
+
+
+def sync_once(engine, url, token=None):
+    # Erst eigene Änderungen übertragen, dann fremde holen
+    pushed = push(engine, url, token)
+    pulled = pull(engine, url, token)
+    return {'pushed': pushed, 'pulled': pulled}
+
+
+def start(engine, url, token=None, interval=INTERVAL, on_pull=None):
+    # Hintergrund-Thread, der alle interval Sekunden (oder nach trigger()) synchronisiert.
+    # on_pull() läuft im Worker, wenn Änderungen angekommen sind, z.B. zum Leeren von Caches.
+    key = str(engine.url)
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is not None:
+            return worker
+        worker = {
+            'engine': engine,
+            'url': url.rstrip('/'),
+            'token': token,
+            'interval': interval,
+            'on_pull': on_pull,
+            'wake': threading.Event(),
+            'stop': threading.Event(),
+            'status': {'last_sync': None, 'last_error': None, 'pushed': 0, 'pulled': 0},
+        }
+        worker['thread'] = threading.Thread(
+            target=_run, args=(worker,), name=f"sync-{engine.url.database}", daemon=True
+        )
+        worker['thread'].start()
+        _workers[key] = worker
+        return worker
+
+
+def trigger(engine):
+    worker = _workers.get(str(engine.url))
+    if worker is not None:
+        worker['wake'].set()
+
+
+def status(engine):
+    worker = _workers.get(str(engine.url))
+    return dict(worker['status']) if worker is not None else None
+
+
+def stop(engine, timeout=10.0):
+    with _workers_lock:
+        worker = _workers.pop(str(engine.url), None)
+    if worker is not None:
+        worker['stop'].set()
+        worker['wake'].set()
+        worker['thread'].join(timeout)
+
+
+def _run(worker):
+    while not worker['stop'].is_set():
+        try:
+            result = sync_once(worker['engine'], worker['url'], worker['token'])
+            worker['status'].update(
+                last_sync=datetime.now(), last_error=None,
+                pushed=worker['status']['pushed'] + result['pushed'],
+                pulled=worker['status']['pulled'] + result['pulled'],
+            )
+            if result['pulled'] and worker['on_pull'] is not None:
+                worker['on_pull']()
+        except Exception as exc:
+            logger.error("Sync fehlgeschlagen: %s", exc)
+            worker['status']['last_error'] = str(exc)
+        worker['wake'].wait(worker['interval'])
+        worker['wake'].clear()
@@ -0,0 +1,255 @@
+import math
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Rollierende Kennzahlen je Sorte und gesamt für den laufenden Tag: Mittelwert und
+# Streuung der letzten WINDOW_DAYS abgeschlossenen Tage, diese Woche und Vorwoche.
+# Der Zustand hält nur die Tageswerte des Fensters in einem Ringpuffer samt laufender
+# Summen. Ein neuer Eintrag oder ein neuer Tag ändert nur diese Summen (O(1)); da
+# Tassen und mg ganzzahlig sind, bleiben sie exakt und driften nicht.
+WINDOW_DAYS = 28
+# Woche wie die Wochenkachel (db.read_header_metrics: date >= heute - 7), also acht Tage
+# einschließlich heute; die Vorwoche sind die acht Tage davor
+WEEK_DAYS = 8
+# Ein Tag ist auffällig, wenn er mehr als ANOMALY_Z Standardabweichungen über dem Mittel liegt
+ANOMALY_Z = 2.5
+# Untergrenze der Standardabweichung, sonst fällt bei sehr gleichmäßigem Konsum jede Extratasse auf
+MIN_STD = {'cups': 1.0, 'caffeine': 80.0}
+# Erst ab so vielen Tagen Historie gibt es Vergleichswerte
+MIN_BASELINE_DAYS = 7
+METRICS = ('cups', 'caffeine')
+TOTAL = 'total'
+
+# Das Fenster liegt innerhalb der Aufbewahrungsfrist (retention.MIN_RETENTION_DAYS),
+# archivierte Tagessummen betreffen es also nie
+_SIZE = WINDOW_DAYS + 1
+assert WINDOW_DAYS >= 2 * WEEK_DAYS
+
+# Ein Zustand pro Datenbank (Schlüssel: URL der Datenbank)
+_states = {}
+_lock = threading.Lock()
+
+
+def _new_series(first_day):
+    series = {'first_day': first_day}
+    for metric in METRICS:
+        series[metric] = {'ring': [0] * _SIZE, 'base': 0, 'base_sq': 0, 'week': 0, 'prev_week': 0}
+    return series
+
+
+def _add(state, key, day, values):
+    # Rechnet (Tassen, mg) eines Eintrags in die Reihe ein; Tage außerhalb des Fensters
+    # verschieben höchstens den Beginn der Historie
+    series = state['series'].get(key)
+    if series is None:
+        series = state['series'][key] = _new_series(day)
+    elif day < series['first_day']:
+        series['first_day'] = day
+    age = (state['day'] - day).days
+    if age < 0 or age > WINDOW_DAYS:
+        return
+    slot = day.toordinal() % _SIZE
+    for metric, value in zip(METRICS, values):
+        sums = series[metric]
+        old = sums['ring'][slot]
+        new = old + value
+        sums['ring'][slot] = new
+        if age >= 1:
+            sums['base'] += value
+            sums['base_sq'] += new * new - old * old
+        if age < WEEK_DAYS:
+            sums['week'] += value
+        elif age < 2 * WEEK_DAYS:
+            sums['prev_week'] += value
+
+
+def _advance(state, today):
+    # Schiebt das Fenster Tag für Tag bis heute weiter: der laufende Tag kommt in den
+    # Vergleichszeitraum, der älteste fällt heraus
+    days = (today - state['day']).days
+    if days <= 0:
+        return
+    if days > WINDOW_DAYS:
+        for series in state['series'].values():
+            for metric in METRICS:
+                series[metric] = {'ring': [0] * _SIZE, 'base': 0, 'base_sq': 0, 'week': 0, 'prev_week': 0}
+        state['day'] = today
+        return
+    for _ in range(days):
+        ordinal = state['day'].toordinal()
+        for series in state['series'].values():
+            for metric in METRICS:
+                sums = series[metric]
+                ring = sums['ring']
+                closed = ring[ordinal % _SIZE]
+                # Slot des ältesten Tages wird zum neuen laufenden Tag
+                dropped = ring[(ordinal + 1) % _SIZE]
+                sums['base'] += closed - dropped
+                sums['base_sq'] += closed * closed - dropped * dropped
+                # Der älteste Tag der Woche wechselt in die Vorwoche, deren ältester fällt heraus
+                last_week = ring[(ordinal - WEEK_DAYS + 1) % _SIZE]
+                sums['week'] -= last_week
+                sums['prev_week'] += last_week - ring[(ordinal - 2 * WEEK_DAYS + 1) % _SIZE]
+                ring[(ordinal + 1) % _SIZE] = 0
+        state['day'] += timedelta(days=1)
+
+
+def _fold(state, rows):
+    # (id, date, variety_id, cups, caffeine_mg) in id-Reihenfolge
+    for entry_id, day, variety_id, cups, caffeine_mg in rows:
+        state['last_id'] = max(state['last_id'], entry_id)
+        if caffeine_mg is None:
+            continue
+        day = date.fromisoformat(str(day)[:10])
+        if day > state['day']:
+            # Eintrag in der Zukunft: sobald der Tag erreicht ist, neu aufbauen
+            state['future'] = min(state['future'] or day, day)
+            continue
+        values = (cups, cups * caffeine_mg)
+        _add(state, TOTAL, day, values)
+        _add(state, variety_id, day, values)
+
+
+_ENTRIES = """
+    SELECT c.id, c.date, c.variety_id, c.cups, v.caffeine_mg
+      FROM consumption c
+      LEFT JOIN varieties v ON c.variety_id = v.id
+     WHERE {where}
+     ORDER BY c.id
+"""
+
+
+def _build(engine, today):
+    # Einträge des Fensters in einer Abfrage; ihre höchste id ist der Wasserstand für
+    # spätere Einträge. Ältere Einträge liefern nur den Beginn der Historie je Reihe.
+    state = {'day': today, 'last_id': 0, 'future': None, 'series': {}}
+    with engine.connect() as conn:
+        firsts = conn.execute(text(
+            "SELECT variety_id, MIN(date) FROM daily_rollup WHERE date <= :today GROUP BY variety_id"
+        ), {'today': today.isoformat()}).all()
+        rows = conn.execute(
+            text(_ENTRIES.format(where="c.date >= :start")),
+            {'start': (today - timedelta(days=WINDOW_DAYS)).isoformat()}
+        ).all()
+    for variety_id, first_day in firsts:
+        first_day = date.fromisoformat(str(first_day)[:10])
+        for key in (TOTAL, variety_id):
+            series = state['series'].get(key)
+            if series is None:
+                state['series'][key] = _new_series(first_day)
+            elif first_day < series['first_day']:
+                series['first_day'] = first_day
+    _fold(state, rows)
+    return state
+
+
+def reset(engine):
+    # Nach geänderten oder gelöschten Einträgen (oder Koffeinwerten): beim nächsten Zugriff neu aufbauen
+    with _lock:
+        _states.pop(str(engine.url), None)
+
+
+def refresh(engine, today=None):
+    # Rechnet neue Einträge (id über dem Wasserstand) ein und schiebt das Fenster bis heute
+    with _lock:
+        return _refresh(engine, today or date.today())
+
+
+def _refresh(engine, today):
+    key = str(engine.url)
+    state = _states.get(key)
+    if state is None or today < state['day'] or (state['future'] and state['future'] <= today):
+        state = _states[key] = _build(engine, today)
+        return state
+    _advance(state, today)
+    with engine.connect() as conn:
+        rows = conn.execute(text(_ENTRIES.format(where="c.id > :last_id")), {'last_id': state['last_id']}).all()
+    _fold(state, rows)
+    return state
+
+
+def is_anomaly(metric, value, mean, std, days):
+    return days >= MIN_BASELINE_DAYS and value > mean + ANOMALY_Z * max(std, MIN_STD[metric])
+
+
+def week_change(week, prev_week):
+    # Veränderung gegenüber der Vorwoche in Prozent, None ohne Vorwoche
+    return (week - prev_week) / prev_week * 100 if prev_week else None
+
+
+def _summarize(series, day):
+    days = min(WINDOW_DAYS, (day - series['first_day']).days)
+    result = {}
+    for metric in METRICS:
+        sums = series[metric]
+        today = sums['ring'][day.toordinal() % _SIZE]
+        mean = sums['base'] / days if days > 0 else 0.0
+        std = math.sqrt(max(sums['base_sq'] / days - mean * mean, 0.0)) if days > 0 else 0.0
+        result[metric] = {
+            'today': today,
+            'mean': mean,
+            'std': std,
+            'days': days,
+            'week': sums['week'],
+            'prev_week': sums['prev_week'],
+            'week_change': week_change(sums['week'], sums['prev_week']),
+            'anomaly': is_anomaly(metric, today, mean, std, days),
+        }
+    return result
+
+
+def summary(engine, today=None):
+    # Kennzahlen gesamt (TOTAL) und je variety_id für den heutigen Tag
+    with _lock:
+        state = _refresh(engine, today or date.today())
+        return {key: _summarize(series, state['day']) for key, series in state['series'].items()}
+
+
+def _window_before(values, window):
+    # Summe der window Werte vor jeder Position (ohne die Position selbst) über kumulierte Summen
+    cumulative = np.concatenate(([0], np.cumsum(values)))
+    positions = np.arange(len(values))
+    return cumulative[positions] - cumulative[np.maximum(positions - window, 0)]
+
+
+def baseline(frame, start=None, window=WINDOW_DAYS):
+    # Dieselben Kennzahlen für jeden Tag ab start, vektorisiert über die Einträge frame
+    # (date, cups, total_caffeine; nach Datum sortiert), z.B. als Overlay im Tagesdiagramm.
+    # Gelesen werden nur die window Tage vor start, nicht die ganze Historie.
+    if frame.empty:
+        return pd.DataFrame(columns=['date'])
+    first = frame['date'].min()
+    lead = first if start is None else max(first, pd.Timestamp(start) - pd.Timedelta(days=window))
+    if frame['date'].is_monotonic_increasing:
+        frame = frame.iloc[frame['date'].searchsorted(lead):]
+    else:
+        frame = frame[frame['date'] >= lead]
+    daily = frame.groupby('date')[['cups', 'total_caffeine']].sum()
+    if daily.empty:
+        return pd.DataFrame(columns=['date'])
+    days = pd.date_range(lead, daily.index.max(), freq='D')
+    positions = (daily.index - lead).days
+    # Vergleichszeitraum: die window Tage davor, höchstens bis zum Beginn der Historie.
+    # Für die Vorlauftage vor start reicht das Fenster nicht, sie werden unten abgeschnitten.
+    count = np.minimum(np.arange(len(days)) + (lead - first).days, window)
+    safe_count = np.maximum(count, 1)
+    columns = {'date': days}
+    for metric, source in zip(METRICS, ('cups', 'total_caffeine')):
+        values = np.zeros(len(days), dtype='int64')
+        values[positions] = daily[source].to_numpy()
+        mean = np.where(count > 0, _window_before(values, window) / safe_count, 0.0)
+        squares = np.where(count > 0, _window_before(values * values, window) / safe_count, 0.0)
+        std = np.sqrt(np.clip(squares - mean * mean, 0, None))
+        upper = mean + ANOMALY_Z * np.maximum(std, MIN_STD[metric])
+        columns[metric] = values
+        columns[f'{metric}_mean'] = mean
+        columns[f'{metric}_upper'] = upper
+        columns[f'{metric}_anomaly'] = (count >= MIN_BASELINE_DAYS) & (values > upper)
+    result = pd.DataFrame(columns)
+    if start is not None:
+        result = result.iloc[max((pd.Timestamp(start) - lead).days, 0):]
+    return result.reset_index(drop=True)
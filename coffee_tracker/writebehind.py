@@ -0,0 +1,226 @@
+import atexit
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from coffee_tracker import changelog
+from coffee_tracker.db import refresh_rollup
+
+logger = logging.getLogger(__name__)
+
+# Nach dem ersten Eintrag so lange auf weitere warten, die in dieselbe Transaktion kommen
+FLUSH_INTERVAL = 0.005
+MAX_BATCH = 1000
+RETRIES = 3
+
+# Ein Worker pro Datenbank (Schlüssel: URL)
+_workers = {}
+_workers_lock = threading.Lock()
+_tokens = itertools.count(1)
+_STOP = object()
+
+
+def start(engine, on_commit=None):
+    # Startet den Hintergrund-Thread für diese Datenbank (einmal pro Prozess).
+    # on_commit(dates) läuft nach jedem Batch im Worker-Thread, z.B. zum Leeren von Caches.
+    key = str(engine.url)
+    with _workers_lock:
+        worker = _workers.get(key)
+        if worker is not None:
+            return worker
+        pending_lock = threading.Lock()
+        worker = {
+            'engine': engine,
+            'queue': queue.Queue(),
+            'on_commit': on_commit,
+            # Session -> {token: eintrag}, bis der Eintrag committet ist
+            'pending': {},
+            'failed': {},
+            'changed': threading.Condition(pending_lock),
+            # Hält der Worker von Commit bis Cache-Invalidierung; Leser siehe read_with_pending()
+            'commit_lock': threading.RLock(),
+        }
+        worker['thread'] = threading.Thread(
+            target=_run, args=(worker,), name=f"writebehind-{engine.url.database}", daemon=True
+        )
+        worker['thread'].start()
+        if not _workers:
+            atexit.register(stop_all)
+        _workers[key] = worker
+        return worker
+
+
+def _worker(engine):
+    worker = _workers.get(str(engine.url))
+    if worker is None:
+        raise RuntimeError("Write-behind-Worker nicht gestartet - erst start(engine) aufrufen")
+    return worker
+
+
+def submit(engine, session, day, cups, variety_id, caffeine_mg=0, consumed_at=None):
+    # Reiht einen Eintrag ein und kehrt sofort zurück; bis zum Commit ist er über
+    # pending() für die eigene Session sichtbar
+    worker = _worker(engine)
+    entry = {
+        'token': next(_tokens),
+        'session': session,
+        'date': day,
+        'cups': int(cups),
+        'variety_id': int(variety_id),
+        'caffeine_mg': int(caffeine_mg),
+        'consumed_at': consumed_at,
+    }
+    with worker['changed']:
+        worker['pending'].setdefault(session, {})[entry['token']] = entry
+    worker['queue'].put(entry)
+    return entry['token']
+
+
+def pending(engine, session):
+    worker = _worker(engine)
+    with worker['changed']:
+        return list(worker['pending'].get(session, {}).values())
+
+
+def pop_failed(engine, session):
+    # Einträge, die auch nach mehreren Versuchen nicht gespeichert werden konnten
+    worker = _worker(engine)
+    with worker['changed']:
+        return worker['failed'].pop(session, [])
+
+
+def read_with_pending(engine, session, read):
+    # Liest z.B. gecachte Kennzahlen zusammen mit den offenen Einträgen der Session.
+    # Unter der Commit-Sperre enthält das Ergebnis jeden Eintrag genau einmal:
+    # entweder noch offen oder schon in der Datenbank und im neu geladenen Cache.
+    worker = _worker(engine)
+    with worker['commit_lock']:
+        return read(), pending(engine, session)
+
+
+def with_pending(header, entries, today):
+    # Ergänzt die Header-Kennzahlen (Grenzen wie in db.read_header_metrics) um offene Einträge
+    header = dict(header)
+    week_ago = today - timedelta(days=7)
+    prev_week_ago = week_ago - timedelta(days=8)
+    month_ago = today - timedelta(days=30)
+    for entry in entries:
+        caffeine = entry['cups'] * entry['caffeine_mg']
+        day = entry['date']
+        for prefix, included in (
+            ('today', day == today), ('week', day >= week_ago), ('prev_week', prev_week_ago <= day < week_ago),
+            ('month', day >= month_ago), ('total', True)
+        ):
+            if included:
+                header[f'{prefix}_cups'] += entry['cups']
+                header[f'{prefix}_caffeine'] += caffeine
+    return header
+
+
+def wait(engine, session=None, timeout=1.0):
+    # Wartet, bis die offenen Einträge der Session (oder alle) committet sind
+    worker = _worker(engine)
+
+    def done():
+        if session is None:
+            return not any(worker['pending'].values())
+        return not worker['pending'].get(session)
+
+    with worker['changed']:
+        return worker['changed'].wait_for(done, timeout)
+
+
+def flush(engine, timeout=None):
+    return wait(engine, None, timeout)
+
+
+def stop(engine, timeout=10.0):
+    # Leert die Warteschlange und beendet den Worker
+    with _workers_lock:
+        worker = _workers.pop(str(engine.url), None)
+    if worker is not None:
+        worker['queue'].put(_STOP)
+        worker['thread'].join(timeout)
+
+
+def stop_all():
+    for worker in list(_workers.values()):
+        stop(worker['engine'])
+
+
+def _run(worker):
+    q = worker['queue']
+    while True:
+        entry = q.get()
+        if entry is _STOP:
+            return
+        batch = [entry]
+        stopping = False
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < MAX_BATCH:
+            try:
+                entry = q.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                stopping = True
+                break
+            batch.append(entry)
+        _commit(worker, batch)
+        if stopping:
+            return
+
+
+def _commit(worker, batch):
+    engine = worker['engine']
+    dates = sorted({entry['date'] for entry in batch})
+    rows = [
+        (entry['date'].isoformat(), entry['cups'], entry['variety_id'], _timestamp(entry['consumed_at']))
+        for entry in batch
+    ]
+    error = None
+    with worker['commit_lock']:
+        for attempt in range(RETRIES):
+            try:
+                with engine.begin() as conn:
+                    after = changelog.last_id(conn, 'consumption')
+                    conn.exec_driver_sql(
+                        "INSERT INTO consumption (date, cups, variety_id, consumed_at) VALUES (?, ?, ?, ?)", rows
+                    )
+                    changelog.record(conn, 'consumption', after_id=after)
+                    refresh_rollup(conn, dates=dates)
+                error = None
+                break
+            except Exception as exc:
+                error = exc
+                logger.warning("Batch mit %d Einträgen fehlgeschlagen (Versuch %d): %s", len(batch), attempt + 1, exc)
+                time.sleep(0.05 * 2 ** attempt)
+
+        if error is None and worker['on_commit'] is not None:
+            try:
+                worker['on_commit'](dates)
+            except Exception:
+                logger.exception("on_commit nach Write-behind-Batch fehlgeschlagen")
+
+        with worker['changed']:
+            for entry in batch:
+                entries = worker['pending'].get(entry['session'], {})
+                entries.pop(entry['token'], None)
+                if not entries:
+                    worker['pending'].pop(entry['session'], None)
+                if error is not None:
+                    worker['failed'].setdefault(entry['session'], []).append(entry)
+            worker['changed'].notify_all()
+
+    if error is None:
+        logger.debug("%d Einträge in einer Transaktion gespeichert", len(batch))
+    else:
+        logger.error("%d Einträge konnten nicht gespeichert werden: %s", len(batch), error)
+
+
+def _timestamp(value):
+    # Gleiches Format wie SQLAlchemys DateTime unter SQLite
+    return None if value is None else value.isoformat(sep=' ', timespec='microseconds')
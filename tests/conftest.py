@@ -0,0 +1,25 @@
+import pytest
+
+from coffee_tracker import db
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    # Schreib-Engine auf einer Datenbankdatei im Testverzeichnis, ohne Checkpoint-Thread;
+    # mehrere Namen ergeben getrennte Datenbanken (z.B. zwei Geräte beim Sync)
+    engines = []
+
+    def make(name='coffee', **storage):
+        storage.setdefault('checkpoint_seconds', None)
+        engine = db.create_db_engine(f'sqlite:///{tmp_path / name}.db', **storage)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        db.dispose_engine(engine)
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
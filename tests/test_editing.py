@@ -0,0 +1,77 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+from coffee_tracker import db
+from coffee_tracker.db import consumption, daily_rollup, varieties
+from coffee_tracker.editing import apply_changes, diff_entries
+
+VARIETY_IDS = {'Espresso': 1, 'Latte': 2}
+
+
+@pytest.fixture
+def engine(make_engine):
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(varieties.insert(), [
+            {'id': 1, 'name': 'Espresso', 'caffeine_mg': 80},
+            {'id': 2, 'name': 'Latte', 'caffeine_mg': 60},
+        ])
+        conn.execute(consumption.insert(), [
+            {'id': 1, 'date': date(2026, 10, 1), 'cups': 2, 'variety_id': 1},
+            {'id': 2, 'date': date(2026, 10, 2), 'cups': 1, 'variety_id': 2},
+        ])
+        db.refresh_rollup(conn)
+    return engine
+
+
+def page():
+    return pd.DataFrame({
+        'id': [1, 2],
+        'date': pd.to_datetime(['2026-10-01', '2026-10-02']),
+        'cups': [2, 1],
+        'variety': ['Espresso', 'Latte'],
+    })
+
+
+def test_unchanged_page_has_no_changes():
+    changes = diff_entries(page(), page(), VARIETY_IDS)
+    assert changes['updated'].empty
+    assert changes['inserted'].empty
+    assert len(changes['deleted']) == 0
+    assert changes['incomplete'] == []
+
+
+@pytest.mark.parametrize('column, empty', [('cups', np.nan), ('variety', None), ('date', pd.NaT)])
+def test_cleared_cell_is_reported_not_updated(engine, column, empty):
+    edited = page()
+    edited.loc[0, column] = empty
+    edited.loc[1, 'cups'] = 3
+    changes = diff_entries(page(), edited, VARIETY_IDS)
+    assert changes['incomplete'] == [1]
+    assert list(changes['updated'].index) == [2]
+
+    # Auch direkt übernommen schreibt die unvollständige Zeile nichts und wirft keinen Fehler
+    with engine.begin() as conn:
+        assert apply_changes(conn, changes) == {'inserted': 0, 'updated': 1, 'deleted': 0}
+    with engine.connect() as conn:
+        rows = conn.execute(select(consumption.c.id, consumption.c.date, consumption.c.cups,
+                                   consumption.c.variety_id).order_by(consumption.c.id)).all()
+        rollup = conn.execute(select(daily_rollup.c.date, daily_rollup.c.cups).order_by(daily_rollup.c.date)).all()
+    assert [tuple(row) for row in rows] == [(1, date(2026, 10, 1), 2, 1), (2, date(2026, 10, 2), 3, 2)]
+    assert [tuple(row) for row in rollup] == [(date(2026, 10, 1), 2), (date(2026, 10, 2), 3)]
+
+
+def test_incomplete_new_rows_are_ignored():
+    edited = pd.concat([page(), pd.DataFrame({
+        'id': [np.nan, np.nan],
+        'date': pd.to_datetime(['2026-10-03', None]),
+        'cups': [1, 1],
+        'variety': ['Espresso', 'Latte'],
+    })], ignore_index=True)
+    changes = diff_entries(page(), edited, VARIETY_IDS)
+    assert len(changes['inserted']) == 1
+    assert changes['incomplete'] == []
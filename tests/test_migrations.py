@@ -0,0 +1,68 @@
+import sqlite3
+
+from sqlalchemy import create_engine, text
+
+from coffee_tracker import db, migrations
+
+
+def test_database_from_before_the_rollup_is_migrated(tmp_path, make_engine):
+    # Stand vor Migration 4: nur Einträge und Sorten, noch ohne caffeine_mg
+    path = tmp_path / 'coffee.db'
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE consumption (id INTEGER PRIMARY KEY, date DATE NOT NULL, cups INTEGER NOT NULL,
+                                  variety_id INTEGER NOT NULL);
+        CREATE TABLE varieties (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE);
+        INSERT INTO varieties VALUES (1, 'Espresso'), (2, 'Latte');
+        INSERT INTO consumption VALUES (1, '2026-10-01', 2, 1), (2, '2026-10-01', 1, 2), (3, '2026-10-02', 1, 1);
+    """)
+    conn.close()
+
+    engine = make_engine()
+    with engine.begin() as conn:
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+        rollup = conn.execute(text("SELECT date, variety_id, cups, caffeine FROM daily_rollup ORDER BY 1, 2")).all()
+        assert [tuple(row) for row in rollup] == [('2026-10-01', 1, 2, 0), ('2026-10-01', 2, 1, 0), ('2026-10-02', 1, 1, 0)]
+        assert conn.execute(text("SELECT COUNT(*) FROM consumption_archive")).scalar() == 0
+        # Die feste Befüllung aus Schritt 4 entspricht dem heutigen refresh_rollup
+        db.refresh_rollup(conn)
+        assert conn.execute(text("SELECT date, variety_id, cups, caffeine FROM daily_rollup ORDER BY 1, 2")).all() == rollup
+
+
+def _schema(conn):
+    # Spalten (Name, Typ, NOT NULL, Primärschlüssel) und Indizes je Tabelle; Primärschlüssel
+    # zählen als NOT NULL, ob explizit angegeben oder nicht
+    tables = [row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))]
+    return {
+        table: (
+            sorted((row[1], row[2], bool(row[3] or row[5]), row[5]) for row in conn.execute(text(f"PRAGMA table_info({table})"))),
+            sorted((row[1], row[2]) for row in conn.execute(text(f"PRAGMA index_list({table})"))),
+        )
+        for table in tables if table != 'sqlite_sequence'
+    }
+
+
+def test_migrated_schema_matches_the_model(tmp_path, make_engine):
+    # Die festen SQL-Schritte ergeben dasselbe Schema wie das aktuelle Modell
+    engine = make_engine('migrated')
+    reference = create_engine(f'sqlite:///{tmp_path / "model.db"}')
+    try:
+        db.metadata.create_all(reference)
+        migrations.version_metadata.create_all(reference)
+        with engine.connect() as migrated, reference.connect() as fresh:
+            assert _schema(migrated) == _schema(fresh)
+    finally:
+        reference.dispose()
+
+
+def test_recreated_database_is_migrated_again(tmp_path, make_engine):
+    engine = make_engine()
+    assert migrations.migrate(engine) == []
+    db.dispose_engine(engine)
+    # Dieselbe URL, aber eine neue, leere Datei
+    for path in tmp_path.glob('coffee.db*'):
+        path.unlink()
+    engine = make_engine()
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+        assert conn.execute(text("SELECT COUNT(*) FROM daily_rollup")).scalar() == 0
@@ -0,0 +1,102 @@
+import threading
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from coffee_tracker import db
+from coffee_tracker.db import consumption, varieties
+
+READERS = 4
+DAY = date(2026, 1, 1)
+# Werte von PRAGMA synchronous
+SYNCHRONOUS = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}
+
+
+@pytest.fixture
+def engine(make_engine):
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(varieties.insert().values(id=1, name='Sorte 1', caffeine_mg=80))
+        conn.execute(consumption.insert().values(date=DAY, cups=1, variety_id=1))
+        db.refresh_rollup(conn, dates=[DAY])
+    return engine
+
+
+def _pragma(engine, name):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_writer_and_readers_use_the_storage_defaults(engine):
+    read_engine = db.reader(engine)
+    assert read_engine is not engine
+    for current in (engine, read_engine):
+        assert _pragma(current, 'journal_mode') == db.STORAGE_DEFAULTS['journal_mode'].lower()
+        assert _pragma(current, 'synchronous') == SYNCHRONOUS[db.STORAGE_DEFAULTS['synchronous']]
+        assert _pragma(current, 'busy_timeout') == db.STORAGE_DEFAULTS['busy_timeout_ms']
+    assert _pragma(engine, 'query_only') == 0
+    assert _pragma(read_engine, 'query_only') == 1
+
+
+def test_storage_options_override_the_defaults(make_engine):
+    engine = make_engine(synchronous='FULL', busy_timeout_ms=250)
+    assert _pragma(engine, 'synchronous') == SYNCHRONOUS['FULL']
+    assert _pragma(db.reader(engine), 'busy_timeout') == 250
+    with pytest.raises(ValueError):
+        make_engine(wal=True)
+
+
+def test_readers_reject_writes(engine):
+    with pytest.raises(OperationalError, match="readonly"):
+        with db.reader(engine).begin() as conn:
+            conn.execute(consumption.insert().values(date=date(2026, 1, 2), cups=1, variety_id=1))
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM consumption")).scalar() == 1
+
+
+def test_readers_are_not_blocked_by_an_open_write_transaction(engine):
+    read_engine = db.reader(engine)
+    errors = []
+    seen = []
+    reading = threading.Barrier(READERS + 1)
+    committed = threading.Event()
+
+    def count(conn):
+        return conn.exec_driver_sql("SELECT COUNT(*) FROM consumption").scalar()
+
+    def reader():
+        try:
+            seen.append(db.read_header_metrics(read_engine, DAY)['total_cups'])
+            with read_engine.connect() as conn:
+                # Offene Lesetransaktion über den Commit des Schreibers hinweg
+                conn.exec_driver_sql("BEGIN")
+                seen.append(count(conn))
+                reading.wait()
+                committed.wait()
+                seen.append(count(conn))
+                conn.exec_driver_sql("COMMIT")
+                assert count(conn) == 2
+        except Exception as exc:
+            errors.append(exc)
+            reading.abort()
+
+    threads = [threading.Thread(target=reader) for _ in range(READERS)]
+    try:
+        with engine.begin() as conn:
+            # Die Leser starten, während der Schreiber die Sperre hält, und sehen den Stand davor
+            conn.execute(consumption.insert().values(date=DAY, cups=2, variety_id=1))
+            db.refresh_rollup(conn, dates=[DAY])
+            for thread in threads:
+                thread.start()
+            reading.wait()
+        # Ohne WAL wartete der Commit auf die Leser und endete mit "database is locked"
+    finally:
+        committed.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    assert seen == [1] * (3 * READERS)
+    assert db.read_header_metrics(read_engine, DAY)['total_cups'] == 3
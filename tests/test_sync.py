@@ -0,0 +1,167 @@
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from benchmarks import sync_server
+from coffee_tracker import changelog, db, editing, retention, sync
+from coffee_tracker.db import consumption, varieties
+
+# Kleine Blöcke, damit auch das Blättern über mehrere Anfragen geprüft wird
+BATCH_SIZE = 7
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(sync, 'RETRY_DELAY', 0.001)
+    server = sync_server.serve(fail_rate=0.3, seed=11)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def devices(make_engine):
+    return [make_engine(name) for name in ('a', 'b')]
+
+
+def add_variety(engine, name, caffeine_mg):
+    with engine.begin() as conn:
+        result = conn.execute(varieties.insert().values(name=name, caffeine_mg=caffeine_mg))
+        changelog.record(conn, 'varieties', result.inserted_primary_key)
+
+
+def set_caffeine(engine, name, caffeine_mg):
+    with engine.begin() as conn:
+        variety_id = conn.execute(text("SELECT id FROM varieties WHERE name = :name"), {'name': name}).scalar()
+        conn.execute(varieties.update().where(varieties.c.id == variety_id).values(caffeine_mg=caffeine_mg))
+        changelog.record(conn, 'varieties', [variety_id])
+        db.refresh_rollup(conn, variety_ids=[variety_id])
+
+
+def add_entries(engine, entries):
+    # (Tag, Tassen, Sorte, Uhrzeit) wie das Formular: Eintrag und changelog in einer Transaktion
+    with engine.begin() as conn:
+        ids = dict(conn.execute(text("SELECT name, id FROM varieties")).all())
+        for day, cups, variety, consumed_at in entries:
+            result = conn.execute(consumption.insert().values(
+                date=day, cups=cups, variety_id=ids[variety], consumed_at=consumed_at
+            ))
+            changelog.record(conn, 'consumption', result.inserted_primary_key)
+        db.refresh_rollup(conn, dates=[day for day, *_ in entries])
+
+
+def edit(engine, change):
+    # Wie der Editor: change(frame) bearbeitet eine Kopie aller Einträge
+    with engine.connect() as conn:
+        original = pd.read_sql(text("""
+            SELECT c.id, c.date, c.cups, v.name AS variety
+              FROM consumption c JOIN varieties v ON c.variety_id = v.id
+             ORDER BY c.date, c.id
+        """), conn, parse_dates=['date'])
+        ids = dict(conn.execute(text("SELECT name, id FROM varieties")).all())
+    changes = editing.diff_entries(original, change(original.copy()), ids)
+    with engine.begin() as conn:
+        editing.apply_changes(conn, changes)
+
+
+def sync_until_converged(engines, url, rounds=20):
+    # Wie der Hintergrund-Thread: Fehlschläge nach allen Wiederholungen holt die nächste Runde nach
+    for _ in range(rounds):
+        moved = 0
+        for engine in engines:
+            try:
+                moved += sync.push(engine, url, batch_size=BATCH_SIZE)
+                moved += sync.pull(engine, url, batch_size=BATCH_SIZE)
+            except RuntimeError:
+                moved += 1
+        if moved == 0:
+            return
+    raise AssertionError("Geräte haben sich nicht angeglichen")
+
+
+def state(engine):
+    with engine.connect() as conn:
+        entries = conn.execute(text("""
+            SELECT c.date, c.cups, v.name, c.consumed_at
+              FROM consumption c JOIN varieties v ON c.variety_id = v.id
+             ORDER BY 1, 2, 3, 4
+        """)).all()
+        kinds = conn.execute(text("SELECT name, caffeine_mg FROM varieties ORDER BY name")).all()
+        rollup = conn.execute(text("""
+            SELECT r.date, v.name, r.cups, r.caffeine
+              FROM daily_rollup r JOIN varieties v ON r.variety_id = v.id
+             ORDER BY 1, 2
+        """)).all()
+        unsent = changelog.pending(conn)
+    return {'entries': entries, 'varieties': kinds, 'rollup': rollup, 'unsent': unsent}
+
+
+def test_two_devices_converge_despite_failing_server(devices, server):
+    a, b = devices
+    url = f"http://127.0.0.1:{server.server_port}"
+    start = date(2026, 9, 1)
+    add_variety(a, 'Espresso', 80)
+    add_variety(a, 'Filter', 95)
+    add_entries(a, [
+        (start + timedelta(days=i % 12), 1 + i % 3, ('Espresso', 'Filter')[i % 2], datetime(2026, 9, 1, 7, i))
+        for i in range(30)
+    ])
+    # Gleiche Sortennamen, aber andere ids und eine zusätzliche Sorte auf dem zweiten Gerät
+    add_variety(b, 'Latte', 60)
+    add_variety(b, 'Espresso', 80)
+    add_entries(b, [
+        (start + timedelta(days=i), 2, ('Latte', 'Espresso')[i % 2], datetime(2026, 9, 1, 9, i))
+        for i in range(10)
+    ])
+    sync_until_converged(devices, url)
+    assert state(a) == state(b)
+    assert len(state(a)['entries']) == 40
+    assert state(a)['unsent'] == 0
+
+    # Änderungen auf beiden Seiten, auch an Einträgen des jeweils anderen Geräts
+    def edit_on_a(frame):
+        frame.loc[frame['variety'] == 'Latte', 'cups'] = 5
+        frame.loc[0, 'variety'] = 'Latte'
+        return frame.drop(index=[1, 2])
+
+    def edit_on_b(frame):
+        frame.loc[frame['variety'] == 'Filter', 'date'] += pd.Timedelta(days=1)
+        return frame.drop(index=[len(frame) - 1])
+
+    edit(a, edit_on_a)
+    edit(b, edit_on_b)
+    set_caffeine(b, 'Espresso', 90)
+    add_entries(b, [(start + timedelta(days=20), 1, 'Filter', None)])
+    sync_until_converged(devices, url)
+
+    final = state(a)
+    assert final == state(b)
+    assert final['unsent'] == 0
+    assert ('Espresso', 90) in final['varieties']
+    assert len(final['entries']) == 40 - 3 + 1
+    assert sum(cups for _, _, cups, _ in final['rollup']) == sum(cups for _, cups, _, _ in final['entries'])
+    assert server.store['failures'] > 0
+
+
+def test_changes_to_entries_archived_here_are_not_counted_twice(devices, server):
+    a, b = devices
+    url = f"http://127.0.0.1:{server.server_port}"
+    old_day = date.today() - timedelta(days=400)
+    add_variety(a, 'Espresso', 80)
+    add_entries(a, [(old_day, 2, 'Espresso', None), (date.today(), 1, 'Espresso', None)])
+    sync_until_converged(devices, url)
+
+    retention.archive_entries(b, keep_days=365)
+    edit(a, lambda frame: frame.assign(cups=3))
+    sync_until_converged(devices, url)
+
+    with b.connect() as conn:
+        hot = conn.execute(text("SELECT COUNT(*) FROM consumption WHERE date = :day"), {'day': old_day}).scalar()
+        rollup = conn.execute(text("SELECT cups FROM daily_rollup WHERE date = :day"), {'day': old_day}).all()
+        today = conn.execute(text("SELECT cups FROM consumption WHERE date = :day"), {'day': date.today()}).all()
+    # Der archivierte Tag bleibt beim archivierten Stand, neuere Einträge werden weiter übernommen
+    assert hot == 0
+    assert [tuple(row) for row in rollup] == [(2,)]
+    assert [tuple(row) for row in today] == [(3,)]
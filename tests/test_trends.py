@@ -0,0 +1,112 @@
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from coffee_tracker import db, trends
+from coffee_tracker.db import consumption, varieties
+
+CAFFEINE_MG = {1: 80, 2: 60}
+START = date(2026, 1, 1)
+# Abstände zwischen den Aufrufen von summary(): einzelne Tage, kurze Lücken und eine Lücke
+# über das ganze Fenster hinaus
+STEPS = [0, 1, 1, 2, 1, 5, 1, 1, 3, 1, trends.WINDOW_DAYS + 6, 1, 1, 2, 9, 1, 1, 1, 4, 1]
+
+
+@pytest.fixture
+def engine(make_engine):
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(varieties.insert(), [
+            {'id': variety_id, 'name': f'Sorte {variety_id}', 'caffeine_mg': mg} for variety_id, mg in CAFFEINE_MG.items()
+        ])
+    return engine
+
+
+def add_entries(engine, entries):
+    with engine.begin() as conn:
+        conn.execute(consumption.insert(), [
+            {'date': day, 'cups': cups, 'variety_id': variety_id} for day, cups, variety_id in entries
+        ])
+        db.refresh_rollup(conn, dates=[day for day, _, _ in entries])
+
+
+def expected(entries, key, today):
+    # Kennzahlen direkt aus allen Einträgen bis heute: Fenster der WINDOW_DAYS Tage davor,
+    # Woche und Vorwoche wie die Kacheln
+    rows = [(day, cups, cups * CAFFEINE_MG[variety_id]) for day, cups, variety_id in entries
+            if day <= today and key in (trends.TOTAL, variety_id)]
+    if not rows:
+        return None
+    days = min(trends.WINDOW_DAYS, (today - min(day for day, _, _ in rows)).days)
+    result = {}
+    for index, metric in enumerate(trends.METRICS, start=1):
+        daily = {}
+        for row in rows:
+            daily[row[0]] = daily.get(row[0], 0) + row[index]
+
+        def total(first_age, last_age):
+            return sum(daily.get(today - timedelta(days=age), 0) for age in range(first_age, last_age + 1))
+
+        window = [daily.get(today - timedelta(days=age), 0) for age in range(1, trends.WINDOW_DAYS + 1)]
+        mean = sum(window) / days if days else 0.0
+        std = (max(sum(v * v for v in window) / days - mean * mean, 0.0)) ** 0.5 if days else 0.0
+        result[metric] = {
+            'today': daily.get(today, 0),
+            'mean': pytest.approx(mean),
+            'std': pytest.approx(std),
+            'days': days,
+            'week': total(0, trends.WEEK_DAYS - 1),
+            'prev_week': total(trends.WEEK_DAYS, 2 * trends.WEEK_DAYS - 1),
+        }
+    return result
+
+
+def test_incremental_summary_matches_a_full_recount(engine):
+    read_engine = db.reader(engine)
+    rng = random.Random(7)
+    entries = []
+    today = START
+    for step in STEPS:
+        today += timedelta(days=step)
+        new = [(today, rng.randint(1, 3), rng.choice(list(CAFFEINE_MG))) for _ in range(rng.randint(1, 4))]
+        # Nachgetragene Einträge: im Fenster, davor und (noch nicht zählend) in der Zukunft
+        new.append((today - timedelta(days=rng.randint(1, trends.WINDOW_DAYS)), rng.randint(1, 3), 1))
+        if rng.random() < 0.3:
+            new.append((today - timedelta(days=rng.randint(trends.WINDOW_DAYS + 1, 60)), 1, 2))
+        if rng.random() < 0.3:
+            new.append((today + timedelta(days=rng.randint(1, 3)), 2, 2))
+        add_entries(engine, new)
+        entries += new
+
+        summary = trends.summary(read_engine, today)
+        for key in (trends.TOTAL, *CAFFEINE_MG):
+            want = expected(entries, key, today)
+            if want is None:
+                assert key not in summary
+                continue
+            for metric in trends.METRICS:
+                got = summary[key][metric]
+                assert {name: got[name] for name in want[metric]} == want[metric], (today, key, metric)
+                assert got['anomaly'] == trends.is_anomaly(metric, got['today'], got['mean'], got['std'], got['days'])
+
+        # Gesamtreihe wie baseline() für heute
+        frame = pd.DataFrame(
+            [(pd.Timestamp(day), cups, cups * CAFFEINE_MG[variety_id]) for day, cups, variety_id in sorted(entries)
+             if day <= today],
+            columns=['date', 'cups', 'total_caffeine']
+        )
+        row = trends.baseline(frame, start=today).iloc[-1]
+        assert row['date'] == pd.Timestamp(today)
+        for metric in trends.METRICS:
+            total = summary[trends.TOTAL][metric]
+            assert row[metric] == total['today']
+            assert row[f'{metric}_mean'] == pytest.approx(total['mean'])
+            upper = total['mean'] + trends.ANOMALY_Z * max(total['std'], trends.MIN_STD[metric])
+            assert row[f'{metric}_upper'] == pytest.approx(upper)
+            assert row[f'{metric}_anomaly'] == total['anomaly']
+
+    # Der über alle Schritte fortgeschriebene Stand entspricht einem Neuaufbau
+    trends.reset(read_engine)
+    assert trends.summary(read_engine, today) == summary
@@ -0,0 +1,139 @@
+import random
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from coffee_tracker import db, writebehind
+from coffee_tracker.db import varieties
+
+SESSIONS = 4
+ENTRIES = 40
+READERS = 2
+CAFFEINE_MG = {1: 80, 2: 60}
+
+
+@pytest.fixture
+def engine(make_engine):
+    engine = make_engine()
+    with engine.begin() as conn:
+        conn.execute(varieties.insert(), [
+            {'id': variety_id, 'name': f'Sorte {variety_id}', 'caffeine_mg': mg} for variety_id, mg in CAFFEINE_MG.items()
+        ])
+    yield engine
+    writebehind.stop(engine)
+
+
+def _marker(consumed_at):
+    # consumed_at ist je Eintrag eindeutig und steht so in der Datenbank
+    return consumed_at.isoformat(sep=' ', timespec='microseconds')
+
+
+def _expected(rows, today):
+    # Header-Kennzahlen direkt aus (Datum, Tassen, mg) mit den Grenzen der Kacheln
+    windows = {
+        'today': lambda day: day == today,
+        'week': lambda day: day >= today - timedelta(days=7),
+        'prev_week': lambda day: today - timedelta(days=15) <= day < today - timedelta(days=7),
+        'month': lambda day: day >= today - timedelta(days=30),
+        'total': lambda day: True,
+    }
+    header = {}
+    for prefix, included in windows.items():
+        header[f'{prefix}_cups'] = sum(cups for day, cups, _ in rows if included(day))
+        header[f'{prefix}_caffeine'] = sum(cups * mg for day, cups, mg in rows if included(day))
+    return header
+
+
+def test_concurrent_sessions_see_every_entry_exactly_once(engine):
+    read_engine = db.reader(engine)
+    today = date.today()
+    # Wie st.cache_data in der App: gecachter Header, den jeder Commit verwirft
+    cache = {}
+    cache_lock = threading.Lock()
+
+    def on_commit(dates):
+        with cache_lock:
+            cache.clear()
+
+    def cached_header():
+        with cache_lock:
+            if 'header' not in cache:
+                cache['header'] = db.read_header_metrics(read_engine, today)
+            return cache['header']
+
+    def committed():
+        with read_engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT c.consumed_at, c.date, c.cups, v.caffeine_mg
+                  FROM consumption c JOIN varieties v ON c.variety_id = v.id
+            """)).all()
+
+    writebehind.start(engine, on_commit=on_commit)
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def session(number):
+        rng = random.Random(number)
+        session_token = f'session-{number}'
+        submitted = {}
+        try:
+            for i in range(ENTRIES):
+                consumed_at = datetime(2026, 1, 1) + timedelta(seconds=number, microseconds=i)
+                day = today - timedelta(days=rng.choice([0, 0, 3, 7, 8, 12, 15, 16, 29, 31]))
+                cups = rng.randint(1, 3)
+                variety_id = rng.choice(list(CAFFEINE_MG))
+                writebehind.submit(engine, session_token, day, cups, variety_id, CAFFEINE_MG[variety_id], consumed_at)
+                submitted[_marker(consumed_at)] = cups
+
+                (header, rows), pending = writebehind.read_with_pending(
+                    engine, session_token, lambda: (cached_header(), committed())
+                )
+                in_db = {str(row[0]) for row in rows} & set(submitted)
+                waiting = {_marker(entry['consumed_at']) for entry in pending}
+                assert not in_db & waiting, "Eintrag gleichzeitig offen und gespeichert"
+                assert in_db | waiting == set(submitted), "Eintrag verloren"
+                shown = writebehind.with_pending(header, pending, today)
+                all_rows = [(date.fromisoformat(str(row[1])), row[2], row[3]) for row in rows]
+                all_rows += [(entry['date'], entry['cups'], entry['caffeine_mg']) for entry in pending]
+                assert shown == _expected(all_rows, today)
+        except Exception as exc:
+            errors.append(exc)
+
+    def reader():
+        # Reine Leser über den Reader-Pool: die Summe wächst nur, nie halb geschriebene Batches
+        last = 0
+        try:
+            while writing.is_set():
+                total = db.read_header_metrics(read_engine, today)['total_cups']
+                with read_engine.connect() as conn:
+                    count = conn.execute(text("SELECT COUNT(*) FROM consumption")).scalar()
+                assert total >= last
+                assert count <= SESSIONS * ENTRIES
+                last = total
+        except Exception as exc:
+            errors.append(exc)
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    sessions = [threading.Thread(target=session, args=(number,)) for number in range(SESSIONS)]
+    for thread in readers + sessions:
+        thread.start()
+    for thread in sessions:
+        thread.join()
+    assert writebehind.flush(engine, timeout=10)
+    writing.clear()
+    for thread in readers:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    rows = committed()
+    assert len(rows) == SESSIONS * ENTRIES
+    assert len({row[0] for row in rows}) == SESSIONS * ENTRIES
+    expected = _expected([(date.fromisoformat(str(row[1])), row[2], row[3]) for row in rows], today)
+    assert db.read_header_metrics(read_engine, today) == expected
+    for session_token in (f'session-{number}' for number in range(SESSIONS)):
+        assert writebehind.pending(engine, session_token) == []
+        assert writebehind.pop_failed(engine, session_token) == []